@@ -0,0 +1,60 @@
+import json
+import logging
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Body, HTTPException
+from pydantic import BaseModel, Field
+from starlette.responses import StreamingResponse
+
+from llm.gemini import chat_service
+
+chat_route = APIRouter(prefix="/api/chat")
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRequest(BaseModel):
+    prompt: str = Field(..., min_length=1, description="用户输入的提示词")
+
+
+class ChatResponse(BaseModel):
+    text: str = Field(..., description="完整的回复")
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    # 片段可能包含换行，统一编码为一行 JSON
+    lines = f"event: {event}\n" if event else ""
+    return lines + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(prompt: str) -> AsyncIterator[str]:
+    # 响应头已经发出，生成过程中的错误作为 error 事件发送
+    try:
+        async for chunk in chat_service.stream(prompt):
+            yield sse_event({"text": chunk})
+        yield sse_event({}, "done")
+    except Exception as e:
+        logger.exception("Chat stream failed")
+        yield sse_event({"detail": f"An error occurred: {str(e)}"}, "error")
+
+
+@chat_route.post("/stream")
+async def chat_stream(request: ChatRequest = Body(...)):
+    # 以 Server-Sent Events 逐段转发生成的文本，结束时发送 done 事件
+    headers = {
+        "Cache-Control": "no-cache",
+        # 关闭反向代理缓冲，片段到达后立即发给客户端
+        "X-Accel-Buffering": "no",
+        "X-Cache": "HIT" if chat_service.cached(request.prompt) is not None else "MISS",
+    }
+    return StreamingResponse(sse_stream(request.prompt), media_type="text/event-stream", headers=headers)
+
+
+@chat_route.post("", response_model=ChatResponse)
+async def chat(request: ChatRequest = Body(...)):
+    try:
+        return ChatResponse(text=await chat_service.complete(request.prompt))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
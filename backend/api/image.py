@@ -1,232 +1,362 @@
 import io
+import asyncio
+import json
+import logging
 import os
+import re
 import shutil
 import tempfile
-import zipfile
 from enum import Enum
-from typing import List
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import urlparse
 
-import replicate
-from PIL import ImageDraw, ImageFont, Image
+from PIL import Image
 from dotenv import load_dotenv
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Body
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Body, Depends, Request, Response
 from pydantic import BaseModel, Field
-from rembg import remove
+from rembg import new_session, remove
 from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import FileResponse, StreamingResponse
 
+from core.cache import content_digest, result_cache, upload_digest
+from core.encoding import (EncodeOptions, EncoderSpeed, ImageFormat, SPEED_SETTINGS, encode_image, encode_image_to,
+                           open_image, parse_format, prepare_image)
+from core.executor import pool
+from core.jobs import JobContext, jobs
+from core.memo import AsyncMemo
+from core.metrics import record_pages, stage
+from core.mosaic import JoinDirection, join_to_image, join_to_png
+from core.uploads import read_upload
+from core.watermark import WatermarkPosition, apply_watermark
+from core.zipstream import prefetch, zip_response
+from llm.replicate_client import FileInput, ReplicateError, ReplicateTimeout, replicate_client, verify_webhook
+
 image_route = APIRouter(prefix="/api/image")
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# rembg 模型，每个 worker 进程常驻一个 session
+REMBG_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+# 批量抠图时一个进程池任务处理的图片数
+REMBG_BATCH_SIZE = int(os.getenv('REMBG_BATCH_SIZE', 4))
+# worker 启动时预加载模型，避免第一个请求承担数秒的冷启动
+REMBG_PRELOAD = os.getenv('REMBG_PRELOAD', 'true').lower() == 'true'
+# 相同的生成请求在 GENERATE_CACHE_TTL 秒内直接返回上次的结果，最多缓存 GENERATE_CACHE_SIZE 个请求，任一为 0 时关闭。
+# Replicate 的输出链接约一小时后失效，不镜像时 TTL 应小于该时间
+GENERATE_CACHE_SIZE = int(os.getenv('GENERATE_CACHE_SIZE', 256))
+GENERATE_CACHE_TTL = int(os.getenv('GENERATE_CACHE_TTL', 1800))
+# 把生成的图片下载到结果缓存，返回本服务的地址，不依赖会过期的 Replicate 链接
+GENERATE_MIRROR = os.getenv('GENERATE_MIRROR', 'false').lower() == 'true'
+
+GENERATE_MODEL = "black-forest-labs/flux-schnell"
+MIRROR_KEY_PATTERN = re.compile(r"generated-[0-9a-f]{64}")
+
+rembg_session = None
+
+
+def get_rembg_session():
+    global rembg_session
+    if rembg_session is None:
+        rembg_session = new_session(REMBG_MODEL)
+    return rembg_session
+
+
+def preload_rembg_session():
+    try:
+        get_rembg_session()
+    except Exception:
+        # 模型加载失败不能让 worker 退出，第一次请求时会再次尝试
+        logger.exception("Failed to preload rembg model %s", REMBG_MODEL)
+
 
-class JoinDirection(str, Enum):
-    HORIZONTAL = "horizontal"
-    VERTICAL = "vertical"
+if REMBG_PRELOAD:
+    pool.add_initializer(preload_rembg_session)
 
 
 def cleanup_temp_dir(temp_dir: str):
     shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+def encode_options(
+        format: str = Form("png"),  # png / jpeg / webp / avif / tiff
+        quality: int = Form(0),  # 0 表示使用格式默认质量
+        speed: EncoderSpeed = Form(EncoderSpeed.BALANCED),  # fast 优先速度，small 优先体积
+        max_dimension: int = Form(0),  # 长边超过该值时等比缩小，0 表示不缩放
+        strip_metadata: bool = Form(True)
+) -> EncodeOptions:
+    # 各图片接口共用的输出编码参数
+    try:
+        image_format = parse_format(format)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+    if not 0 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="Quality must be between 0 and 100")
+    if max_dimension < 0:
+        raise HTTPException(status_code=400, detail="Max dimension must not be negative")
+    return EncodeOptions(image_format, quality, speed, max_dimension, strip_metadata)
+
+
+def output_name(filename: Optional[str], suffix: str, options: EncodeOptions) -> str:
+    stem = os.path.splitext(os.path.basename(filename or "image"))[0]
+    return f"{stem}{suffix}.{options.extension}"
+
+
 @image_route.post("/add-watermark")
 async def add_watermark_to_images(
         files: List[UploadFile] = File(...),
-        watermark_text: str = Form(...)
+        watermark_text: str = Form(...),
+        position: WatermarkPosition = Form(WatermarkPosition.BOTTOM_RIGHT),
+        opacity: float = Form(0.5),
+        scale: float = Form(0.1),  # 文字高度相对图片短边的比例
+        options: EncodeOptions = Depends(encode_options)
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No image files provided")
 
-    # 如果只有一个文件，直接处理并返回
-    if len(files) == 1:
-        image = Image.open(files[0].file)
-        watermarked_image = add_watermark(image, watermark_text)
-
-        img_byte_arr = io.BytesIO()
-        watermarked_image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        return StreamingResponse(img_byte_arr, media_type="image/png",
-                                 headers={"Content-Disposition": f"attachment; filename=watermarked_image.png"})
-
-    # 如果有多个文件，处理所有文件并创建ZIP
-    else:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            zip_path = os.path.join(temp_dir, "watermarked_images.zip")
+    if not 0 < opacity <= 1:
+        raise HTTPException(status_code=400, detail="Opacity must be between 0 and 1")
 
-            with zipfile.ZipFile(zip_path, 'w') as zip_file:
-                for file in files:
-                    image = Image.open(file.file)
-                    watermarked_image = add_watermark(image, watermark_text)
+    if not 0 < scale <= 1:
+        raise HTTPException(status_code=400, detail="Scale must be between 0 and 1")
 
-                    img_byte_arr = io.BytesIO()
-                    watermarked_image.save(img_byte_arr, format='PNG')
-                    img_byte_arr.seek(0)
+    arguments = (watermark_text, position, opacity, scale, options)
+    cache_key = result_cache.key("image_watermark", await upload_digest(*files), watermark_text=watermark_text,
+                                 position=position.value, opacity=opacity, scale=scale, **options.cache_params())
+    cached = result_cache.response(cache_key)
+    if cached is not None:
+        return cached
 
-                    zip_file.writestr(f"{file.filename}_watermarked.png", img_byte_arr.getvalue())
+    # 如果只有一个文件，直接处理并返回
+    if len(files) == 1:
+        data = await read_upload(files[0])
+        watermarked = await pool.run("watermark", add_watermark_to_image_bytes, data, *arguments)
+        filename = f"watermarked_image.{options.extension}"
+        await run_in_threadpool(result_cache.store_bytes, cache_key, watermarked, options.media_type, filename)
 
-            return FileResponse(
-                zip_path,
-                media_type="application/zip",
-                filename="watermarked_images.zip"
-            )
+        return StreamingResponse(io.BytesIO(watermarked), media_type=options.media_type,
+                                 headers={"Content-Disposition": f"attachment; filename={filename}"})
 
+    # 如果有多个文件，分发到多个 worker 并行处理，处理完一个就写入 ZIP 流，保持上传顺序
+    # 上传文件在接口返回后会被关闭，所以需要在返回响应前读出内容
+    else:
+        contents = [await read_upload(file) for file in files]
+        results = pool.imap("watermark", add_watermark_to_image_bytes, ((data, *arguments) for data in contents))
+        entries = watermarked_entries(files, results, options)
+        return zip_response(await prefetch(entries), "watermarked_images.zip", cache_key=cache_key)
 
-def add_watermark(image: Image.Image, watermark_text: str) -> Image.Image:
-    # 创建一个绘图对象
-    draw = ImageDraw.Draw(image)
 
-    # 设置字体
+async def watermarked_entries(files: List[UploadFile], results: AsyncIterator[bytes],
+                              options: EncodeOptions) -> AsyncIterator[Tuple[str, bytes]]:
+    names = iter(files)
     try:
-        font = ImageFont.truetype("arial", 360)
-    except IOError:
-        font = ImageFont.load_default()
+        async for watermarked in results:
+            yield output_name(next(names).filename, "_watermarked", options), watermarked
+    finally:
+        await results.aclose()
 
-    # 获取图像尺寸
-    width, height = image.size
 
-    # 获取文本边界框
-    left, top, right, bottom = draw.textbbox((0, 0), watermark_text, font=font)
-    text_width = right - left
-    text_height = bottom - top
+def add_watermark_to_image_bytes(data: bytes, watermark_text: str,
+                                 position: WatermarkPosition = WatermarkPosition.BOTTOM_RIGHT,
+                                 opacity: float = 0.5, scale: float = 0.1,
+                                 options: EncodeOptions = EncodeOptions()) -> bytes:
+    # 先按输出尺寸缩小再加水印，图章按最终分辨率缩放
+    image = prepare_image(open_image(data, options), options)
+    watermarked_image = add_watermark(image, watermark_text, position, opacity, scale)
 
-    # 计算文本位置（右下角）
-    x = width - text_width - 10
-    y = height - text_height - 10
+    with stage("encode"):
+        output = encode_image(watermarked_image, options)
+    record_pages("watermark", 1)
+    return output
 
-    # 添加水印文本
-    draw.text((x, y), watermark_text, font=font, fill=(255, 255, 255, 128))
 
-    return image
+def add_watermark(image: Image.Image, watermark_text: str,
+                  position: WatermarkPosition = WatermarkPosition.BOTTOM_RIGHT,
+                  opacity: float = 0.5, scale: float = 0.1) -> Image.Image:
+    # 文字图章按 (文字, 字体, 字号, 透明度) 缓存在 worker 中，每张图片只做一次 alpha 合成
+    return apply_watermark(image, watermark_text, position, opacity, scale)
 
 
 @image_route.post("/remove-background")
-async def remove_image_background(file: UploadFile = File(...)):
-    if not file:
+async def remove_image_background(
+        file: Optional[UploadFile] = File(None),
+        files: Optional[List[UploadFile]] = File(None),
+        options: EncodeOptions = Depends(encode_options)
+):
+    uploads = ([file] if file else []) + (files or [])
+    if not uploads:
         raise HTTPException(status_code=400, detail="No image file provided")
 
-    temp_dir = tempfile.mkdtemp()
+    cache_key = result_cache.key("remove_background", await upload_digest(*uploads), model=REMBG_MODEL,
+                                 **options.cache_params())
+    cached = result_cache.response(cache_key)
+    if cached is not None:
+        return cached
+
+    # 多个文件按批分发，每个任务复用 worker 中常驻的模型 session
+    if len(uploads) > 1:
+        try:
+            contents = [await read_upload(upload) for upload in uploads]
+            batches = ((contents[i:i + REMBG_BATCH_SIZE], options)
+                       for i in range(0, len(contents), REMBG_BATCH_SIZE))
+            results = pool.imap("remove_background", remove_backgrounds, batches)
+            entries = await prefetch(removed_background_entries(uploads, results, options))
+            return zip_response(entries, "removed_bg_images.zip", cache_key=cache_key)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    # 单个文件与批量使用同一个按内容处理的入口，不在磁盘上按客户端提供的文件名创建路径
+    file = uploads[0]
     try:
-        # 保存上传的文件到临时目录
-        temp_input_path = os.path.join(temp_dir, file.filename)
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
+        data = await read_upload(file)
+        output, = await pool.run("remove_background", remove_backgrounds, [data], options)
+        output_filename = output_name(f"removed_bg_{os.path.basename(file.filename or 'image')}", "", options)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, options.media_type, output_filename)
+        return Response(output, media_type=options.media_type,
+                        headers={"Content-Disposition": f'attachment; filename="{output_filename}"'})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-        # 读取图片并移除背景
-        input_image = Image.open(temp_input_path)
-        output_image = remove(input_image)
 
-        # 保存处理后的图片
-        output_filename = f"removed_bg_{file.filename}"
-        output_path = os.path.join(temp_dir, output_filename)
-        output_image.save(output_path, format="PNG")
+async def removed_background_entries(uploads: List[UploadFile], results: AsyncIterator[List[bytes]],
+                                     options: EncodeOptions) -> AsyncIterator[Tuple[str, bytes]]:
+    names = iter(uploads)
+    try:
+        async for batch in results:
+            for output in batch:
+                yield output_name(f"removed_bg_{next(names).filename}", "", options), output
+    finally:
+        await results.aclose()
 
-        # 确保文件存在
-        if not os.path.exists(output_path):
-            raise HTTPException(status_code=500, detail="Failed to create image with removed background")
 
-        # 使用 BackgroundTask 来确保在响应发送后删除临时目录
-        return FileResponse(
-            output_path,
-            filename=output_filename,
-            media_type="image/png",
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
-
-    except Exception as e:
-        # 如果发生任何错误，确保删除临时目录
-        cleanup_temp_dir(temp_dir)
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+def remove_backgrounds(contents: List[bytes], options: EncodeOptions = EncodeOptions()) -> List[bytes]:
+    session = get_rembg_session()
+    outputs = []
+    for data in contents:
+        input_image = prepare_image(open_image(data, options), options)
+        with stage("inference"):
+            output_image = remove(input_image, session=session)
+        with stage("encode"):
+            outputs.append(encode_image(output_image, options))
+    record_pages("remove_background", len(contents))
+    return outputs
 
 
 @image_route.post("/join")
 async def join_images(
         files: List[UploadFile] = File(...),
-        direction: JoinDirection = Form(JoinDirection.VERTICAL)
+        direction: JoinDirection = Form(JoinDirection.VERTICAL),
+        columns: int = Form(0),  # 网格布局的列数，0 表示接近正方形的自动列数
+        options: EncodeOptions = Depends(encode_options)
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No image files provided")
 
+    if columns < 0:
+        raise HTTPException(status_code=400, detail="Columns must not be negative")
+
+    cache_key = result_cache.key("join", await upload_digest(*files), direction=direction.value,
+                                 columns=columns if direction == JoinDirection.GRID else 0, **options.cache_params())
+    cached = result_cache.response(cache_key)
+    if cached is not None:
+        return cached
+
     temp_dir = tempfile.mkdtemp()
     try:
-        images = []
-        for file in files:
-            temp_input_path = os.path.join(temp_dir, file.filename)
-            with open(temp_input_path, "wb") as temp_file:
-                shutil.copyfileobj(file.file, temp_file)
-            img = Image.open(temp_input_path)
-            images.append(img)
-
-        # 垂直拼接，选取宽度最大的图片的宽度作为拼接后的图片宽度
-        if direction == JoinDirection.VERTICAL:
-            max_width = max(img.width for img in images)
-            total_height = sum(img.height for img in images)
-            joined_image = Image.new('RGB', (max_width, total_height))
-            y_offset = 0
-            for img in images:
-                if img.width < max_width:
-                    new_img = Image.new('RGB', (max_width, img.height), (255, 255, 255))
-                    new_img.paste(img, ((max_width - img.width) // 2, 0))
-                    img = new_img
-                joined_image.paste(img, (0, y_offset))
-                y_offset += img.height
-        # 水平拼接，选取高度最大的图片的高度作为拼接后的图片高度
-        else:  # HORIZONTAL
-            total_width = sum(img.width for img in images)
-            max_height = max(img.height for img in images)
-            joined_image = Image.new('RGB', (total_width, max_height))
-            x_offset = 0
-            for img in images:
-                if img.height < max_height:
-                    new_img = Image.new('RGB', (img.width, max_height), (255, 255, 255))
-                    new_img.paste(img, (0, (max_height - img.height) // 2))
-                    img = new_img
-                joined_image.paste(img, (x_offset, 0))
-                x_offset += img.width
-
-        output_filename = f"joined_image.png"
+        temp_input_paths = []
+        for index, file in enumerate(files):
+            # 加上序号，避免同名文件互相覆盖
+            temp_input_path = os.path.join(temp_dir, f"{index}_{os.path.basename(file.filename or 'image')}")
+            with stage("upload"), open(temp_input_path, "wb") as temp_file:
+                await run_in_threadpool(shutil.copyfileobj, file.file, temp_file)
+            temp_input_paths.append(temp_input_path)
+
+        output_filename = f"joined_image.{options.extension}"
         output_path = os.path.join(temp_dir, output_filename)
-        joined_image.save(output_path, format="PNG")
+        await pool.run("join", join_image_files, temp_input_paths, direction, output_path, columns, options)
 
         if not os.path.exists(output_path):
             raise HTTPException(status_code=500, detail="Failed to create joined image")
+        await run_in_threadpool(result_cache.store_file, cache_key, output_path, options.media_type,
+                                output_filename)
 
         return FileResponse(
             output_path,
             filename=output_filename,
-            media_type="image/png",
+            media_type=options.media_type,
             background=BackgroundTask(cleanup_temp_dir, temp_dir)
         )
 
+    except HTTPException:
+        cleanup_temp_dir(temp_dir)
+        raise
     except Exception as e:
         cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
+def join_image_files(input_paths: List[str], direction: JoinDirection, output_path: str, columns: int = 0,
+                     options: EncodeOptions = EncodeOptions()):
+    # PNG 由拼接引擎按行带流式编码；其他格式的编码器需要完整画布，先拼成一张图再统一编码
+    with stage("encode"):
+        if options.format == ImageFormat.PNG:
+            compress_level = SPEED_SETTINGS[ImageFormat.PNG][options.speed]["compress_level"]
+            with open(output_path, "wb") as output:
+                join_to_png(input_paths, output, direction, columns, compress_level=compress_level,
+                            max_dimension=options.max_dimension)
+        else:
+            encode_image_to(join_to_image(input_paths, direction, columns, options.max_dimension), output_path,
+                            options)
+    record_pages("join", len(input_paths))
+
+
+UPSCALE_MODEL = "nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa"
+
+
 @image_route.post("/upscale")
-async def upscale(file: UploadFile = File(...)):
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        # 将上传的文件内容写入临时文件
-        content = await file.read()
-        temp_file.write(content)
-        temp_file_path = temp_file.name
+async def upscale(file: UploadFile = File(...), async_job: bool = Form(False)):
+    # 内容作为 HTTP 请求体发给 Replicate，落盘的上传（mmap）在这里转成 bytes
+    content = bytes(await read_upload(file))
+    content_type = file.content_type or "application/octet-stream"
+
+    if async_job:
+        async def run(job: JobContext):
+            await job.progress(0, 1)
+            output = await upscale_image_bytes(content, content_type)
+            await run_in_threadpool(write_json, job.path, {"result": output})
+
+        return await jobs.submit("upscale", run, "upscale.json", "application/json")
 
     try:
-        output = replicate.run(
-            "nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa",
-            input={
-                "image": open(temp_file_path, "rb"),
-                "scale": 2,
-                "face_enhance": True
-            }
-        )
-        print(output)
+        output = await upscale_image_bytes(content, content_type)
+        logger.info("Upscale result: %s", output)
         return {"result": output}
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        # 删除临时文件
-        os.unlink(temp_file_path)
+
+
+async def upscale_image_bytes(content: bytes, content_type: str = "application/octet-stream"):
+    # 远程推理通过异步客户端等待，不占用事件循环和线程池
+    return await replicate_client.run(
+        UPSCALE_MODEL,
+        input={
+            "image": FileInput(content, content_type),
+            "scale": 2,
+            "face_enhance": True
+        }
+    )
+
+
+def write_json(path: str, data):
+    with open(path, "w") as f:
+        json.dump(data, f, default=str)
 
 
 class AspectRatio(str, Enum):
@@ -260,21 +390,84 @@ class ImageGenerationResponse(BaseModel):
     images: list[str] = Field(..., description="生成的地址列表")
 
 
+generate_cache = AsyncMemo(GENERATE_CACHE_SIZE, GENERATE_CACHE_TTL)
+
+
+def generation_key(request: ImageGenerationRequest) -> str:
+    # 规范化后的请求参数作为键，提示词只忽略首尾和连续空白
+    params = request.model_dump(mode="json")
+    params["prompt"] = " ".join(request.prompt.split())
+    return content_digest(GENERATE_MODEL.encode(), json.dumps(params, sort_keys=True).encode())
+
+
+async def mirror_output(url: str) -> str:
+    # 镜像失败时退回原始链接，不影响生成结果
+    key = result_cache.key("generated", content_digest(url.encode()))
+    if key is None:
+        return url
+    try:
+        data, media_type = await replicate_client.download(url)
+    except ReplicateError as e:
+        logger.warning("Failed to mirror generated image: %s", e)
+        return url
+    filename = os.path.basename(urlparse(url).path) or "image"
+    await run_in_threadpool(result_cache.store_bytes, key, data, media_type, filename)
+    return f"{image_route.prefix}/generated/{key}"
+
+
+async def run_generation(request: ImageGenerationRequest) -> List[str]:
+    try:
+        output = await replicate_client.run(
+            GENERATE_MODEL,
+            input={
+                "prompt": request.prompt,
+                "num_outputs": request.num_outputs,
+                "aspect_ratio": request.aspect_ratio.value,
+                "output_format": request.output_format.value,
+                "output_quality": request.output_quality,
+                "disable_safety_checker": request.disable_safety_checker
+            }
+        )
+    except ReplicateTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ReplicateError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    logger.info("Generated images: %s", output)
+    if GENERATE_MIRROR:
+        output = list(await asyncio.gather(*(mirror_output(url) for url in output)))
+    return output
+
+
 @image_route.post("/generate", response_model=ImageGenerationResponse)
-async def generate_image(request: ImageGenerationRequest = Body(...)):
-    # 这里实现图像生成的逻辑
-    # 使用request中的参数调用相应的API或服务
-    output = replicate.run(
-        "black-forest-labs/flux-schnell",
-        input={
-            "prompt": request.prompt,
-            "num_outputs": request.num_outputs,
-            "aspect_ratio": request.aspect_ratio,
-            "output_format": request.output_format,
-            "output_quality": request.output_quality,
-            "disable_safety_checker": request.disable_safety_checker
-        }
-    )
-    # 示例返回值（实际实现时需要替换）
-    print(output)
-    return ImageGenerationResponse(images=output)
+async def generate_image(response: Response, request: ImageGenerationRequest = Body(...)):
+    # 并发的相同请求共享一次 Replicate 调用，完成后的结果按 TTL 缓存
+    if not generate_cache.enabled:
+        return ImageGenerationResponse(images=await run_generation(request))
+    images, source = await generate_cache.run(generation_key(request), lambda: run_generation(request))
+    response.headers["X-Cache"] = "MISS" if source == "miss" else "HIT"
+    return ImageGenerationResponse(images=images)
+
+
+@image_route.get("/generated/{key}")
+async def get_generated_image(key: str):
+    # 镜像到本地的生成结果，有效期与结果缓存相同
+    if not MIRROR_KEY_PATTERN.fullmatch(key):
+        raise HTTPException(status_code=404, detail="Image not found")
+    cached = await run_in_threadpool(result_cache.response, key)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return cached
+
+
+@image_route.post("/replicate/webhook")
+async def replicate_webhook(request: Request):
+    # Replicate 预测完成的回调，唤醒等待该预测的请求
+    body = await request.body()
+    if not verify_webhook(request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        prediction = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    replicate_client.handle_webhook(prediction)
+    return {"status": "ok"}
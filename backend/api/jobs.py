@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
+
+from core.jobs import jobs
+
+job_route = APIRouter(prefix="/api/jobs")
+
+
+@job_route.get("/{job_id}")
+async def get_job(job_id: str):
+    return await run_in_threadpool(jobs.status, job_id)
+
+
+@job_route.get("/{job_id}/result")
+async def get_job_result(job_id: str):
+    return await run_in_threadpool(jobs.result, job_id)
@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from api.image import generate_cache
+from core.cache import result_cache
+from core.executor import pool
+from core.metrics import CollectedCounter, Gauge, registry
+
+
+def pool_stats():
+    stats = pool.stats()
+    return {(name,): stats[name] for name in ("workers", "admitted", "running", "queued")}
+
+
+def pool_operations():
+    return {(operation,): running for operation, running in pool.stats()["operations"].items()}
+
+
+def cache_lookups():
+    stats = result_cache.stats()
+    values = {}
+    for result in ("hits", "misses"):
+        for operation, count in stats[result].items():
+            values[(operation, result)] = count
+    return values
+
+
+def generate_lookups():
+    stats = generate_cache.stats()
+    return {(result,): stats[result] for result in ("hit", "shared", "miss")}
+
+
+registry.register(Gauge("convertflow_pool_tasks", "Process pool workers and admitted/running/queued tasks",
+                        ("state",), pool_stats))
+registry.register(Gauge("convertflow_pool_running_tasks", "Running pool tasks by operation",
+                        ("operation",), pool_operations))
+# 命中率 = hits / (hits + misses)，按操作区分
+registry.register(CollectedCounter("convertflow_cache_lookups_total", "Result cache lookups since start",
+                                   ("operation", "result"), cache_lookups))
+# shared 为等待同一个进行中调用的请求数
+registry.register(CollectedCounter("convertflow_generate_cache_lookups_total",
+                                   "Image generation cache lookups since start", ("result",), generate_lookups))
+
+metrics_route = APIRouter()
+
+
+@metrics_route.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
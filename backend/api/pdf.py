@@ -1,55 +1,150 @@
+import functools
+import io
+import itertools
+import json
+import multiprocessing
 import os
 import shutil
 import tempfile
-import zipfile
+import time
 from enum import Enum
-from typing import List
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 from PIL import Image
 from fastapi import File, UploadFile, Form, HTTPException, APIRouter
-from fastapi.responses import FileResponse
-from pdf2image import convert_from_path
-from pypdf import PdfReader, PdfWriter
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pypdf import PageObject, PdfReader, PdfWriter
 from reportlab.lib.colors import Color
 from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
-from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from core.batch import BatchItem, batch_entries, stage_uploads
+from core.cache import content_digest, result_cache, tee, upload_digest
+from core.compress import CompressionProfile, compress_pdf_writer
+from core.encoding import EncodeOptions, EncoderSpeed, ImageFormat, encode_image_to, parse_format
+from core.executor import pool
+from core.merge import MERGE_FLUSH_BYTES, MergeWriter
+from core.jobs import JobContext, jobs
+from core.metrics import record_pages, record_stage, stage
+from core.pagetree import PageRangeError, iter_page_tree, iter_pages, page_count, parse_page_ranges, release_page
+from core.render import RENDER_MAX_PIXELS, ColorMode, RenderOptions, limit_max_pixels, page_sizes, to_mono
+from core.uploads import read_upload
+from core.zipstream import prefetch, write_zip, zip_response
 
 pdf_route = APIRouter(prefix="/api/pdf")
 
+# 转图片时单次调用 poppler 渲染的页数，页面先写到磁盘，不会整本驻留内存
+RENDER_BATCH_PAGES = int(os.getenv('RENDER_BATCH_PAGES', 8))
+# 单个请求最多同时运行的 pdftoppm 进程数，以及整个服务共享的上限
+RENDER_THREADS_PER_REQUEST = int(os.getenv('RENDER_THREADS_PER_REQUEST', 4))
+RENDER_MAX_THREADS = int(os.getenv('RENDER_MAX_THREADS', 0)) or (os.cpu_count() or 1)
+# 每个 worker 进程缓存的水印页数量，按 (文字, 密度, 页面尺寸) 区分
+WATERMARK_CACHE_SIZE = int(os.getenv('WATERMARK_CACHE_SIZE', 64))
+
+# pdftoppm 可以直接输出的格式，其余格式先渲染为 ppm 再由 PIL 编码
+POPPLER_FORMATS = (ImageFormat.PNG, ImageFormat.JPEG, ImageFormat.TIFF)
+
+# 全局渲染并发由跨进程信号量控制，worker 启动时注入
+render_slots = multiprocessing.BoundedSemaphore(RENDER_MAX_THREADS)
+
+
+def set_render_slots(slots):
+    global render_slots
+    render_slots = slots
+
+
+def acquire_render_slots(wanted: int) -> int:
+    # 至少等待一个渲染名额，其余名额有空闲才占用，避免大文档饿死其他请求
+    render_slots.acquire()
+    granted = 1
+    while granted < wanted and render_slots.acquire(block=False):
+        granted += 1
+    return granted
+
+
+def release_render_slots(granted: int):
+    for _ in range(granted):
+        render_slots.release()
+
+
+pool.add_initializer(set_render_slots, render_slots)
+
 
 def is_pdf(file: UploadFile) -> bool:
     return file.filename.lower().endswith('.pdf')
 
 
-def split_pdf(input_path: str, output_folder: str, pages_per_file: int) -> List[str]:
-    output_files = []
-    with open(input_path, 'rb') as file:
-        pdf = PdfReader(file)
-        total_pages = len(pdf.pages)
+def open_pdf(source: Union[str, bytes]) -> PdfReader:
+    # 接受文件路径或内存中的 PDF 内容
+    with stage("parse"):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return PdfReader(io.BytesIO(source))
+        return PdfReader(source)
+
+
+def write_pdf(writer: PdfWriter) -> bytes:
+    output = io.BytesIO()
+    with stage("write"):
+        writer.write(output)
+    return output.getvalue()
+
+
+def pdf_response(data: bytes, filename: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(data, media_type='application/pdf',
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"', **(headers or {})})
 
-        for start in range(0, total_pages, pages_per_file):
-            pdf_writer = PdfWriter()
-            end = min(start + pages_per_file, total_pages)
 
-            for page in range(start, end):
-                pdf_writer.add_page(pdf.pages[page])
+def split_pdf(source: Union[str, bytes], pages_per_file: int) -> List[Tuple[str, bytes]]:
+    return list(iter_split_pdf(source, pages_per_file))
 
-            output_filename = f'split_{start + 1}-{end}.pdf'
-            output_path = os.path.join(output_folder, output_filename)
 
-            with open(output_path, 'wb') as output_file:
-                pdf_writer.write(output_file)
+def iter_split_pdf(source: Union[str, bytes], pages_per_file: int) -> Iterator[Tuple[str, bytes]]:
+    # 单次顺序遍历页面树，每个分块写完立即产出；共享的字体、图片保留在 reader 缓存中跨分块复用，
+    # 已经写出的页面内容从缓存中移除，内存占用只和分块大小有关
+    # 分块数不依赖 /Count，损坏文件中 /Count 偏小时也不会丢页
+    pdf = open_pdf(source)
+    pages = iter_page_tree(pdf)
 
-            output_files.append(output_path)
+    for start in itertools.count(0, pages_per_file):
+        pdf_writer = PdfWriter()
+        chunk = list(itertools.islice(pages, pages_per_file))
+        if not chunk:
+            break
+        end = start + len(chunk)
 
-    return output_files
+        with stage("pages"):
+            for page in chunk:
+                pdf_writer.add_page(page)
+        output = write_pdf(pdf_writer)
+        for page in chunk:
+            release_page(pdf, page)
+        record_pages("split", len(chunk))
+
+        yield f'split_{start + 1}-{end}.pdf', output
+
+
+def write_file(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
 
 
-def create_zip(files: List[str], zip_path: str):
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file in files:
-            zipf.write(file, os.path.basename(file))
+def read_and_remove(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+async def file_entries(paths: AsyncIterator[str], temp_dir: str) -> AsyncIterator[Tuple[str, bytes]]:
+    # 把 worker 产出的文件逐个读入 ZIP 流，全部发送完后清理临时目录
+    try:
+        async for path in paths:
+            data = await run_in_threadpool(read_and_remove, path)
+            yield os.path.basename(path), data
+    finally:
+        cleanup_temp_dir(temp_dir)
 
 
 @pdf_route.post("/split")
@@ -60,30 +155,61 @@ async def split_pdf_api(file: UploadFile = File(...), pages: int = Form(...)):
     if pages <= 0:
         raise HTTPException(status_code=400, detail="Pages must be a positive integer")
 
-    temp_dir = tempfile.mkdtemp()
     try:
-        temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
+        data = await read_upload(file)
+        cache_key = result_cache.key("split", content_digest(data), pages=pages)
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
 
-        output_folder = os.path.join(temp_dir, "output")
-        os.makedirs(output_folder)
+        entries = await prefetch(pool.iterate("split", iter_split_pdf, data, pages))
+        return zip_response(entries, "split_pdfs.zip", cache_key=cache_key)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-        split_files = split_pdf(temp_input_path, output_folder, pages)
 
-        zip_filename = "split_pdfs.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-        create_zip(split_files, zip_path)
+def extract_pdf_pages(source: Union[str, bytes], ranges: str) -> bytes:
+    reader = open_pdf(source)
+    writer = PdfWriter()
+
+    with stage("pages"):
+        indices = parse_page_ranges(ranges, page_count(reader))
+        for page in iter_pages(reader, indices):
+            writer.add_page(page)
+    record_pages("extract", len(indices))
+
+    return write_pdf(writer)
+
 
-        return FileResponse(
-            zip_path,
-            filename=zip_filename,
-            media_type='application/zip',
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
+@pdf_route.post("/extract")
+async def extract_pdf_api(file: UploadFile = File(...), pages: str = Form(...)):
+    if not is_pdf(file):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
 
+    # 页码范围如 "1-3,10,50-"，按书写顺序输出
+    ranges = pages.replace(" ", "")
+    if not ranges:
+        raise HTTPException(status_code=400, detail="Pages must not be empty")
+
+    try:
+        data = await read_upload(file)
+        cache_key = result_cache.key("extract", content_digest(data), pages=ranges)
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
+
+        output = await pool.run("extract", extract_pdf_pages, data, ranges)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', "extracted.pdf")
+        return pdf_response(output, "extracted.pdf")
+
+    except HTTPException:
+        raise
+    except PageRangeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
@@ -96,50 +222,119 @@ async def download_file(filename: str):
         raise HTTPException(status_code=404, detail="File not found")
 
 
-def merge_pdfs(input_files: List[str], output_path: str):
-    pdf_writer = PdfWriter()
+def merge_pdfs(sources: List[Union[str, bytes]]) -> bytes:
+    return b"".join(iter_merge_pdfs(sources))
+
+
+def open_merge_source(source: Union[str, bytes]) -> PdfReader:
+    reader = open_pdf(source)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    return reader
+
+
+def iter_merge_pdfs(sources: List[Union[str, bytes]],
+                    sections: Optional[List[Tuple[int, Optional[str]]]] = None) -> Iterator[bytes]:
+    # 逐个文档追加到输出，缓冲超过 MERGE_FLUSH_BYTES 就产出，内存中只保留当前文档和 xref
+    # sections 为 (文件下标, 页码范围) 列表，决定输出顺序，页码范围为空表示整个文件
+    # 写出第一个字节前先逐个打开输入并解析全部页码范围，错误在响应开始前就能返回 4xx/5xx，而不是截断的 PDF；
+    # 校验时每个文件用完即释放，写出时再按顺序重新打开，任何时候只有一个输入在内存中
+    writer = MergeWriter()
+    sections = sections or [(index, None) for index in range(len(sources))]
+    plan: List[Tuple[int, Optional[List[int]]]] = [(index, None) for index, _ in sections]
+    for index in dict.fromkeys(index for index, _ in sections):
+        reader = open_merge_source(sources[index])
+        total = page_count(reader)
+        reader = None
+        for position, (section_index, ranges) in enumerate(sections):
+            if section_index == index and ranges:
+                plan[position] = (index, parse_page_ranges(ranges, total))
+
+    current, reader = None, None
+    for index, indices in plan:
+        # 相邻的段落来自同一个文件时继续使用已打开的 reader
+        if index != current:
+            reader = None
+            reader = open_merge_source(sources[index])
+            current = index
+        pages = iter_page_tree(reader) if indices is None else iter_pages(reader, indices)
+        for pending in writer.add_document(reader, pages):
+            if pending >= MERGE_FLUSH_BYTES:
+                yield writer.drain()
+    reader = None
+
+    record_pages("merge", writer.page_count)
+    yield writer.finish()
+
+
+def parse_merge_order(order: Optional[str], file_count: int) -> List[Tuple[int, Optional[str]]]:
+    # order 为 JSON 数组，元素是文件下标（从 0 开始）或 {"file": 下标, "pages": "1-3,10"}，
+    # 同一个文件可以出现多次；不传时按上传顺序合并所有页面
+    if not order:
+        return [(index, None) for index in range(file_count)]
+    try:
+        items = json.loads(order)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Order must be a JSON array")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Order must be a non-empty JSON array")
+
+    sections = []
+    for item in items:
+        if isinstance(item, dict):
+            index, ranges = item.get("file"), item.get("pages")
+        else:
+            index, ranges = item, None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < file_count:
+            raise HTTPException(status_code=400, detail=f"Invalid file index in order: {index}")
+        if ranges is not None and not isinstance(ranges, str):
+            raise HTTPException(status_code=400, detail="Pages in order must be a string such as '1-3,10'")
+        sections.append((index, ranges.replace(" ", "") if ranges else None))
+    return sections
 
-    for file_path in input_files:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PdfReader(file)
-            for page in pdf_reader.pages:
-                pdf_writer.add_page(page)
 
-    with open(output_path, 'wb') as output_file:
-        pdf_writer.write(output_file)
+async def merged_chunks(chunks: AsyncIterator[bytes], temp_dir: str) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        cleanup_temp_dir(temp_dir)
 
 
 @pdf_route.post("/merge")
-async def merge_pdf_api(files: List[UploadFile] = File(...)):
+async def merge_pdf_api(files: List[UploadFile] = File(...), order: Optional[str] = Form(None)):
     if not all(is_pdf(file) for file in files):
         raise HTTPException(status_code=400, detail="All uploaded files must be PDFs")
 
-    # 创建一个持久的临时目录
+    sections = parse_merge_order(order, len(files))
+    cache_key = result_cache.key("merge", await upload_digest(*files), order=sections)
+    cached = result_cache.response(cache_key)
+    if cached is not None:
+        return cached
+
+    # 上传文件在请求结束时会被关闭，先逐个复制到临时目录，worker 按路径依次读取，不把所有输入同时读入内存
     temp_dir = tempfile.mkdtemp()
     try:
-        temp_input_files = []
-        for file in files:
-            temp_input_path = os.path.join(temp_dir, file.filename)
-            with open(temp_input_path, "wb") as temp_file:
-                shutil.copyfileobj(file.file, temp_file)
-            temp_input_files.append(temp_input_path)
-
-        output_filename = "merged.pdf"
-        output_path = os.path.join(temp_dir, output_filename)
-
-        merge_pdfs(temp_input_files, output_path)
-
-        # 确保文件存在
-        if not os.path.exists(output_path):
-            raise HTTPException(status_code=500, detail="Failed to create merged PDF")
-
-        # 使用 background 参数来确保文件在响应发送后被删除
-
-        return FileResponse(output_path, filename=output_filename,
-                            background=BackgroundTask(cleanup_temp_dir, temp_dir))
+        paths = []
+        for index, file in enumerate(files):
+            path = os.path.join(temp_dir, f"{index}.pdf")
+            with stage("upload"), open(path, "wb") as temp_file:
+                await run_in_threadpool(shutil.copyfileobj, file.file, temp_file)
+            paths.append(path)
+
+        chunks = await prefetch(pool.iterate("merge", iter_merge_pdfs, paths, sections))
+        cache_writer = result_cache.writer(cache_key, 'application/pdf', "merged.pdf")
+        return StreamingResponse(tee(merged_chunks(chunks, temp_dir), cache_writer), media_type='application/pdf',
+                                 headers={"Content-Disposition": 'attachment; filename="merged.pdf"'})
+
+    except HTTPException:
+        cleanup_temp_dir(temp_dir)
+        raise
+    except PageRangeError as e:
+        cleanup_temp_dir(temp_dir)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        # 如果发生任何错误，确保删除临时目录
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
@@ -155,46 +350,36 @@ async def encrypt_pdf_api(file: UploadFile = File(...), password: str = Form(...
     if not password:
         raise HTTPException(status_code=400, detail="Password is required")
 
-    # 创建一个临时目录
-    temp_dir = tempfile.mkdtemp()
     try:
-        # 保存上传的文件
-        temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-
-        # 创建输出文件路径
-        output_filename = "encrypted.pdf"
-        output_path = os.path.join(temp_dir, output_filename)
+        data = await read_upload(file)
+        cache_key = result_cache.key("encrypt", content_digest(data), password=password)
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
 
         # 加密PDF
-        encrypt_pdf(temp_input_path, output_path, password)
-
-        # 确保文件存在
-        if not os.path.exists(output_path):
-            raise HTTPException(status_code=500, detail="Failed to create encrypted PDF")
-
-        # 返回加密后的文件，并在响应发送后清理临时目录
-        return FileResponse(output_path, filename=output_filename,
-                            background=BackgroundTask(cleanup_temp_dir, temp_dir))
+        output = await pool.run("encrypt", encrypt_pdf, data, password)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', "encrypted.pdf")
+        return pdf_response(output, "encrypted.pdf")
 
+    except HTTPException:
+        raise
     except Exception as e:
-        # 如果发生任何错误，确保删除临时目录
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-def encrypt_pdf(input_path: str, output_path: str, password: str):
+def encrypt_pdf(source: Union[str, bytes], password: str) -> bytes:
     pdf_writer = PdfWriter()
-    pdf_reader = PdfReader(input_path)
+    pdf_reader = open_pdf(source)
 
-    for page in pdf_reader.pages:
-        pdf_writer.add_page(page)
+    with stage("pages"):
+        for page in pdf_reader.pages:
+            pdf_writer.add_page(page)
+    record_pages("encrypt", len(pdf_writer.pages))
 
     pdf_writer.encrypt(password)
 
-    with open(output_path, 'wb') as output_file:
-        pdf_writer.write(output_file)
+    return write_pdf(pdf_writer)
 
 
 @pdf_route.post("/to-images")
@@ -202,7 +387,14 @@ async def pdf_to_images_api(
         file: UploadFile = File(...),
         format: str = Form("png"),
         pages_per_image: int = Form(1),
-        dpi: int = Form(600)  # 添加 DPI 参数
+        dpi: int = Form(600),  # 添加 DPI 参数
+        quality: int = Form(95),  # JPEG / WebP / AVIF 的编码质量
+        speed: EncoderSpeed = Form(EncoderSpeed.FAST),  # 编码速度档位，fast 优先速度，small 优先体积
+        width: int = Form(0),  # 按目标宽度渲染（像素），与 height 同时指定时等比缩放到框内
+        height: int = Form(0),  # 按目标高度渲染（像素）
+        max_pixels: int = Form(0),  # 单页像素上限，超出时自动降低 DPI，不能超过服务端上限
+        color: ColorMode = Form(ColorMode.COLOR),  # color / gray / mono
+        async_job: bool = Form(False)  # 返回任务 ID，通过 /api/jobs 查询进度和下载结果
 ):
     if not is_pdf(file):
         raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
@@ -210,69 +402,186 @@ async def pdf_to_images_api(
     if pages_per_image <= 0:
         raise HTTPException(status_code=400, detail="Pages per image must be a positive integer")
 
-    if format.lower() not in ["png", "jpg", "jpeg", "tiff"]:
+    if format.lower() not in ["png", "jpg", "jpeg", "tiff", "webp", "avif"]:
         raise HTTPException(status_code=400, detail="Unsupported image format")
 
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="Quality must be between 1 and 100")
+
     if dpi <= 0:
         raise HTTPException(status_code=400, detail="DPI must be a positive integer")
 
+    if width < 0 or height < 0:
+        raise HTTPException(status_code=400, detail="Width and height must not be negative")
+
+    if max_pixels < 0:
+        raise HTTPException(status_code=400, detail="Max pixels must not be negative")
+
+    max_pixels = limit_max_pixels(max_pixels)
+
+    # 只有请求指定 async_job 时才返回任务，默认始终直接返回文件
+    queued = async_job
+    cache_key = result_cache.key("to_images", await upload_digest(file),
+                                 format=format.lower(), pages_per_image=pages_per_image, dpi=dpi,
+                                 quality=quality, speed=speed.value, width=width, height=height,
+                                 max_pixels=max_pixels, color=color.value)
+    cached = result_cache.response(cache_key) if not queued else None
+    if cached is not None:
+        return cached
+
     temp_dir = tempfile.mkdtemp()
     try:
         temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
+        with stage("upload"), open(temp_input_path, "wb") as temp_file:
+            await run_in_threadpool(shutil.copyfileobj, file.file, temp_file)
 
         output_folder = os.path.join(temp_dir, "output")
         os.makedirs(output_folder)
 
-        images = convert_pdf_to_images(temp_input_path, output_folder, format, pages_per_image, dpi)
-
-        zip_filename = "pdf_images.zip"
-        zip_path = os.path.join(temp_dir, zip_filename)
-        create_zip(images, zip_path)
-
-        return FileResponse(
-            zip_path,
-            filename=zip_filename,
-            media_type='application/zip',
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
-
+        if queued:
+            async def run(job: JobContext):
+                try:
+                    total = (await run_in_threadpool(pdfinfo_from_path, temp_input_path))["Pages"]
+                    await job.progress(0, total)
+                    images = pool.iterate("to_images", iter_pdf_images,
+                                          temp_input_path, output_folder, format, pages_per_image, dpi, quality, speed,
+                                          width, height, max_pixels, color)
+                    entries = tracked_entries(file_entries(images, temp_dir), job, pages_per_image, total)
+                    await write_zip(entries, job.path)
+                finally:
+                    cleanup_temp_dir(temp_dir)
+                await run_in_threadpool(result_cache.store_file, cache_key, job.path,
+                                        "application/zip", "pdf_images.zip")
+
+            return await jobs.submit("to_images", run, "pdf_images.zip", "application/zip")
+
+        images = pool.iterate("to_images", iter_pdf_images,
+                              temp_input_path, output_folder, format, pages_per_image, dpi, quality, speed,
+                              width, height, max_pixels, color)
+        entries = await prefetch(file_entries(images, temp_dir))
+        return zip_response(entries, "pdf_images.zip", cache_key=cache_key)
+
+    except HTTPException:
+        cleanup_temp_dir(temp_dir)
+        raise
     except Exception as e:
         cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-def convert_pdf_to_images(pdf_path: str, output_folder: str, format: str, pages_per_image: int, dpi: int = 600) -> List[
-    str]:
-    images = convert_from_path(pdf_path, dpi=dpi)  # 增加 DPI
-    output_files = []
-
-    for i in range(0, len(images), pages_per_image):
-        combined_image = images[i]
-        if pages_per_image > 1:
-            width = max(img.width for img in images[i:i + pages_per_image])
-            height = sum(img.height for img in images[i:i + pages_per_image])
-            combined_image = Image.new('RGB', (width, height), (255, 255, 255))  # 使用白色背景
-
-            y_offset = 0
-            for img in images[i:i + pages_per_image]:
-                combined_image.paste(img, (0, y_offset))
-                y_offset += img.height
-
-        output_filename = f'page_{i + 1}-{min(i + pages_per_image, len(images))}.{format}'
-        output_path = os.path.join(output_folder, output_filename)
-
-        if format.lower() in ['jpg', 'jpeg']:
-            combined_image.save(output_path, format.upper(), quality=95)  # 提高 JPEG 质量
-        elif format.lower() == 'png':
-            combined_image.save(output_path, format.upper(), compress_level=1)  # 降低 PNG 压缩以提高质量
-        else:
-            combined_image.save(output_path, format.upper())
-
-        output_files.append(output_path)
-
-    return output_files
+async def tracked_entries(entries: AsyncIterator[Tuple[str, bytes]], job: JobContext, pages_per_entry: int,
+                          total: int) -> AsyncIterator[Tuple[str, bytes]]:
+    # 每产出一个文件就更新任务进度
+    done = 0
+    async for entry in entries:
+        yield entry
+        done = min(done + pages_per_entry, total)
+        await job.progress(done)
+
+
+def convert_pdf_to_images(pdf_path: str, output_folder: str, format: str, pages_per_image: int, dpi: int = 600,
+                          quality: int = 95, speed: EncoderSpeed = EncoderSpeed.FAST, width: int = 0, height: int = 0,
+                          max_pixels: int = RENDER_MAX_PIXELS, color: ColorMode = ColorMode.COLOR) -> List[str]:
+    return list(iter_pdf_images(pdf_path, output_folder, format, pages_per_image, dpi, quality, speed,
+                                width, height, max_pixels, color))
+
+
+def iter_pdf_images(pdf_path: str, output_folder: str, format: str, pages_per_image: int,
+                    dpi: int = 600, quality: int = 95, speed: EncoderSpeed = EncoderSpeed.FAST,
+                    width: int = 0, height: int = 0, max_pixels: int = RENDER_MAX_PIXELS,
+                    color: ColorMode = ColorMode.COLOR) -> Iterator[str]:
+    # 按批渲染：poppler 先把页面写到磁盘，再逐组读取拼接，内存峰值只与一组页面有关
+    render = RenderOptions(dpi, width, height, max_pixels, color)
+    with stage("page_sizes"):
+        sizes = page_sizes(pdf_path)
+    total_pages = len(sizes)
+    threads = max(1, min(RENDER_THREADS_PER_REQUEST, RENDER_MAX_THREADS))
+    # 每批页数至少覆盖所有渲染进程，并且是 pages_per_image 的整数倍
+    batch_pages = max(RENDER_BATCH_PAGES, threads)
+    batch_pages = -(-batch_pages // pages_per_image) * pages_per_image
+    options = EncodeOptions(parse_format(format), quality, speed)
+    # 单页输出且 poppler 支持该格式时直接使用 poppler 编码的文件，无需经过 PIL；黑白模式需要 PIL 二值化
+    direct = pages_per_image == 1 and options.format in POPPLER_FORMATS and render.color != ColorMode.MONO
+    render_format = options.format.value if direct else "ppm"
+
+    render_folder = tempfile.mkdtemp(dir=output_folder)
+    try:
+        for batch_start in range(1, total_pages + 1, batch_pages):
+            batch_end = min(batch_start + batch_pages - 1, total_pages)
+            # poppler 按页码区间切分给多个进程，返回结果仍按页码排序
+            granted = acquire_render_slots(min(threads, batch_end - batch_start + 1))
+            start_time = time.perf_counter()
+            page_paths = []
+            try:
+                # 一次调用只能使用一个 dpi / 目标尺寸，参数相同的相邻页面合并为一次调用
+                pages = range(batch_start, batch_end + 1)
+                for args, run in itertools.groupby(pages, key=lambda page: render.page_args(sizes[page - 1])):
+                    run = list(run)
+                    page_dpi, scale_to = args
+                    page_paths += convert_from_path(
+                        pdf_path,
+                        dpi=page_dpi,
+                        size=scale_to,
+                        grayscale=render.grayscale,
+                        first_page=run[0],
+                        last_page=run[-1],
+                        output_folder=render_folder,
+                        fmt=render_format,
+                        jpegopt={"quality": quality},
+                        thread_count=min(granted, len(run)),
+                        paths_only=True
+                    )
+            finally:
+                release_render_slots(granted)
+                record_stage("render", time.perf_counter() - start_time)
+            record_pages("to_images", len(page_paths))
+
+            for i in range(0, len(page_paths), pages_per_image):
+                group = page_paths[i:i + pages_per_image]
+                start = batch_start + i
+                output_filename = f'page_{start}-{start + len(group) - 1}.{format}'
+                output_path = os.path.join(output_folder, output_filename)
+
+                if direct:
+                    os.replace(group[0], output_path)
+                else:
+                    with stage("stitch"):
+                        combined_image = stitch_pages(group, render.image_mode)
+                        if render.color == ColorMode.MONO:
+                            combined_image = to_mono(combined_image)
+                        save_image(combined_image, output_path, options)
+                    combined_image.close()
+                    for page_path in group:
+                        os.remove(page_path)
+
+                yield output_path
+    finally:
+        shutil.rmtree(render_folder, ignore_errors=True)
+
+
+def stitch_pages(page_paths: List[str], mode: str = 'RGB') -> Image.Image:
+    # 只读取图片头获取尺寸，逐页解码后粘贴
+    sizes = []
+    for page_path in page_paths:
+        with Image.open(page_path) as img:
+            sizes.append(img.size)
+
+    width = max(w for w, _ in sizes)
+    height = sum(h for _, h in sizes)
+    combined_image = Image.new(mode, (width, height), 'white')  # 使用白色背景
+
+    y_offset = 0
+    for page_path, (_, page_height) in zip(page_paths, sizes):
+        with Image.open(page_path) as img:
+            combined_image.paste(img, (0, y_offset))
+        y_offset += page_height
+
+    return combined_image
+
+
+def save_image(image: Image.Image, output_path: str, options: EncodeOptions):
+    # 与图片接口共用编码层，默认 fast 档位（PNG 低压缩级别）以降低延迟
+    encode_image_to(image, output_path, options)
 
 
 @pdf_route.post("/rotate")
@@ -286,37 +595,34 @@ async def rotate_pdf(
     if angle not in [90, 180, 270, 360]:
         raise HTTPException(status_code=400, detail="Angle must be 90, 180, 270, or 360 degrees")
 
-    temp_dir = tempfile.mkdtemp()
     try:
-        temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-
-        output_path = os.path.join(temp_dir, "rotated.pdf")
-        rotate_pdf_file(temp_input_path, output_path, angle)
-
-        return FileResponse(
-            output_path,
-            filename="rotated.pdf",
-            media_type='application/pdf',
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
-
+        data = await read_upload(file)
+        cache_key = result_cache.key("rotate", content_digest(data), angle=angle)
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
+
+        output = await pool.run("rotate", rotate_pdf_file, data, angle)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', "rotated.pdf")
+        return pdf_response(output, "rotated.pdf")
+
+    except HTTPException:
+        raise
     except Exception as e:
-        cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-def rotate_pdf_file(input_path: str, output_path: str, angle: int):
-    reader = PdfReader(input_path)
+def rotate_pdf_file(source: Union[str, bytes], angle: int) -> bytes:
+    reader = open_pdf(source)
     writer = PdfWriter()
 
-    for page in reader.pages:
-        page.rotate(angle)
-        writer.add_page(page)
+    with stage("pages"):
+        for page in reader.pages:
+            page.rotate(angle)
+            writer.add_page(page)
+    record_pages("rotate", len(writer.pages))
 
-    with open(output_path, "wb") as output_file:
-        writer.write(output_file)
+    return write_pdf(writer)
 
 
 # 水印密枚举
@@ -335,47 +641,58 @@ async def add_watermark_to_pdf(
     if not is_pdf(file):
         raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
 
-    temp_dir = tempfile.mkdtemp()
     try:
-        temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-
-        output_path = os.path.join(temp_dir, "watermarked.pdf")
-        add_watermark_to_pdf_file(temp_input_path, output_path, watermark_text, density)
-
-        return FileResponse(
-            output_path,
-            filename="watermarked.pdf",
-            media_type='application/pdf',
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
-
+        data = await read_upload(file)
+        cache_key = result_cache.key("watermark", content_digest(data),
+                                     watermark_text=watermark_text, density=density.value)
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
+
+        output = await pool.run("watermark", add_watermark_to_pdf_file, data, watermark_text, density)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', "watermarked.pdf")
+        return pdf_response(output, "watermarked.pdf")
+
+    except HTTPException:
+        raise
     except Exception as e:
-        cleanup_temp_dir(temp_dir)
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-def add_watermark_to_pdf_file(input_path: str, output_path: str, watermark_text: str, density: WatermarkDensity):
-    reader = PdfReader(input_path)
+def add_watermark_to_pdf_file(source: Union[str, bytes], watermark_text: str, density: WatermarkDensity) -> bytes:
+    reader = open_pdf(source)
     writer = PdfWriter()
 
-    watermark = create_watermark(watermark_text, density)
-    watermark_page = PdfReader(watermark).pages[0]
+    with stage("pages"):
+        for page in reader.pages:
+            watermark_page(page, watermark_text, density)
+            writer.add_page(page)
+    record_pages("watermark", len(writer.pages))
+
+    return write_pdf(writer)
+
+
+def watermark_page(page: PageObject, watermark_text: str, density: WatermarkDensity):
+    # 按页面实际尺寸取水印，同尺寸页面共用同一个解析好的水印页
+    box = page.mediabox
+    watermark = get_watermark_page(watermark_text, WatermarkDensity(density),
+                                   round(float(box.width), 2), round(float(box.height), 2))
+    if box.left or box.bottom:
+        page.merge_translated_page(watermark, float(box.left), float(box.bottom))
+    else:
+        page.merge_page(watermark)
 
-    for page in reader.pages:
-        page.merge_page(watermark_page)
-        writer.add_page(page)
 
-    with open(output_path, "wb") as output_file:
-        writer.write(output_file)
+@functools.lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def get_watermark_page(text: str, density: WatermarkDensity, width: float, height: float) -> PageObject:
+    return PdfReader(io.BytesIO(create_watermark(text, density, width, height))).pages[0]
 
 
-def create_watermark(text: str, density: WatermarkDensity):
-    temp_watermark = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    c = canvas.Canvas(temp_watermark.name)
+def create_watermark(text: str, density: WatermarkDensity, width: float = 8.5 * inch,
+                     height: float = 11 * inch) -> bytes:
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer)
 
-    width, height = 8.5 * inch, 11 * inch  # Assuming letter size
     c.setPageSize((width, height))
     c.setFont("Helvetica", 50)
     # 白色背景，低透明度，不影响 pdf 主体内容
@@ -387,8 +704,8 @@ def create_watermark(text: str, density: WatermarkDensity):
         positions = [(width / 4, height / 4), (3 * width / 4, height / 4),
                      (width / 4, 3 * height / 4), (3 * width / 4, 3 * height / 4)]
     else:  # HIGH
-        positions = [(x, y) for x in range(int(width / 4), int(width), int(width / 4))
-                     for y in range(int(height / 4), int(height), int(height / 4))]
+        positions = [(x, y) for x in range(int(width / 4), int(width), max(1, int(width / 4)))
+                     for y in range(int(height / 4), int(height), max(1, int(height / 4)))]
 
     for x, y in positions:
         c.saveState()
@@ -398,42 +715,126 @@ def create_watermark(text: str, density: WatermarkDensity):
         c.restoreState()
 
     c.save()
-    temp_watermark.close()
-    return temp_watermark.name
+    return buffer.getvalue()
 
 
 @pdf_route.post("/compress")
 async def compress_pdf(
         file: UploadFile = File(...),
-        compression_level: int = Form(4, ge=0, le=9)  # 压缩级别，0-3
+        compression_level: int = Form(4, ge=0, le=9),  # 内容流 zlib 压缩级别，0 表示不处理
+        profile: CompressionProfile = Form(CompressionProfile.EBOOK),  # screen / ebook / print
+        async_job: bool = Form(False)
 ):
     if not is_pdf(file):
         raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
 
-    temp_dir = tempfile.mkdtemp()
     try:
-        temp_input_path = os.path.join(temp_dir, "input.pdf")
-        with open(temp_input_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-
-        output_path = os.path.join(temp_dir, "compressed.pdf")
-        with open(output_path, "wb") as f:
-            writer = PdfWriter(clone_from=temp_input_path)
-            # 两种方法的压缩效率不一样，如果是针对图像多的压缩建议通过压缩图像方式减少体积，比如 pdf 电子书
-            # for page in writer.pages:
-            #     page.compress_content_streams(level=compression_level)
-            for page in writer.pages:
-                for img in page.images:
-                    img.replace(img.image, quality=40)
-            writer.write(f)
-
-        return FileResponse(
-            output_path,
-            filename="compressed.pdf",
-            media_type='application/pdf',
-            background=BackgroundTask(cleanup_temp_dir, temp_dir)
-        )
+        queued = async_job
+        data = await read_upload(file)
+        cache_key = result_cache.key("compress", content_digest(data), compression_level=compression_level,
+                                     profile=profile.value)
+        cached = result_cache.response(cache_key) if not queued else None
+        if cached is not None:
+            return cached
+
+        if queued:
+            async def run(job: JobContext):
+                # 压缩是一次进程池调用，没有中间进度，不为统计页数在主进程里解析 PDF
+                output, headers = await pool.run("compress", compress_pdf_file, data, compression_level, profile)
+                await run_in_threadpool(write_file, job.path, output)
+                await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf',
+                                        "compressed.pdf", headers)
+
+            return await jobs.submit("compress", run, "compressed.pdf", "application/pdf")
+
+        output, headers = await pool.run("compress", compress_pdf_file, data, compression_level, profile)
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', "compressed.pdf",
+                                headers)
+        return pdf_response(output, "compressed.pdf", headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+def compress_pdf_file(source: Union[str, bytes], compression_level: int,
+                      profile: CompressionProfile = CompressionProfile.EBOOK) -> Tuple[bytes, Dict[str, str]]:
+    reader = open_pdf(source)
+    writer = PdfWriter(clone_from=reader)
+    saved = compress_pdf_writer(writer, compression_level, profile)
+    record_pages("compress", len(writer.pages))
+    output = write_pdf(writer)
+    # 每个阶段节省的字节数放在响应头里，便于按场景选择档位
+    headers = {f"X-Bytes-Saved-{stage.replace('_', '-').title()}": str(size) for stage, size in saved.items()}
+    input_size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    headers["X-Bytes-Saved-Total"] = str(input_size - len(output))
+    return output, headers
+
+
+async def batch_pdf_response(files: List[UploadFile], operation: str, fn, args: tuple, params: dict,
+                             filename: str) -> StreamingResponse:
+    # 每个文件单独提交到进程池（名额由 batch_entries 统一预留），缓存键与单文件接口相同，两边可以互相命中
+    async def process(item: BatchItem, data: bytes) -> Tuple[bytes, dict]:
+        if not item.name.lower().endswith('.pdf'):
+            raise ValueError("Not a PDF file")
+        cache_key = result_cache.key(operation, content_digest(data), **params)
+        cached = await run_in_threadpool(result_cache.read_bytes, cache_key)
+        if cached is not None:
+            output, meta = cached
+            return output, {"cached": True, **meta.get("headers", {})}
+
+        result = await pool.run_reserved(operation, fn, data, *args)
+        output, headers = result if isinstance(result, tuple) else (result, {})
+        await run_in_threadpool(result_cache.store_bytes, cache_key, output, 'application/pdf', item.name, headers)
+        return output, headers
 
+    temp_dir = tempfile.mkdtemp()
+    try:
+        items = await stage_uploads(files, temp_dir)
+        entries = await prefetch(batch_entries(items, process, temp_dir))
+        return zip_response(entries, filename)
+    except HTTPException:
+        cleanup_temp_dir(temp_dir)
+        raise
     except Exception as e:
         cleanup_temp_dir(temp_dir)
-        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+@pdf_route.post("/batch/rotate")
+async def batch_rotate_pdf(files: List[UploadFile] = File(...), angle: int = Form(...)):
+    if angle not in [90, 180, 270, 360]:
+        raise HTTPException(status_code=400, detail="Angle must be 90, 180, 270, or 360 degrees")
+
+    return await batch_pdf_response(files, "rotate", rotate_pdf_file, (angle,), {"angle": angle}, "rotated.zip")
+
+
+@pdf_route.post("/batch/encrypt")
+async def batch_encrypt_pdf(files: List[UploadFile] = File(...), password: str = Form(...)):
+    if not password:
+        raise HTTPException(status_code=400, detail="Password is required")
+
+    return await batch_pdf_response(files, "encrypt", encrypt_pdf, (password,), {"password": password},
+                                    "encrypted.zip")
+
+
+@pdf_route.post("/batch/add-watermark")
+async def batch_add_watermark_to_pdf(
+        files: List[UploadFile] = File(...),
+        watermark_text: str = Form(...),
+        density: WatermarkDensity = Form(...)
+):
+    return await batch_pdf_response(files, "watermark", add_watermark_to_pdf_file, (watermark_text, density),
+                                    {"watermark_text": watermark_text, "density": density.value}, "watermarked.zip")
+
+
+@pdf_route.post("/batch/compress")
+async def batch_compress_pdf(
+        files: List[UploadFile] = File(...),
+        compression_level: int = Form(4, ge=0, le=9),
+        profile: CompressionProfile = Form(CompressionProfile.EBOOK)
+):
+    return await batch_pdf_response(files, "compress", compress_pdf_file, (compression_level, profile),
+                                    {"compression_level": compression_level, "profile": profile.value},
+                                    "compressed.zip")
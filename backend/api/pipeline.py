@@ -0,0 +1,428 @@
+import os
+import shutil
+import tempfile
+from enum import Enum
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Literal, Optional, Tuple, Type, Union
+
+from PIL import Image
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.responses import Response
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from pypdf import PdfWriter
+from rembg import remove
+from starlette.concurrency import run_in_threadpool
+
+from api.image import add_watermark, get_rembg_session
+from api.pdf import WatermarkDensity, iter_pdf_images, open_pdf, watermark_page, write_pdf
+from core.cache import result_cache, upload_digest
+from core.compress import CompressionProfile, compress_pdf_writer
+from core.encoding import EncodeOptions, EncoderSpeed, encode_image, open_image, parse_format, prepare_image
+from core.executor import pool
+from core.metrics import record_pages, stage
+from core.mosaic import JoinDirection, join_loaded
+from core.pagetree import PageRangeError, parse_page_ranges
+from core.pipeline import PipelineError, Step, default_outputs, file_index, order_steps, run_steps
+from core.render import ColorMode, limit_max_pixels
+from core.uploads import read_upload
+from core.watermark import WatermarkPosition
+from core.zipstream import prefetch, zip_response
+
+pipeline_route = APIRouter(prefix="/api/pipeline")
+
+Document = Union[PdfWriter, Image.Image]
+
+
+class DocumentKind(str, Enum):
+    PDF = "pdf"
+    IMAGE = "image"
+
+
+class StepParams(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class ExtractParams(StepParams):
+    pages: str = Field(..., description="页码范围，例如 1-3,5")
+
+
+class SplitParams(StepParams):
+    pages: int = Field(default=1, gt=0, description="每个文件的页数")
+
+
+class RotateParams(StepParams):
+    angle: Literal[90, 180, 270, 360] = Field(..., description="旋转角度")
+
+
+class EncryptParams(StepParams):
+    password: str = Field(..., min_length=1, description="打开密码")
+
+
+class PdfWatermarkParams(StepParams):
+    watermark_text: str = Field(..., description="水印文字")
+    density: WatermarkDensity = Field(default=WatermarkDensity.MEDIUM, description="水印密度")
+
+
+class CompressParams(StepParams):
+    compression_level: int = Field(default=4, ge=0, le=9, description="内容流 zlib 压缩级别")
+    profile: CompressionProfile = Field(default=CompressionProfile.EBOOK, description="压缩档位")
+
+
+class ToImagesParams(StepParams):
+    dpi: int = Field(default=150, gt=0, description="渲染 DPI")
+    width: int = Field(default=0, ge=0, description="按目标宽度渲染")
+    height: int = Field(default=0, ge=0, description="按目标高度渲染")
+    max_pixels: int = Field(default=0, ge=0, description="单页像素上限")
+    color: ColorMode = Field(default=ColorMode.COLOR, description="color / gray / mono")
+
+
+class ImageWatermarkParams(StepParams):
+    watermark_text: str = Field(..., description="水印文字")
+    position: WatermarkPosition = Field(default=WatermarkPosition.BOTTOM_RIGHT, description="水印位置")
+    opacity: float = Field(default=0.5, gt=0, le=1, description="不透明度")
+    scale: float = Field(default=0.1, gt=0, le=1, description="字号相对图片短边的比例")
+
+
+class JoinParams(StepParams):
+    direction: JoinDirection = Field(default=JoinDirection.VERTICAL, description="拼接方向")
+    columns: int = Field(default=0, ge=0, description="网格布局的列数")
+
+
+class EncodeParams(StepParams):
+    format: str = Field(default="png", description="输出图片格式")
+    quality: int = Field(default=0, ge=0, le=100, description="编码质量，0 表示格式默认值")
+    speed: EncoderSpeed = Field(default=EncoderSpeed.BALANCED, description="编码速度档位")
+    max_dimension: int = Field(default=0, ge=0, description="长边上限")
+    strip_metadata: bool = Field(default=True, description="去除元数据")
+
+    @field_validator("format")
+    @classmethod
+    def check_format(cls, value: str) -> str:
+        return parse_format(value).value
+
+    def options(self) -> EncodeOptions:
+        return EncodeOptions(parse_format(self.format), self.quality, self.speed, self.max_dimension,
+                             self.strip_metadata)
+
+
+class PipelineStep(BaseModel):
+    id: str = Field(..., description="节点 ID")
+    op: str = Field(..., description="操作名，例如 pdf.merge")
+    inputs: List[str] = Field(..., description="输入节点 ID，或 file:<序号> 引用上传的文件")
+    params: dict = Field(default_factory=dict, description="操作参数，与对应接口的表单字段相同")
+    encode: EncodeParams = Field(default_factory=EncodeParams, description="图片输出的编码参数")
+
+
+class PipelineSpec(BaseModel):
+    steps: List[PipelineStep] = Field(..., description="流水线节点")
+    outputs: Optional[List[str]] = Field(default=None, description="需要返回的节点，默认为没有被使用的节点")
+
+
+class Operation:
+    # each 为 True 时对每个输入文档分别调用，否则把全部输入文档一次传入并合成一个文档；
+    # mutates 表示原地修改输入，共享的输入需要先复制；terminal 的结果不能再作为其他节点的输入。
+    # name 为对应接口使用的结果缓存操作名，CACHE_DISABLED_OPERATIONS 对流水线同样生效
+    def __init__(self, fn: Callable, name: str, params: Type[StepParams], accepts: DocumentKind,
+                 produces: DocumentKind, each: bool = True, mutates: bool = False, expands: bool = False,
+                 terminal: bool = False):
+        self.fn = fn
+        self.name = name
+        self.params = params
+        self.accepts = accepts
+        self.produces = produces
+        self.each = each
+        self.mutates = mutates
+        self.expands = expands
+        self.terminal = terminal
+
+
+def merge_documents(writers: List[PdfWriter], params: StepParams) -> PdfWriter:
+    merged = PdfWriter()
+    for writer in writers:
+        for page in writer.pages:
+            merged.add_page(page)
+    return merged
+
+
+def extract_document(writer: PdfWriter, params: ExtractParams) -> PdfWriter:
+    extracted = PdfWriter()
+    for index in parse_page_ranges(params.pages, len(writer.pages)):
+        extracted.add_page(writer.pages[index])
+    return extracted
+
+
+def split_document(writer: PdfWriter, params: SplitParams) -> List[PdfWriter]:
+    parts = []
+    for start in range(0, len(writer.pages), params.pages):
+        part = PdfWriter()
+        for page in writer.pages[start:start + params.pages]:
+            part.add_page(page)
+        parts.append(part)
+    return parts
+
+
+def rotate_document(writer: PdfWriter, params: RotateParams) -> PdfWriter:
+    for page in writer.pages:
+        page.rotate(params.angle)
+    return writer
+
+
+def watermark_document(writer: PdfWriter, params: PdfWatermarkParams) -> PdfWriter:
+    for page in writer.pages:
+        watermark_page(page, params.watermark_text, params.density)
+    return writer
+
+
+def compress_document(writer: PdfWriter, params: CompressParams) -> PdfWriter:
+    compress_pdf_writer(writer, params.compression_level, params.profile)
+    return writer
+
+
+def encrypt_document(writer: PdfWriter, params: EncryptParams) -> PdfWriter:
+    writer.encrypt(params.password)
+    return writer
+
+
+def render_document(writer: PdfWriter, params: ToImagesParams) -> List[Image.Image]:
+    # poppler 只能读文件：序列化一次后渲染为无压缩 TIFF，读回内存后立即删除
+    temp_dir = tempfile.mkdtemp()
+    try:
+        pdf_path = os.path.join(temp_dir, "input.pdf")
+        with stage("write"), open(pdf_path, "wb") as output:
+            writer.write(output)
+        images = []
+        max_pixels = limit_max_pixels(params.max_pixels)
+        for image_path in iter_pdf_images(pdf_path, temp_dir, "tiff", 1, params.dpi, width=params.width,
+                                          height=params.height, max_pixels=max_pixels, color=params.color):
+            image = Image.open(image_path)
+            image.load()
+            os.remove(image_path)
+            images.append(image)
+        return images
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def watermark_image(image: Image.Image, params: ImageWatermarkParams) -> Image.Image:
+    return add_watermark(image, params.watermark_text, params.position, params.opacity, params.scale)
+
+
+def remove_image_background(image: Image.Image, params: StepParams) -> Image.Image:
+    with stage("inference"):
+        return remove(image, session=get_rembg_session())
+
+
+def join_documents(images: List[Image.Image], params: JoinParams) -> Image.Image:
+    return join_loaded(images, params.direction, params.columns)
+
+
+# 操作名与对应的接口路径一致
+OPERATIONS: Dict[str, Operation] = {
+    "pdf.merge": Operation(merge_documents, "merge", StepParams, DocumentKind.PDF, DocumentKind.PDF, each=False),
+    "pdf.extract": Operation(extract_document, "extract", ExtractParams, DocumentKind.PDF, DocumentKind.PDF),
+    "pdf.split": Operation(split_document, "split", SplitParams, DocumentKind.PDF, DocumentKind.PDF,
+                           expands=True),
+    "pdf.rotate": Operation(rotate_document, "rotate", RotateParams, DocumentKind.PDF, DocumentKind.PDF,
+                            mutates=True),
+    "pdf.add-watermark": Operation(watermark_document, "watermark", PdfWatermarkParams, DocumentKind.PDF,
+                                   DocumentKind.PDF, mutates=True),
+    "pdf.compress": Operation(compress_document, "compress", CompressParams, DocumentKind.PDF, DocumentKind.PDF,
+                              mutates=True),
+    "pdf.encrypt": Operation(encrypt_document, "encrypt", EncryptParams, DocumentKind.PDF, DocumentKind.PDF,
+                             mutates=True, terminal=True),
+    # 渲染前要写出 PDF，PdfWriter.write 会修改文档，共享的输入同样先复制
+    "pdf.to-images": Operation(render_document, "to_images", ToImagesParams, DocumentKind.PDF, DocumentKind.IMAGE,
+                               mutates=True, expands=True),
+    "image.add-watermark": Operation(watermark_image, "image_watermark", ImageWatermarkParams, DocumentKind.IMAGE,
+                                     DocumentKind.IMAGE, mutates=True),
+    "image.remove-background": Operation(remove_image_background, "remove_background", StepParams,
+                                         DocumentKind.IMAGE, DocumentKind.IMAGE),
+    "image.join": Operation(join_documents, "join", JoinParams, DocumentKind.IMAGE, DocumentKind.IMAGE, each=False),
+}
+
+
+def document_kind(filename: Optional[str]) -> DocumentKind:
+    return DocumentKind.PDF if (filename or "").lower().endswith(".pdf") else DocumentKind.IMAGE
+
+
+def describe_errors(error: ValidationError) -> str:
+    messages = []
+    for item in error.errors():
+        location = ".".join(str(part) for part in item["loc"])
+        messages.append(f"{location}: {item['msg']}" if location else item["msg"])
+    return "; ".join(messages)
+
+
+def plan_pipeline(spec: str, filenames: List[Optional[str]]) -> Tuple[List[Step], List[str],
+                                                                      Dict[str, EncodeOptions], bool]:
+    # 在主进程中完成全部校验：节点引用、环、参数以及输入输出的文档类型，错误直接返回 400。
+    # 同时推断输出是否只有一个文档，是的话直接返回该文件而不是 ZIP
+    try:
+        parsed = PipelineSpec.model_validate_json(spec)
+    except ValidationError as e:
+        raise PipelineError(f"Invalid pipeline spec: {describe_errors(e)}")
+
+    steps = []
+    for item in parsed.steps:
+        operation = OPERATIONS.get(item.op)
+        if operation is None:
+            raise PipelineError(f"Step {item.id} has unknown operation {item.op}")
+        try:
+            params = operation.params.model_validate(item.params)
+        except ValidationError as e:
+            raise PipelineError(f"Step {item.id} has invalid params: {describe_errors(e)}")
+        steps.append(Step(item.id, item.op, item.inputs, params.model_dump(mode="json")))
+    steps = order_steps(steps, len(filenames))
+
+    ops = {step.id: step.op for step in steps}
+    kinds: Dict[str, DocumentKind] = {}
+    # 每个节点产出的文档数，无法预先确定时为 None
+    counts: Dict[str, Optional[int]] = {}
+    for index, filename in enumerate(filenames):
+        kinds[f"file:{index}"] = document_kind(filename)
+        counts[f"file:{index}"] = 1
+    for step in steps:
+        operation = OPERATIONS[step.op]
+        for ref in step.inputs:
+            if ref in ops and OPERATIONS[ops[ref]].terminal:
+                raise PipelineError(f"Step {step.id} cannot use the output of {ref}")
+            if kinds[ref] != operation.accepts:
+                raise PipelineError(f"Step {step.id} ({step.op}) expects {operation.accepts.value} input, "
+                                    f"got {kinds[ref].value} from {ref}")
+        kinds[step.id] = operation.produces
+        if not operation.each:
+            counts[step.id] = 1
+        elif operation.expands or any(counts[ref] is None for ref in step.inputs):
+            counts[step.id] = None
+        else:
+            counts[step.id] = sum(counts[ref] for ref in step.inputs)
+
+    outputs = parsed.outputs or default_outputs(steps)
+    for ref in outputs:
+        if ref not in kinds or file_index(ref) is not None:
+            raise PipelineError(f"Unknown output step {ref}")
+    outputs = list(dict.fromkeys(outputs))
+
+    encodings = {item.id: item.encode.options() for item in parsed.steps if kinds[item.id] == DocumentKind.IMAGE}
+    single = len(outputs) == 1 and counts[outputs[0]] == 1
+    return steps, outputs, encodings, single
+
+
+def load_document(data: bytes, filename: Optional[str]) -> Document:
+    # 每个输入只解析一次，之后的节点都在内存中的文档上操作
+    if document_kind(filename) == DocumentKind.PDF:
+        reader = open_pdf(data)
+        if reader.is_encrypted:
+            reader.decrypt("")
+        with stage("pipeline.load"):
+            return PdfWriter(clone_from=reader)
+    options = EncodeOptions()
+    image = prepare_image(open_image(data, options), options)
+    image.load()
+    return image
+
+
+def copy_document(document: Document) -> Document:
+    if isinstance(document, Image.Image):
+        return document.copy()
+    copied = PdfWriter()
+    for page in document.pages:
+        copied.add_page(page)
+    return copied
+
+
+def execute_step(step: Step, inputs: List[List[Document]], shared: List[bool]) -> List[Document]:
+    operation = OPERATIONS[step.op]
+    params = operation.params.model_validate(step.params)
+    documents = []
+    for values, is_shared in zip(inputs, shared):
+        # 输入还会被其他节点或输出使用时，原地修改的操作在副本上执行
+        documents += [copy_document(value) for value in values] if operation.mutates and is_shared else values
+
+    try:
+        with stage(f"pipeline.{step.op}"):
+            if not operation.each:
+                return [operation.fn(documents, params)]
+            results = []
+            for document in documents:
+                result = operation.fn(document, params)
+                results += result if isinstance(result, list) else [result]
+            return results
+    except PageRangeError as e:
+        raise PipelineError(f"Step {step.id}: {e}")
+
+
+def serialize_output(step_id: str, documents: List[Document],
+                     options: Optional[EncodeOptions]) -> Iterator[Tuple[str, bytes, str]]:
+    # 一个节点产出多个文档时按序号命名
+    for number, document in enumerate(documents, 1):
+        name = f"{step_id}_{number}" if len(documents) > 1 else step_id
+        if isinstance(document, Image.Image):
+            with stage("encode"):
+                yield f"{name}.{options.extension}", encode_image(document, options), options.media_type
+        else:
+            yield f"{name}.pdf", write_pdf(document), "application/pdf"
+
+
+def iter_pipeline(steps: List[Step], outputs: List[str], encodings: Dict[str, EncodeOptions],
+                  sources: List[Tuple[bytes, Optional[str]]]) -> Iterator[Tuple[str, bytes, str]]:
+    # 整个流水线作为一个进程池任务执行，输出节点完成后在执行它的线程里序列化，随后回传
+    def load(index: int) -> List[Document]:
+        return [load_document(*sources[index])]
+
+    def serialize(step_id: str, documents: List[Document]) -> List[Tuple[str, bytes, str]]:
+        record_pages("pipeline", len(documents))
+        return list(serialize_output(step_id, documents, encodings.get(step_id)))
+
+    for _, entries in run_steps(steps, outputs, load, execute_step, serialize):
+        yield from entries
+
+
+async def pipeline_entries(results: AsyncIterator[Tuple[str, bytes, str]]) -> AsyncIterator[Tuple[str, bytes]]:
+    try:
+        async for name, data, _ in results:
+            yield name, data
+    finally:
+        await results.aclose()
+
+
+@pipeline_route.post("")
+async def run_pipeline(
+        files: List[UploadFile] = File(...),
+        spec: str = Form(...)  # JSON：{"steps": [{"id", "op", "inputs", "params", "encode"}], "outputs": [...]}
+):
+    try:
+        steps, outputs, encodings, single = plan_pipeline(spec, [file.filename for file in files])
+    except PipelineError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        cache_key = None
+        # 任一节点的操作不允许缓存（默认 encrypt）时整个流水线都不缓存
+        if all(result_cache.enabled(OPERATIONS[step.op].name) for step in steps):
+            cache_key = result_cache.key("pipeline", await upload_digest(*files),
+                                         steps=[(step.id, step.op, step.inputs, step.params) for step in steps],
+                                         outputs=outputs,
+                                         encodings={key: value.cache_params() for key, value in encodings.items()})
+        cached = result_cache.response(cache_key)
+        if cached is not None:
+            return cached
+
+        sources = [(await read_upload(file), file.filename) for file in files]
+        results = pool.iterate("pipeline", iter_pipeline, steps, outputs, encodings, sources)
+
+        if single:
+            # 只有一个输出文档时直接返回该文件
+            (name, data, media_type), = [result async for result in results]
+            await run_in_threadpool(result_cache.store_bytes, cache_key, data, media_type, name)
+            return Response(data, media_type=media_type,
+                            headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+        entries = await prefetch(pipeline_entries(results))
+        return zip_response(entries, "pipeline.zip", cache_key=cache_key)
+
+    except PipelineError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -0,0 +1,103 @@
+import os
+import random
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List
+
+from PIL import Image
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4, letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# 生成的测试文档缓存目录，同一个名字的文档只生成一次
+CORPUS_DIR = os.getenv('BENCH_CORPUS_DIR') or os.path.join(tempfile.gettempdir(), "convertflow-bench-corpus")
+SEED = 20240801
+# 生成逻辑变化时递增，避免读到旧的缓存文档
+CORPUS_VERSION = 1
+
+WORDS = ("convert", "flow", "document", "page", "image", "render", "stream", "cache", "worker", "latency",
+         "throughput", "merge", "split", "rotate", "compress", "watermark", "encrypt", "layout", "font")
+
+
+@dataclass
+class Document:
+    name: str
+    kind: str  # pdf / image
+    pages: int
+    path: str
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+# 名称 -> (类型, 页数/图片数, 生成参数)
+PRESETS: Dict[str, tuple] = {
+    "text-1": ("pdf", 1, {"images": False}),
+    "text-100": ("pdf", 100, {"images": False}),
+    "text-1000": ("pdf", 1000, {"images": False}),
+    "text-5000": ("pdf", 5000, {"images": False}),
+    "image-1": ("pdf", 1, {"images": True}),
+    "image-20": ("pdf", 20, {"images": True}),
+    "image-200": ("pdf", 200, {"images": True}),
+    "photo-small": ("image", 4, {"size": (640, 480)}),
+    "photo-large": ("image", 4, {"size": (4000, 3000)}),
+}
+
+
+def noise_image(rng: random.Random, size, mode: str = "RGB") -> Image.Image:
+    # Pillow 的 effect_noise 不能指定种子，这里用固定种子生成低分辨率噪声再放大，既确定又有一定的纹理
+    small = (max(1, size[0] // 8), max(1, size[1] // 8))
+    channels = len(mode)
+    data = bytes(rng.getrandbits(8) for _ in range(small[0] * small[1] * channels))
+    return Image.frombytes(mode, small, data).resize(size, Image.BILINEAR)
+
+
+def generate_pdf(path: str, pages: int, images: bool, seed: int = SEED):
+    rng = random.Random(seed)
+    # 扫描件里的图片一般是二进制的 Flate/DCT 流，关闭 reportlab 默认的 ASCII85 编码
+    rl_config.useA85 = 0
+    # invariant 去掉创建时间和随机 ID，保证每次生成的字节完全一致
+    c = canvas.Canvas(path, pagesize=letter, invariant=1, pageCompression=1)
+    scans = [ImageReader(noise_image(rng, (1275, 1650))) for _ in range(4)] if images else []
+    for i in range(pages):
+        # 混合不同页面尺寸，覆盖按页面尺寸处理的逻辑
+        c.setPageSize(A4 if i % 7 == 3 else letter)
+        width, height = c._pagesize
+        if images:
+            c.drawImage(scans[i % len(scans)], 0, 0, width, height)
+        c.setFont("Helvetica", 10)
+        y = height - 50
+        while y > 50:
+            c.drawString(40, y, " ".join(rng.choice(WORDS) for _ in range(14)))
+            y -= 14
+        c.drawString(width / 2, 20, str(i + 1))
+        c.showPage()
+    c.save()
+
+
+def generate_image(path: str, size, seed: int):
+    noise_image(random.Random(seed), size).save(path, "PNG")
+
+
+def load(name: str) -> List[Document]:
+    # 返回文档列表，图片类型的预设会生成多张图片
+    kind, count, options = PRESETS[name]
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    if kind == "pdf":
+        path = os.path.join(CORPUS_DIR, f"{name}-v{CORPUS_VERSION}.pdf")
+        if not os.path.exists(path):
+            generate_pdf(path + ".part", count, options["images"])
+            os.replace(path + ".part", path)
+        return [Document(name, kind, count, path)]
+
+    documents = []
+    for i in range(count):
+        path = os.path.join(CORPUS_DIR, f"{name}-v{CORPUS_VERSION}-{i}.png")
+        if not os.path.exists(path):
+            generate_image(path + ".part", options["size"], SEED + i)
+            os.replace(path + ".part", path)
+        documents.append(Document(name, kind, 1, path))
+    return documents
+
@@ -0,0 +1,439 @@
+# 转换接口的基准测试
+#
+# 在 backend 目录下运行：
+#   python -m benchmarks.run --documents text-1,text-100,image-20,photo-small --repeat 5 --output bench.json
+#   python -m benchmarks.run --compare bench.json --threshold 0.1
+#
+# 每个用例在独立的子进程中执行，统计延迟分位数、峰值 RSS（包括进程池 worker）和每秒处理页数
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+from benchmarks import corpus
+
+DEFAULT_DOCUMENTS = "text-1,text-100,image-20,photo-small"
+# 抽取用例最多抽取的页数，不超过文档页数
+EXTRACT_PAGES = 2
+
+
+@dataclass
+class Case:
+    name: str
+    suite: str  # function / route
+    kind: str  # 适用的文档类型 pdf / image
+    # 接收文档列表，返回每次迭代执行的函数和处理的页数
+    setup: Callable[[List[corpus.Document]], tuple]
+    requires: Optional[str] = None  # 依赖的外部命令
+
+
+class MissingDependency(Exception):
+    # 缺少可选的 Python 包（例如 rembg）时跳过用例，其他错误都算失败；外部命令在运行前通过 Case.requires 检查
+    pass
+
+
+def has_poppler() -> bool:
+    return shutil.which("pdftoppm") is not None
+
+
+def extract_count(document: corpus.Document) -> int:
+    return min(EXTRACT_PAGES, document.pages)
+
+
+def extract_range(document: corpus.Document) -> str:
+    return f"1-{extract_count(document)}"
+
+
+def function_cases() -> List[Case]:
+    from api import image, pdf
+
+    def pdf_case(name: str, fn: Callable[[bytes, corpus.Document], object], factor: int = 1,
+                 requires: Optional[str] = None,
+                 pages: Optional[Callable[[corpus.Document], int]] = None) -> Case:
+        # pages 指定时按实际处理的页数计算吞吐，例如只抽取其中几页
+        def setup(documents):
+            document = documents[0]
+            data = document.read()
+            return (lambda: fn(data, document)), pages(document) if pages else document.pages * factor
+
+        return Case(name, "function", "pdf", setup, requires)
+
+    def convert_pdf_to_images(data: bytes, document: corpus.Document):
+        output = tempfile.mkdtemp()
+        try:
+            pdf.convert_pdf_to_images(document.path, output, "png", 1, 72)
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+
+    def join_setup(documents):
+        paths = [document.path for document in documents]
+
+        def run():
+            output = tempfile.mkdtemp()
+            try:
+                image.join_image_files(paths, image.JoinDirection.VERTICAL, os.path.join(output, "joined.png"))
+            finally:
+                shutil.rmtree(output, ignore_errors=True)
+
+        return run, len(documents)
+
+    def watermark_setup(documents):
+        contents = [document.read() for document in documents]
+        return (lambda: [image.add_watermark_to_image_bytes(data, "ConvertFlow") for data in contents]), \
+            len(documents)
+
+    return [
+        pdf_case("split_pdf", lambda data, _: pdf.split_pdf(data, 10)),
+        pdf_case("merge_pdfs", lambda data, _: pdf.merge_pdfs([data, data]), factor=2),
+        pdf_case("extract_pdf_pages", lambda data, document: pdf.extract_pdf_pages(data, extract_range(document)),
+                 pages=extract_count),
+        pdf_case("encrypt_pdf", lambda data, _: pdf.encrypt_pdf(data, "secret")),
+        pdf_case("rotate_pdf_file", lambda data, _: pdf.rotate_pdf_file(data, 90)),
+        pdf_case("add_watermark_to_pdf_file",
+                 lambda data, _: pdf.add_watermark_to_pdf_file(data, "CONFIDENTIAL", pdf.WatermarkDensity.MEDIUM)),
+        pdf_case("compress_pdf_file", lambda data, _: pdf.compress_pdf_file(data, 6, "ebook")),
+        pdf_case("convert_pdf_to_images", convert_pdf_to_images, requires="pdftoppm"),
+        Case("join_image_files", "function", "image", join_setup),
+        Case("add_watermark_to_image_bytes", "function", "image", watermark_setup),
+    ]
+
+
+def route_cases() -> List[Case]:
+    def pdf_case(name: str, path: str, form: Union[Dict[str, str], Callable[[corpus.Document], Dict[str, str]]],
+                 copies: int = 1, requires: Optional[str] = None,
+                 pages: Optional[Callable[[corpus.Document], int]] = None) -> Case:
+        # form 可以是按文档生成表单的函数，例如页码范围取决于文档页数
+        def setup(documents):
+            document = documents[0]
+            data = document.read()
+            field = "files" if copies > 1 else "file"
+            files = [(field, (f"{i}.pdf", data, "application/pdf")) for i in range(copies)]
+            fields = form(document) if callable(form) else form
+            return (lambda client: check(client.post(path, files=files, data=fields))), \
+                pages(document) if pages else document.pages * copies
+
+        return Case(name, "route", "pdf", setup, requires)
+
+    def image_case(name: str, path: str, form: Dict[str, str]) -> Case:
+        def setup(documents):
+            files = [("files", (os.path.basename(document.path), document.read(), "image/png"))
+                     for document in documents]
+            return (lambda client: check(client.post(path, files=files, data=form))), len(documents)
+
+        return Case(name, "route", "image", setup)
+
+    return [
+        pdf_case("POST /api/pdf/split", "/api/pdf/split", {"pages": "10"}),
+        pdf_case("POST /api/pdf/merge", "/api/pdf/merge", {}, copies=2),
+        pdf_case("POST /api/pdf/extract", "/api/pdf/extract", lambda document: {"pages": extract_range(document)},
+                 pages=extract_count),
+        pdf_case("POST /api/pdf/encrypt", "/api/pdf/encrypt", {"password": "secret"}),
+        pdf_case("POST /api/pdf/rotate", "/api/pdf/rotate", {"angle": "90"}),
+        pdf_case("POST /api/pdf/add-watermark", "/api/pdf/add-watermark",
+                 {"watermark_text": "CONFIDENTIAL", "density": "medium"}),
+        pdf_case("POST /api/pdf/compress", "/api/pdf/compress", {"profile": "ebook"}),
+        pdf_case("POST /api/pdf/to-images", "/api/pdf/to-images", {"dpi": "72"}, requires="pdftoppm"),
+        pdf_case("POST /api/pipeline", "/api/pipeline", {"spec": json.dumps({"steps": [
+            {"id": "merged", "op": "pdf.merge", "inputs": ["file:0", "file:1"]},
+            {"id": "watermarked", "op": "pdf.add-watermark", "inputs": ["merged"],
+             "params": {"watermark_text": "CONFIDENTIAL"}},
+            {"id": "compressed", "op": "pdf.compress", "inputs": ["watermarked"]},
+        ]})}, copies=2),
+        image_case("POST /api/image/add-watermark", "/api/image/add-watermark", {"watermark_text": "ConvertFlow"}),
+        image_case("POST /api/image/join", "/api/image/join", {"direction": "vertical"}),
+    ]
+
+
+def check(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+    return response
+
+
+def create_app():
+    # 只挂载转换相关的路由，用户模块依赖 PostgreSQL
+    from contextlib import asynccontextmanager
+
+    from fastapi import FastAPI
+
+    from api.image import image_route
+    from api.pdf import pdf_route
+    from api.pipeline import pipeline_route
+    from core.executor import pool
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        pool.start()
+        yield
+        pool.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(pdf_route)
+    app.include_router(image_route)
+    app.include_router(pipeline_route)
+    return app
+
+
+def read_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+
+def child_pids(pid: int) -> List[int]:
+    pids = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path) as f:
+                pids.extend(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            continue
+    return pids
+
+
+class PeakRss:
+    # 定时采样当前进程和所有子进程（进程池 worker、poppler）的 RSS 之和，记录峰值
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        pid = os.getpid()
+        pending, total = [pid], 0
+        while pending:
+            current = pending.pop()
+            total += read_rss_kb(current)
+            pending.extend(child_pids(current))
+        self.peak_kb = max(self.peak_kb, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        if self.peak_kb == 0:
+            # 没有 /proc 的平台退回到 getrusage，只能拿到单个进程的峰值
+            scale = 1024 if sys.platform == "darwin" else 1
+            usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            self.peak_kb = usage // scale
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def execute_case(case_name: str, suite: str, document_name: str, repeat: int, warmup: int) -> Dict:
+    cases = function_cases() if suite == "function" else route_cases()
+    case = next(c for c in cases if c.name == case_name)
+    documents = corpus.load(document_name)
+    run, pages = case.setup(documents)
+
+    client = None
+    if suite == "route":
+        from fastapi.testclient import TestClient
+        client = TestClient(create_app())
+        client.__enter__()
+        call = lambda: run(client)
+    else:
+        call = run
+
+    latencies = []
+    try:
+        with PeakRss() as rss:
+            for _ in range(warmup):
+                call()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                call()
+                latencies.append(time.perf_counter() - start)
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+
+    p50 = percentile(latencies, 50)
+    return {
+        "name": f"{suite}:{case.name}[{document_name}]",
+        "suite": suite,
+        "case": case.name,
+        "document": document_name,
+        "pages": pages,
+        "iterations": repeat,
+        "latency_ms": {
+            "p50": round(p50 * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "min": round(min(latencies) * 1000, 3),
+        },
+        "pages_per_sec": round(pages / p50, 3) if p50 > 0 else None,
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+    }
+
+
+def _case_worker(queue, *args):
+    try:
+        queue.put(("ok", execute_case(*args)))
+    except ImportError as e:
+        queue.put(("missing", f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        queue.put(("error", f"{type(e).__name__}: {e}"))
+
+
+def run_isolated(*args) -> Dict:
+    # 每个用例一个新进程，峰值 RSS 互不影响
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_case_worker, args=(queue, *args))
+    process.start()
+    status, value = queue.get()
+    process.join()
+    if status == "missing":
+        raise MissingDependency(value)
+    if status == "error":
+        raise RuntimeError(value)
+    return value
+
+
+def git_info() -> Dict:
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.check_output(["git", *args], stderr=subprocess.DEVNULL, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[Dict]:
+    with open(baseline_path) as f:
+        baseline = {item["name"]: item for item in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None:
+            continue
+        ratio = result["latency_ms"]["p50"] / previous["latency_ms"]["p50"] if previous["latency_ms"]["p50"] else 1
+        result["baseline_p50_ms"] = previous["latency_ms"]["p50"]
+        result["p50_change"] = round(ratio - 1, 4)
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ConvertFlow conversion functions and routes")
+    parser.add_argument("--suite", choices=("function", "route", "all"), default="all")
+    parser.add_argument("--documents", default=DEFAULT_DOCUMENTS,
+                        help=f"comma separated presets: {', '.join(corpus.PRESETS)}")
+    parser.add_argument("--cases", default="", help="comma separated substrings to select cases")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON produced by a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown before failing")
+    args = parser.parse_args(argv)
+
+    # 基准测试不走结果缓存，rembg 模型也不预加载
+    os.environ["CACHE_MAX_BYTES"] = "0"
+    os.environ.setdefault("REMBG_PRELOAD", "false")
+
+    documents = [name.strip() for name in args.documents.split(",") if name.strip()]
+    for name in documents:
+        if name not in corpus.PRESETS:
+            parser.error(f"unknown document preset: {name}")
+        corpus.load(name)
+
+    suites = ("function", "route") if args.suite == "all" else (args.suite,)
+    filters = [item.strip() for item in args.cases.split(",") if item.strip()]
+    cases = [case for case in function_cases() + route_cases() if case.suite in suites]
+
+    results, skipped, failed = [], [], []
+    for case in cases:
+        if filters and not any(item in case.name for item in filters):
+            continue
+        for name in documents:
+            if corpus.PRESETS[name][0] != case.kind:
+                continue
+            label = f"{case.suite}:{case.name}[{name}]"
+            if case.requires and shutil.which(case.requires) is None:
+                skipped.append({"name": label, "reason": f"{case.requires} not found"})
+                continue
+            print(f"running {label}", file=sys.stderr)
+            try:
+                results.append(run_isolated(case.name, case.suite, name, args.repeat, args.warmup))
+            except MissingDependency as e:
+                skipped.append({"name": label, "reason": str(e)})
+            except RuntimeError as e:
+                failed.append({"name": label, "error": str(e)})
+
+    report = {
+        **git_info(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "repeat": args.repeat,
+        "results": results,
+        "skipped": skipped,
+        "failed": failed,
+    }
+
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    for result in results:
+        latency = result["latency_ms"]
+        change = f" ({result['p50_change']:+.1%})" if "p50_change" in result else ""
+        print(f"{result['name']:<70} p50 {latency['p50']:>10.1f} ms{change}  p99 {latency['p99']:>10.1f} ms  "
+              f"{result['pages_per_sec'] or 0:>9.1f} pages/s  {result['peak_rss_mb']:>7.1f} MB", file=sys.stderr)
+    for item in skipped:
+        print(f"skipped {item['name']}: {item['reason']}", file=sys.stderr)
+    for result in regressions:
+        print(f"REGRESSION {result['name']}: p50 {result['baseline_p50_ms']} -> {result['latency_ms']['p50']} ms",
+              file=sys.stderr)
+    # 用例失败说明接口已经坏了，和性能回退一样返回非零
+    for item in failed:
+        print(f"FAILED {item['name']}: {item['error']}", file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import zipfile
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from core.executor import POOL_MAX_QUEUE, POOL_MAX_WORKERS, pool
+from core.metrics import stage
+
+load_dotenv()
+
+# 批量接口同时提交到进程池的文件数，0 表示 worker 数；最多占用一半的等待队列，给其他请求留出名额
+BATCH_CONCURRENCY = max(1, min(int(os.getenv('BATCH_CONCURRENCY', 0)) or POOL_MAX_WORKERS, POOL_MAX_QUEUE // 2))
+# 单个批量请求最多处理的文件数，ZIP 中的文件分别计数
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 1000))
+# 单个文件（包括 ZIP 解压后的文件）的大小上限，超过的文件在清单中记为错误
+BATCH_MAX_FILE_BYTES = int(os.getenv('BATCH_MAX_FILE_BYTES', 100 * 1024 * 1024))
+
+MANIFEST_NAME = "manifest.json"
+
+
+class BatchItem:
+    # 批量请求中的一个文件，内容在轮到它处理时才从磁盘读取
+    def __init__(self, index: int, name: str, path: str, member: Optional[str] = None):
+        self.index = index
+        self.name = name
+        self.path = path
+        self.member = member
+
+    def read(self) -> bytes:
+        # ZIP 中声明的解压大小先检查一次；声明可能是伪造的，读取时最多只解压到上限多一个字节
+        if self.member is None:
+            with open(self.path, "rb") as f:
+                data = f.read(BATCH_MAX_FILE_BYTES + 1)
+        else:
+            with zipfile.ZipFile(self.path) as archive:
+                info = archive.getinfo(self.member)
+                if info.file_size > BATCH_MAX_FILE_BYTES:
+                    raise self._too_large()
+                with archive.open(info) as member:
+                    data = member.read(BATCH_MAX_FILE_BYTES + 1)
+        if len(data) > BATCH_MAX_FILE_BYTES:
+            raise self._too_large()
+        return data
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"File exceeds the {BATCH_MAX_FILE_BYTES} byte limit")
+
+
+def unique_name(name: str, used: Set[str]) -> str:
+    # 不同目录或不同 ZIP 中的同名文件加序号区分，也不能与清单文件重名
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    number = 1
+    while candidate in used or candidate == MANIFEST_NAME:
+        candidate = f"{stem}_{number}{ext}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def list_members(path: str) -> List[str]:
+    with zipfile.ZipFile(path) as archive:
+        return [info.filename for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+
+
+async def stage_uploads(files: List[UploadFile], temp_dir: str) -> List[BatchItem]:
+    # 上传文件在接口返回前复制到临时目录（响应流式发送时上传文件已经关闭），ZIP 展开为其中的每个文件
+    items: List[BatchItem] = []
+    used: Set[str] = set()
+    for index, file in enumerate(files):
+        filename = os.path.basename(file.filename or "file")
+        path = os.path.join(temp_dir, f"{index}_{filename}")
+        with stage("upload"), open(path, "wb") as temp_file:
+            await run_in_threadpool(shutil.copyfileobj, file.file, temp_file)
+
+        if filename.lower().endswith(".zip"):
+            try:
+                members = await run_in_threadpool(list_members, path)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Invalid ZIP file: {filename}")
+            for member in members:
+                items.append(BatchItem(len(items), unique_name(os.path.basename(member), used), path, member))
+        else:
+            items.append(BatchItem(len(items), unique_name(filename, used), path))
+
+        if len(items) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_FILES} files")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No files provided")
+    return items
+
+
+async def batch_entries(items: List[BatchItem], process: Callable[[BatchItem, bytes], Awaitable[Tuple[bytes, dict]]],
+                        temp_dir: str, concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[Tuple[str, bytes]]:
+    # 最多 concurrency 个文件同时处理，结果按完成顺序产出；单个文件失败只记录在清单中，不影响其他文件。
+    # 清单按输入顺序排列，作为最后一个条目写入 ZIP。
+    # 开始前一次性向进程池预留 concurrency 个名额（不足时整个请求 503），process 应使用 pool.run_reserved 提交
+    manifest: List[Optional[dict]] = [None] * len(items)
+    slots = min(max(1, concurrency), len(items))
+    pool.reserve(slots)
+
+    async def run(item: BatchItem) -> Tuple[BatchItem, Optional[bytes], dict]:
+        try:
+            data = await run_in_threadpool(item.read)
+            output, details = await process(item, data)
+            return item, output, {"status": "ok", "input_bytes": len(data), "output_bytes": len(output), **details}
+        except HTTPException as e:
+            return item, None, {"status": "error", "error": e.detail}
+        except Exception as e:
+            return item, None, {"status": "error", "error": str(e) or type(e).__name__}
+
+    queue = iter(items)
+    pending = {asyncio.ensure_future(run(item)) for item in itertools.islice(queue, max(1, concurrency))}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item, output, details = task.result()
+                manifest[item.index] = {"file": item.name, **details}
+                following = next(queue, None)
+                if following is not None:
+                    pending.add(asyncio.ensure_future(run(following)))
+                if output is not None:
+                    yield item.name, output
+
+        failed = sum(1 for entry in manifest if entry["status"] != "ok")
+        summary = {"total": len(items), "succeeded": len(items) - failed, "failed": failed, "files": manifest}
+        yield MANIFEST_NAME, json.dumps(summary, ensure_ascii=False, indent=2).encode()
+    finally:
+        for task in pending:
+            task.cancel()
+        pool.release(slots)
+        shutil.rmtree(temp_dir, ignore_errors=True)
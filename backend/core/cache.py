@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from core.metrics import stage
+
+load_dotenv()
+
+# 转换结果缓存配置，CACHE_MAX_BYTES 为 0 时关闭缓存
+CACHE_DIR = os.getenv('CACHE_DIR') or os.path.join(tempfile.gettempdir(), "convertflow-cache")
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 2 * 1024 ** 3))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 24 * 3600))
+# 不缓存的操作，例如加密结果包含密码，不应该落盘
+CACHE_DISABLED_OPERATIONS = os.getenv('CACHE_DISABLED_OPERATIONS', 'encrypt')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class CacheWriter:
+    # 边写边缓存，只有完整写完调用 commit 后才对外可见
+    def __init__(self, cache: "ResultCache", key: str, meta: dict):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        self.cache.commit(self.key, self.temp_path, self.meta)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+# 以输入内容哈希和规范化参数为键的磁盘缓存，按总大小做 LRU 淘汰，过期时间由 ttl 控制
+class ResultCache:
+    def __init__(self, directory: str, max_bytes: int, ttl: int, disabled_operations: List[str]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disabled_operations = set(disabled_operations)
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if self.max_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def enabled(self, operation: str) -> bool:
+        return self.max_bytes > 0 and operation not in self.disabled_operations
+
+    def key(self, operation: str, digest: str, **params) -> Optional[str]:
+        if not self.enabled(operation):
+            return None
+        normalized = json.dumps(params, sort_keys=True, default=str)
+        return f"{operation}-" + hashlib.sha256(f"{operation}\0{digest}\0{normalized}".encode()).hexdigest()
+
+    def _paths(self, key: str):
+        data_path = os.path.join(self.directory, key)
+        return data_path, data_path + ".json"
+
+    def open(self, key: Optional[str]):
+        if key is None:
+            return None
+        operation = key.split("-", 1)[0]
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if time.time() - meta["created"] > self.ttl:
+                self._remove(key)
+                raise FileNotFoundError(key)
+            data_file = open(data_path, "rb")
+        except (FileNotFoundError, ValueError, KeyError):
+            self.misses[operation] = self.misses.get(operation, 0) + 1
+            return None
+
+        # 访问时间用于 LRU 淘汰
+        now = time.time()
+        os.utime(meta_path, (now, now))
+        self.hits[operation] = self.hits.get(operation, 0) + 1
+        return data_file, meta
+
+    def response(self, key: Optional[str]) -> Optional[StreamingResponse]:
+        entry = self.open(key)
+        if entry is None:
+            return None
+        data_file, meta = entry
+        headers = dict(meta.get("headers", {}))
+        headers["Content-Disposition"] = f'attachment; filename="{meta["filename"]}"'
+        headers["X-Cache"] = "HIT"
+        return StreamingResponse(iter_file(data_file), media_type=meta["media_type"], headers=headers)
+
+    def read_bytes(self, key: Optional[str]) -> Optional[Tuple[bytes, dict]]:
+        # 批量接口逐个文件复用单文件接口的缓存结果
+        entry = self.open(key)
+        if entry is None:
+            return None
+        data_file, meta = entry
+        with data_file:
+            return data_file.read(), meta
+
+    def writer(self, key: Optional[str], media_type: str, filename: str,
+               headers: Optional[dict] = None) -> Optional[CacheWriter]:
+        if key is None:
+            return None
+        return CacheWriter(self, key, {"media_type": media_type, "filename": filename, "headers": headers or {}})
+
+    def store_file(self, key: Optional[str], path: str, media_type: str, filename: str,
+                   headers: Optional[dict] = None):
+        writer = self.writer(key, media_type, filename, headers)
+        if writer is None:
+            return
+        with stage("cache_store"), open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+            writer.commit()
+
+    def store_bytes(self, key: Optional[str], data: bytes, media_type: str, filename: str,
+                    headers: Optional[dict] = None):
+        writer = self.writer(key, media_type, filename, headers)
+        if writer is None:
+            return
+        with stage("cache_store"):
+            writer.write(data)
+            writer.commit()
+
+    def commit(self, key: str, temp_path: str, meta: dict):
+        data_path, meta_path = self._paths(key)
+        meta = {**meta, "created": time.time(), "size": os.path.getsize(temp_path)}
+        os.replace(temp_path, data_path)
+        with open(meta_path + ".part", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".part", meta_path)
+        self.evict()
+
+    def _remove(self, key: str):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        # 先删除过期条目，再按最近访问时间从旧到新删除，直到总大小低于上限
+        with self._lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                # 清理异常中断留下的半成品
+                if entry.name.endswith(".part") and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+                if not entry.name.endswith(".json"):
+                    continue
+                key = entry.name[:-len(".json")]
+                try:
+                    stat = entry.stat()
+                    with open(entry.path) as f:
+                        meta = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if now - meta.get("created", 0) > self.ttl:
+                    self._remove(key)
+                    continue
+                entries.append((stat.st_mtime, meta.get("size", 0), key))
+                total += meta.get("size", 0)
+
+            entries.sort()
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+
+    def stats(self) -> Dict:
+        return {"hits": dict(self.hits), "misses": dict(self.misses)}
+
+
+async def iter_file(data_file) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            data = await run_in_threadpool(data_file.read, CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        data_file.close()
+
+
+async def tee(chunks: AsyncIterator[bytes], cache_writer: Optional[CacheWriter]) -> AsyncIterator[bytes]:
+    # 把流式响应的字节同时写入结果缓存，完整发送后才提交
+    try:
+        async for chunk in chunks:
+            if cache_writer is not None:
+                cache_writer.write(chunk)
+            yield chunk
+        if cache_writer is not None:
+            await run_in_threadpool(cache_writer.commit)
+    except BaseException:
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+
+
+def content_digest(*contents: bytes) -> str:
+    h = hashlib.sha256()
+    for data in contents:
+        h.update(data)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+async def upload_digest(*files: UploadFile) -> str:
+    # 计算上传内容的哈希，读取后把文件指针恢复到开头，结果与 content_digest 一致
+    def digest() -> str:
+        h = hashlib.sha256()
+        for file in files:
+            file.file.seek(0)
+            for chunk in iter(lambda: file.file.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+            h.update(b"\0")
+            file.file.seek(0)
+        return h.hexdigest()
+
+    with stage("digest"):
+        return await run_in_threadpool(digest)
+
+
+result_cache = ResultCache(
+    CACHE_DIR,
+    CACHE_MAX_BYTES,
+    CACHE_TTL,
+    [name.strip() for name in CACHE_DISABLED_OPERATIONS.split(',') if name.strip()]
+)
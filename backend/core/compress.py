@@ -0,0 +1,405 @@
+import hashlib
+import io
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+from dotenv import load_dotenv
+from pypdf import PdfWriter
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject,
+                           NullObject, NumberObject, PdfObject, StreamObject)
+
+from core.executor import pool
+from core.metrics import record_stage, stage
+from core.pdfobjects import iter_objects, replace_object, trailer_references
+
+load_dotenv()
+
+# 压缩时并行重编码图片的线程数，0 表示 CPU 核数除以 compress 的并发上限
+COMPRESS_THREADS = int(os.getenv('COMPRESS_THREADS', 0)) or pool.threads_per_task("compress")
+# 图片分辨率超过目标 DPI 的倍数后才降采样，避免对接近目标的图片做无意义的重采样
+DOWNSAMPLE_THRESHOLD = float(os.getenv('COMPRESS_DOWNSAMPLE_THRESHOLD', 1.5))
+
+
+class CompressionProfile(str, Enum):
+    SCREEN = "screen"
+    EBOOK = "ebook"
+    PRINT = "print"
+
+
+# 每个档位的目标 DPI 和 JPEG 质量
+PROFILE_SETTINGS = {
+    CompressionProfile.SCREEN: (72, 40),
+    CompressionProfile.EBOOK: (150, 60),
+    CompressionProfile.PRINT: (300, 80),
+}
+
+# 各阶段节省的字节数，按执行顺序
+STAGES = ("unused_resources", "images", "content_streams", "duplicates")
+
+
+def compress_pdf_writer(writer: PdfWriter, compression_level: int,
+                        profile: CompressionProfile) -> Dict[str, int]:
+    dpi, quality = PROFILE_SETTINGS[CompressionProfile(profile)]
+    saved = dict.fromkeys(STAGES, 0)
+
+    # 先删掉内容流里没有引用的资源，后面就不会再去重编码用不到的图片
+    with stage("compress.unused_resources"):
+        remove_unused_resources(writer)
+        saved["unused_resources"] = remove_orphans(writer)
+
+    with stage("compress.images"):
+        saved["images"] = compress_images(writer, dpi, quality)
+
+    if compression_level > 0:
+        start = time.perf_counter()
+        before = sum(contents_size(page) for page in writer.pages)
+        for page in writer.pages:
+            page.compress_content_streams(level=compression_level)
+        after = sum(contents_size(page) for page in writer.pages)
+        # 合并多个内容流后留下的旧对象也算在这一阶段
+        saved["content_streams"] = before - after + remove_orphans(writer)
+        record_stage("compress.content_streams", time.perf_counter() - start)
+
+    with stage("compress.duplicates"):
+        saved["duplicates"] = remove_duplicate_streams(writer)
+        saved["duplicates"] += remove_orphans(writer)
+    return saved
+
+
+def contents_size(page) -> int:
+    contents = page.get("/Contents")
+    if contents is None:
+        return 0
+    contents = contents.get_object()
+    streams = [item.get_object() for item in contents] if isinstance(contents, ArrayObject) else [contents]
+    return sum(len(stream._data) for stream in streams if isinstance(stream, StreamObject))
+
+
+def object_size(obj: PdfObject) -> int:
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer)
+    return buffer.tell()
+
+
+def iter_resources(writer: PdfWriter):
+    for page in writer.pages:
+        resources = page.get("/Resources")
+        if resources is not None:
+            yield page, resources.get_object()
+
+
+def remove_unused_resources(writer: PdfWriter):
+    # 只清理页面资源字典里的 /XObject 和 /Font。一个资源字典可能被多处内容使用：页面内容流、
+    # 表单 XObject、注释外观流、Type3 字形，没有自己 /Resources 的表单和外观流沿用外层（以及页面）的资源。
+    # 先收集使用每个资源字典的全部内容，某个名字在所有内容中都找不到才删除；有内容无法解码时该字典整体保留
+    usage: Dict[int, Tuple[DictionaryObject, List[bytes]]] = {}
+    undecodable = set()
+    visited = set()
+
+    def use(resources: DictionaryObject, data: bytes):
+        usage.setdefault(id(resources), (resources, []))[1].append(data)
+
+    def walk_stream(stream, resources: Optional[DictionaryObject], page_resources: Optional[DictionaryObject]):
+        if not isinstance(stream, StreamObject):
+            return
+        own = stream.get("/Resources")
+        if own is not None:
+            targets = [own.get_object()]
+        else:
+            targets = [r for r in (resources, page_resources) if r is not None]
+            if len(targets) == 2 and targets[0] is targets[1]:
+                targets = targets[:1]
+        key = (id(stream), tuple(id(target) for target in targets))
+        if key in visited:
+            return
+        visited.add(key)
+        try:
+            data = stream.get_data()
+        except Exception:
+            undecodable.update(id(target) for target in targets)
+            data = b""
+        for target in targets:
+            use(target, data)
+            walk_resources(target, page_resources)
+
+    def walk_resources(resources: DictionaryObject, page_resources: Optional[DictionaryObject]):
+        xobjects = resources.get("/XObject")
+        for ref in (xobjects.get_object().values() if xobjects is not None else []):
+            xobject = ref.get_object()
+            if isinstance(xobject, StreamObject) and xobject.get("/Subtype") == "/Form":
+                walk_stream(xobject, resources, page_resources)
+        fonts = resources.get("/Font")
+        for ref in (fonts.get_object().values() if fonts is not None else []):
+            font = ref.get_object()
+            if not isinstance(font, DictionaryObject) or font.get("/Subtype") != "/Type3":
+                continue
+            font_resources = font.get("/Resources")
+            inherited = font_resources.get_object() if font_resources is not None else resources
+            char_procs = font.get("/CharProcs")
+            for proc in (char_procs.get_object().values() if char_procs is not None else []):
+                walk_stream(proc.get_object(), inherited, page_resources)
+
+    def walk_appearances(page, page_resources: Optional[DictionaryObject]):
+        for annotation in page.get("/Annots", ArrayObject()).get_object():
+            annotation = annotation.get_object()
+            appearances = annotation.get("/AP") if isinstance(annotation, DictionaryObject) else None
+            if appearances is None:
+                continue
+            # /N /R /D 可以直接是外观流，也可以是按状态（例如复选框的 /On /Off）区分的字典
+            for appearance in appearances.get_object().values():
+                appearance = appearance.get_object()
+                if isinstance(appearance, StreamObject):
+                    walk_stream(appearance, page_resources, page_resources)
+                elif isinstance(appearance, DictionaryObject):
+                    for state in appearance.values():
+                        walk_stream(state.get_object(), page_resources, page_resources)
+
+    page_resources_list = []
+    for page in writer.pages:
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else None
+        if resources is not None:
+            try:
+                page_contents = page.get_contents()
+                data = page_contents.get_data() if page_contents is not None else b""
+            except Exception:
+                undecodable.add(id(resources))
+                data = b""
+            use(resources, data)
+            walk_resources(resources, resources)
+            page_resources_list.append(resources)
+        walk_appearances(page, resources)
+
+    pruned = set()
+    for resources in page_resources_list:
+        if id(resources) in undecodable or id(resources) in pruned:
+            continue
+        pruned.add(id(resources))
+        datas = usage[id(resources)][1]
+        for category in ("/XObject", "/Font"):
+            entries = resources.get(category)
+            if entries is None:
+                continue
+            entries = entries.get_object()
+            for name in list(entries.keys()):
+                # 只做字节查找，可能多保留，不会误删
+                if not any(name.encode() in data for data in datas):
+                    del entries[name]
+
+
+def remove_orphans(writer: PdfWriter) -> int:
+    # 从 Root 和 Info 出发标记可达对象，不可达的对象替换为 null
+    # 直接置为 None 会让 pypdf 写出的 xref 错位，所以保留对象编号
+    reachable = set()
+    pending = list(trailer_references(writer))
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in reachable:
+                continue
+            reachable.add(obj.idnum)
+            obj = obj.get_object()
+        if isinstance(obj, DictionaryObject):
+            pending.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            pending.extend(obj)
+
+    freed = 0
+    for idnum, obj in list(iter_objects(writer)):
+        if idnum in reachable or isinstance(obj, NullObject):
+            continue
+        freed += object_size(obj)
+        replace_object(writer, idnum, NullObject())
+    return freed
+
+
+def remove_duplicate_streams(writer: PdfWriter) -> int:
+    # 内容完全相同的流（字体、图片、内容流）只保留一份，引用改为指向保留的对象
+    # 去重后父对象可能也变得相同，例如带相同 SMask 的图片，所以重复直到没有新的重复
+    freed = 0
+    while True:
+        canonical: Dict[bytes, int] = {}
+        replacements: Dict[int, IndirectObject] = {}
+        for idnum, obj in iter_objects(writer):
+            if not isinstance(obj, StreamObject):
+                continue
+            buffer = io.BytesIO()
+            obj.write_to_stream(buffer)
+            digest = hashlib.sha256(buffer.getvalue()).digest()
+            if digest in canonical:
+                replacements[idnum] = IndirectObject(canonical[digest], 0, writer)
+                freed += buffer.tell()
+            else:
+                canonical[digest] = idnum
+        if not replacements:
+            return freed
+
+        for _, obj in iter_objects(writer):
+            if isinstance(obj, (DictionaryObject, ArrayObject)):
+                replace_references(obj, replacements)
+        for idnum in replacements:
+            replace_object(writer, idnum, NullObject())
+
+
+def replace_references(obj, replacements: Dict[int, IndirectObject]):
+    items = obj.items() if isinstance(obj, DictionaryObject) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            if value.idnum in replacements:
+                obj[key] = replacements[value.idnum]
+        elif isinstance(value, (DictionaryObject, ArrayObject)):
+            replace_references(value, replacements)
+
+
+def collect_image_refs(writer: PdfWriter) -> List[IndirectObject]:
+    # 按页面顺序收集图片 XObject（包括表单 XObject 内嵌的图片），多个页面共用的对象只收集一次
+    seen = set()
+    image_refs = []
+
+    def walk(resources):
+        if resources is None:
+            return
+        xobjects = resources.get_object().get("/XObject")
+        if xobjects is None:
+            return
+        for ref in xobjects.get_object().values():
+            if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+                continue
+            seen.add(ref.idnum)
+            xobject = ref.get_object()
+            if xobject.get("/Subtype") == "/Image":
+                image_refs.append(ref)
+            elif xobject.get("/Subtype") == "/Form":
+                walk(xobject.get("/Resources"))
+
+    for page in writer.pages:
+        walk(page.get("/Resources"))
+    return image_refs
+
+
+def multiply(m: Tuple[float, ...], n: Tuple[float, ...]) -> Tuple[float, ...]:
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F
+
+
+def image_display_sizes(writer: PdfWriter) -> Dict[int, Tuple[float, float]]:
+    # 根据内容流中的 cm/Do 计算每张图片在页面上的最大显示尺寸（pt）
+    # 表单 XObject 内的图片不展开计算，按所在页面的尺寸估计
+    sizes: Dict[int, Tuple[float, float]] = {}
+    for page, resources in iter_resources(writer):
+        page_size = (float(page.mediabox.width), float(page.mediabox.height))
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            continue
+        names = {}
+        for name, ref in xobjects.get_object().items():
+            if not isinstance(ref, IndirectObject):
+                continue
+            subtype = ref.get_object().get("/Subtype")
+            if subtype == "/Image":
+                names[name] = ref.idnum
+            elif subtype == "/Form":
+                for form_ref in collect_form_images(ref.get_object()):
+                    update_size(sizes, form_ref.idnum, page_size)
+        contents = page.get_contents()
+        if not names or contents is None:
+            continue
+
+        ctm = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+        stack = []
+        for operands, operator in contents.operations:
+            if operator == b"q":
+                stack.append(ctm)
+            elif operator == b"Q":
+                ctm = stack.pop() if stack else ctm
+            elif operator == b"cm" and len(operands) == 6:
+                ctm = multiply(tuple(float(x) for x in operands), ctm)
+            elif operator == b"Do" and operands and operands[0] in names:
+                update_size(sizes, names[operands[0]], (math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])))
+    return sizes
+
+
+def collect_form_images(form: DictionaryObject, seen: Optional[set] = None) -> List[IndirectObject]:
+    seen = seen if seen is not None else set()
+    refs = []
+    resources = form.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    for ref in (xobjects.get_object().values() if xobjects is not None else []):
+        if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+            continue
+        seen.add(ref.idnum)
+        subtype = ref.get_object().get("/Subtype")
+        if subtype == "/Image":
+            refs.append(ref)
+        elif subtype == "/Form":
+            refs.extend(collect_form_images(ref.get_object(), seen))
+    return refs
+
+
+def update_size(sizes: Dict[int, Tuple[float, float]], idnum: int, size: Tuple[float, float]):
+    width, height = sizes.get(idnum, (0.0, 0.0))
+    sizes[idnum] = (max(width, size[0]), max(height, size[1]))
+
+
+def compress_images(writer: PdfWriter, dpi: int, quality: int) -> int:
+    image_refs = collect_image_refs(writer)
+    display_sizes = image_display_sizes(writer)
+    targets = []
+    for ref in image_refs:
+        width, height = display_sizes.get(ref.idnum, (0.0, 0.0))
+        # 按显示尺寸换算目标像素，没有显示尺寸的图片不降采样
+        targets.append((round(width / 72 * dpi), round(height / 72 * dpi)) if width and height else None)
+
+    # 解码和 JPEG 编码主要耗时在 Pillow/zlib 中，会释放 GIL，用线程并行处理，结果按原顺序写回
+    saved = 0
+    with ThreadPoolExecutor(max_workers=COMPRESS_THREADS) as executor:
+        images = [ref.get_object() for ref in image_refs]
+        streams = executor.map(reencode_image, images, targets, [quality] * len(images))
+        for ref, image, stream in zip(image_refs, images, streams):
+            if stream is not None:
+                saved += len(image._data) - len(stream._data)
+                replace_object(writer, ref, stream)
+    return saved
+
+
+def reencode_image(image: StreamObject, target: Optional[Tuple[int, int]], quality: int) -> Optional[StreamObject]:
+    # 重新编码为 JPEG，直接构造 /DCTDecode 图片流；蒙版、带 /Decode 的图片以及变大的结果保持原样
+    if image.get("/ImageMask") or image.get("/BitsPerComponent") == 1 or "/Decode" in image:
+        return None
+    try:
+        decoded = image.decode_as_image()
+    except Exception:
+        return None
+    if decoded.mode not in ("L", "RGB"):
+        decoded = decoded.convert("L" if decoded.mode in ("1", "LA", "I", "I;16") else "RGB")
+
+    if target is not None and decoded.width > target[0] * DOWNSAMPLE_THRESHOLD \
+            and decoded.height > target[1] * DOWNSAMPLE_THRESHOLD:
+        decoded = decoded.resize((max(1, target[0]), max(1, target[1])), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    decoded.save(buffer, "JPEG", quality=quality, optimize=True)
+    data = buffer.getvalue()
+    if len(data) >= len(image._data):
+        return None
+
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    for key, value in image.items():
+        if key not in ("/Filter", "/DecodeParms", "/Length", "/ColorSpace", "/BitsPerComponent"):
+            stream[NameObject(key)] = value
+    # 透明度保存在独立的 /SMask 对象里，继续沿用，分辨率可以与图片不同
+    stream.update({
+        NameObject("/Filter"): NameObject("/DCTDecode"),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray" if decoded.mode == "L" else "/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Width"): NumberObject(decoded.width),
+        NameObject("/Height"): NumberObject(decoded.height),
+    })
+    return stream
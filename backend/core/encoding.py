@@ -0,0 +1,161 @@
+import io
+from dataclasses import dataclass
+from enum import Enum
+from typing import BinaryIO, Dict, Union
+
+from PIL import Image, ImageOps
+
+BACKGROUND = (255, 255, 255)
+
+
+class ImageFormat(str, Enum):
+    PNG = "png"
+    JPEG = "jpeg"
+    WEBP = "webp"
+    AVIF = "avif"
+    TIFF = "tiff"
+
+
+# 编码速度档位：fast 优先延迟，small 优先体积
+class EncoderSpeed(str, Enum):
+    FAST = "fast"
+    BALANCED = "balanced"
+    SMALL = "small"
+
+
+# 未指定质量时各格式的默认质量
+DEFAULT_QUALITY = {
+    ImageFormat.JPEG: 85,
+    ImageFormat.WEBP: 80,
+    ImageFormat.AVIF: 60,
+}
+
+# 各格式在不同速度档位下传给 Pillow 的参数
+SPEED_SETTINGS: Dict[ImageFormat, Dict[EncoderSpeed, dict]] = {
+    ImageFormat.PNG: {
+        EncoderSpeed.FAST: {"compress_level": 1},
+        EncoderSpeed.BALANCED: {"compress_level": 6},
+        EncoderSpeed.SMALL: {"compress_level": 9, "optimize": True},
+    },
+    ImageFormat.JPEG: {
+        EncoderSpeed.FAST: {},
+        EncoderSpeed.BALANCED: {"optimize": True},
+        EncoderSpeed.SMALL: {"optimize": True, "progressive": True},
+    },
+    ImageFormat.WEBP: {
+        EncoderSpeed.FAST: {"method": 0},
+        EncoderSpeed.BALANCED: {"method": 4},
+        EncoderSpeed.SMALL: {"method": 6},
+    },
+    ImageFormat.AVIF: {
+        EncoderSpeed.FAST: {"speed": 10},
+        EncoderSpeed.BALANCED: {"speed": 8},
+        EncoderSpeed.SMALL: {"speed": 6},
+    },
+    ImageFormat.TIFF: {
+        EncoderSpeed.FAST: {},
+        EncoderSpeed.BALANCED: {"compression": "tiff_lzw"},
+        EncoderSpeed.SMALL: {"compression": "tiff_adobe_deflate"},
+    },
+}
+
+MEDIA_TYPES = {
+    ImageFormat.PNG: "image/png",
+    ImageFormat.JPEG: "image/jpeg",
+    ImageFormat.WEBP: "image/webp",
+    ImageFormat.AVIF: "image/avif",
+    ImageFormat.TIFF: "image/tiff",
+}
+
+EXTENSIONS = {
+    ImageFormat.PNG: "png",
+    ImageFormat.JPEG: "jpg",
+    ImageFormat.WEBP: "webp",
+    ImageFormat.AVIF: "avif",
+    ImageFormat.TIFF: "tiff",
+}
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    format: ImageFormat = ImageFormat.PNG
+    # 0 表示使用格式的默认质量，PNG/TIFF 忽略
+    quality: int = 0
+    speed: EncoderSpeed = EncoderSpeed.BALANCED
+    # 长边超过该像素数时等比缩小，0 表示不缩放
+    max_dimension: int = 0
+    strip_metadata: bool = True
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    def cache_params(self) -> dict:
+        return {"format": self.format.value, "quality": self.quality, "speed": self.speed.value,
+                "max_dimension": self.max_dimension, "strip_metadata": self.strip_metadata}
+
+
+def parse_format(value: str) -> ImageFormat:
+    value = value.lower()
+    return ImageFormat.JPEG if value == "jpg" else ImageFormat(value)
+
+
+def open_image(source: Union[bytes, str], options: EncodeOptions) -> Image.Image:
+    # 需要缩小时让 JPEG 解码器直接按 1/2、1/4、1/8 缩放解码，减少解码时间和内存
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    if options.max_dimension and image.format == "JPEG":
+        image.draft("RGB", (options.max_dimension, options.max_dimension))
+    return image
+
+
+def prepare_image(image: Image.Image, options: EncodeOptions) -> Image.Image:
+    # 去除元数据前先按 EXIF 方向旋转，否则图片会显示成错误的方向
+    if options.strip_metadata:
+        image = ImageOps.exif_transpose(image)
+    if options.max_dimension and max(image.size) > options.max_dimension:
+        image.thumbnail((options.max_dimension, options.max_dimension), Image.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    if options.format == ImageFormat.JPEG:
+        # JPEG 不支持透明，合成到白色背景
+        if has_alpha:
+            rgba = image.convert("RGBA")
+            background = Image.new("RGB", image.size, BACKGROUND)
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            return background
+        if image.mode == "1":
+            return image.convert("L")
+        return image if image.mode in ("RGB", "L", "CMYK") else image.convert("RGB")
+    if options.format in (ImageFormat.WEBP, ImageFormat.AVIF) and image.mode not in ("RGB", "RGBA"):
+        return image.convert("RGBA" if has_alpha else "RGB")
+    return image
+
+
+def save_kwargs(image: Image.Image, options: EncodeOptions) -> dict:
+    kwargs = dict(SPEED_SETTINGS[options.format][options.speed])
+    if options.format in DEFAULT_QUALITY:
+        kwargs["quality"] = options.quality or DEFAULT_QUALITY[options.format]
+    if options.strip_metadata:
+        # PNG/TIFF 会默认写出源图的 ICC 配置，显式清空
+        kwargs["icc_profile"] = None
+        kwargs["exif"] = b""
+    else:
+        for key in ("icc_profile", "exif"):
+            if image.info.get(key):
+                kwargs[key] = image.info[key]
+    return kwargs
+
+
+def encode_image_to(image: Image.Image, output: Union[str, BinaryIO], options: EncodeOptions):
+    image = prepare_image(image, options)
+    image.save(output, options.format.value.upper(), **save_kwargs(image, options))
+
+
+def encode_image(image: Image.Image, options: EncodeOptions) -> bytes:
+    output = io.BytesIO()
+    encode_image_to(image, output, options)
+    return output.getvalue()
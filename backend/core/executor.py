@@ -0,0 +1,280 @@
+import asyncio
+import collections
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from core.metrics import call_collecting, collecting_events, replay, stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 进程池配置，POOL_MAX_WORKERS 为 0 时使用 CPU 核数
+POOL_MAX_WORKERS = int(os.getenv('POOL_MAX_WORKERS', 0)) or (os.cpu_count() or 1)
+# 等待队列长度，超过后直接返回 503
+POOL_MAX_QUEUE = int(os.getenv('POOL_MAX_QUEUE', POOL_MAX_WORKERS * 4))
+# 单个操作的并发上限，格式 "to_images=2,compress=4"
+POOL_OP_LIMITS = os.getenv('POOL_OP_LIMITS', '')
+POOL_START_METHOD = os.getenv('POOL_START_METHOD') or None
+POOL_RETRY_AFTER = int(os.getenv('POOL_RETRY_AFTER', 5))
+# 流式任务在 worker 与主进程之间最多缓冲的条目数，消费慢时 worker 会暂停
+POOL_STREAM_BUFFER = int(os.getenv('POOL_STREAM_BUFFER', 4))
+
+# 重操作默认最多占用一半的 worker，保证 rotate 之类的轻量接口始终有空闲进程
+HEAVY_OPERATIONS = ("to_images", "compress", "remove_background", "pipeline")
+
+
+def parse_op_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition('=')
+        limits[name.strip()] = max(1, int(limit))
+    return limits
+
+
+def _run_initializers(initializers: List[Tuple[Callable, tuple]]):
+    for initializer, args in initializers:
+        initializer(*args)
+
+
+def _noop():
+    return os.getpid()
+
+
+def _drain(channel, cancelled, fn: Callable[..., Iterator], args: tuple, kwargs: dict):
+    # 在 worker 中迭代生成器，逐条放入共享队列；主进程放弃消费后尽快停止
+    def put(message) -> bool:
+        while not cancelled.is_set():
+            try:
+                channel.put(message, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        with collecting_events() as events:
+            for item in fn(*args, **kwargs):
+                if not put(("item", item)):
+                    return
+    except Exception as e:
+        put(("error", e))
+    else:
+        # 结束标记带回 worker 中记录的阶段耗时和页数
+        put(("done", events))
+
+
+# 所有转换操作共用的进程池，带有界等待队列和按操作的并发限制
+class TaskPool:
+    def __init__(self, max_workers: int, max_queue: int, op_limits: Optional[Dict[str, int]] = None,
+                 start_method: Optional[str] = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.op_limits = {name: max(1, max_workers // 2) for name in HEAVY_OPERATIONS}
+        self.op_limits.update(op_limits or {})
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 每次重建进程池加一，避免并发失败的任务把别人刚重建的进程池再次关闭
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._manager = None
+        self._initializers: List[Tuple[Callable, tuple]] = []
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._admitted = 0
+        self._running: Dict[str, int] = {}
+
+    def add_initializer(self, initializer: Callable, *args):
+        # 在每个 worker 进程启动时执行，用于预热模型等
+        self._initializers.append((initializer, args))
+
+    def start(self):
+        return self._current()[0]
+
+    def _current(self) -> Tuple[ProcessPoolExecutor, int]:
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_run_initializers,
+                    initargs=(list(self._initializers),)
+                )
+                # 提前拉起 worker，避免第一个请求承担进程启动开销
+                self._executor.submit(_noop)
+            return self._executor, self._generation
+
+    def _discard_executor(self, generation: int):
+        # worker 异常退出（例如高 DPI 渲染 OOM）后进程池不可再用，只丢弃出问题的那一代进程池，
+        # 流式任务共用的 Manager 保持不变，下一个任务提交时重新创建进程池
+        with self._lock:
+            if self._generation != generation or self._executor is None:
+                return
+            executor, self._executor = self._executor, None
+            self._generation += 1
+        logger.warning("Process pool broken, recreating workers")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch(self, fn: Callable, *args) -> asyncio.Future:
+        executor, generation = self._current()
+        future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+        def check_broken(done: asyncio.Future):
+            if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                self._discard_executor(generation)
+
+        future.add_done_callback(check_broken)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._generation += 1
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context(self.start_method).Manager()
+        return self._manager
+
+    def stats(self) -> Dict:
+        running = sum(self._running.values())
+        return {
+            "workers": self.max_workers,
+            "admitted": self._admitted,
+            "running": running,
+            "queued": self._admitted - running,
+            "operations": dict(self._running),
+        }
+
+    def _semaphore(self, operation: str) -> asyncio.Semaphore:
+        if operation not in self._semaphores:
+            limit = min(self.op_limits.get(operation, self.max_workers), self.max_workers)
+            self._semaphores[operation] = asyncio.Semaphore(limit)
+        return self._semaphores[operation]
+
+    def threads_per_task(self, operation: str) -> int:
+        # 操作的并发达到上限时各任务平分 CPU 核数，任务内的线程总数不会超过核数
+        limit = min(self.op_limits.get(operation, self.max_workers), self.max_workers)
+        return max(1, (os.cpu_count() or 1) // limit)
+
+    def _admit(self, slots: int = 1):
+        if self._admitted + slots > self.max_workers + self.max_queue:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry later",
+                                headers={"Retry-After": str(POOL_RETRY_AFTER)})
+        self._admitted += slots
+
+    def reserve(self, slots: int):
+        # 批量请求一次性占用 slots 个名额，之后用 run_reserved 提交其中的任务，不再逐个准入；
+        # 容量不足时整个请求返回 503，结束后用 release 归还
+        self._admit(slots)
+
+    def release(self, slots: int):
+        self._admitted -= slots
+
+    async def run(self, operation: str, fn: Callable, *args, **kwargs):
+        self._admit()
+        try:
+            return await self.run_reserved(operation, fn, *args, **kwargs)
+        finally:
+            self._admitted -= 1
+
+    async def run_reserved(self, operation: str, fn: Callable, *args, **kwargs):
+        with stage(f"{operation}.queue"):
+            await self._semaphore(operation).acquire()
+        try:
+            self._running[operation] = self._running.get(operation, 0) + 1
+            with stage(operation):
+                return await self._submit(fn, *args, **kwargs)
+        finally:
+            self._running[operation] -= 1
+            self._semaphore(operation).release()
+
+    async def imap(self, operation: str, fn: Callable, items: Iterable[tuple],
+                   window: Optional[int] = None) -> AsyncIterator:
+        # 按输入顺序返回结果，同时最多有 window 个任务在执行，避免一次性占满等待队列
+        window = window or self.max_workers
+        pending = collections.deque()
+        items = iter(items)
+        try:
+            for args in items:
+                pending.append(asyncio.ensure_future(self.run(operation, fn, *args)))
+                if len(pending) >= window:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iterate(self, operation: str, fn: Callable[..., Iterator], *args, **kwargs) -> AsyncIterator:
+        # 在 worker 中运行生成器函数，产出的每一项立即回传，用于流式响应
+        self._admit()
+        try:
+            with stage(f"{operation}.queue"):
+                await self._semaphore(operation).acquire()
+            try:
+                self._running[operation] = self._running.get(operation, 0) + 1
+                async for item in self._stream(fn, args, kwargs):
+                    yield item
+            finally:
+                self._running[operation] -= 1
+                self._semaphore(operation).release()
+        finally:
+            self._admitted -= 1
+
+    async def _stream(self, fn: Callable[..., Iterator], args: tuple, kwargs: dict) -> AsyncIterator:
+        loop = asyncio.get_running_loop()
+        manager = self._get_manager()
+        channel = manager.Queue(POOL_STREAM_BUFFER)
+        cancelled = manager.Event()
+        future = self._dispatch(_drain, channel, cancelled, fn, args, kwargs)
+        try:
+            while True:
+                try:
+                    kind, value = await loop.run_in_executor(None, channel.get, True, 1)
+                except queue.Empty:
+                    if future.done():
+                        # worker 没有发送结束标记就退出了，抛出真实的异常
+                        future.result()
+                        raise RuntimeError("Worker exited without finishing the stream")
+                    continue
+                if kind == "item":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    replay(value)
+                    break
+        finally:
+            cancelled.set()
+            try:
+                await asyncio.shield(future)
+            except Exception:
+                pass
+
+    async def _submit(self, fn: Callable, *args, **kwargs):
+        # 进程池损坏时不自动重试：导致崩溃的任务重试只会再次拖垮进程池，由调用方返回错误
+        call = functools.partial(call_collecting, fn, *args, **kwargs)
+        result, events = await self._dispatch(call)
+        replay(events)
+        return result
+
+
+pool = TaskPool(POOL_MAX_WORKERS, POOL_MAX_QUEUE, parse_op_limits(POOL_OP_LIMITS), POOL_START_METHOD)
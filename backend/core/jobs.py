@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, DateTime, Text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse
+
+from core.executor import POOL_MAX_WORKERS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 异步任务配置，默认使用本地 SQLite 保存任务状态，结果文件保存在 JOB_DIR
+JOB_DATABASE_URL = os.getenv('JOB_DATABASE_URL') or \
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "convertflow-jobs.db")
+JOB_DIR = os.getenv('JOB_DIR') or os.path.join(tempfile.gettempdir(), "convertflow-jobs")
+# 任务结束后结果保留的秒数
+JOB_TTL = int(os.getenv('JOB_TTL', 3600))
+# 同时执行的任务数，其余任务排队，避免把进程池的等待队列占满
+JOB_MAX_RUNNING = int(os.getenv('JOB_MAX_RUNNING', 0)) or POOL_MAX_WORKERS
+JOB_CLEANUP_INTERVAL = int(os.getenv('JOB_CLEANUP_INTERVAL', 60))
+# 任务由提交它的进程执行，该进程每个清理周期刷新一次心跳；心跳超过该秒数未更新的未完成任务视为执行进程已退出
+JOB_HEARTBEAT_TIMEOUT = int(os.getenv('JOB_HEARTBEAT_TIMEOUT', 0)) or JOB_CLEANUP_INTERVAL * 3
+
+Base = declarative_base()
+
+
+# 任务模型
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+    operation = Column(String, index=True)
+    status = Column(String, index=True)
+    pages_done = Column(Integer, default=0)
+    pages_total = Column(Integer)
+    filename = Column(String)
+    media_type = Column(String)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+    # 执行任务的进程（主机名:pid:启动标识）和它最近一次心跳
+    owner = Column(String, index=True)
+    heartbeat_at = Column(DateTime)
+
+
+class JobContext:
+    # 传给任务执行函数，结果写入 path，进度通过 progress 上报
+    def __init__(self, manager: "JobManager", job_id: str, path: str):
+        self.manager = manager
+        self.id = job_id
+        self.path = path
+
+    async def progress(self, done: int, total: Optional[int] = None):
+        values = {"pages_done": done}
+        if total is not None:
+            values["pages_total"] = total
+        await run_in_threadpool(self.manager.update, self.id, **values)
+
+
+# 任务在当前进程中以 asyncio task 执行，实际计算仍然交给进程池
+class JobManager:
+    def __init__(self, database_url: str, directory: str, ttl: int, max_running: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_running = max_running
+        connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+        self.engine = create_engine(database_url, connect_args=connect_args)
+        self.SessionLocal = sessionmaker(autoflush=True, bind=self.engine)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.hostname = socket.gethostname()
+        # pid 会被重用，加上随机标识区分同一个 pid 的不同进程
+        self.owner = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        Base.metadata.create_all(bind=self.engine)
+        self._migrate()
+        self._semaphore = asyncio.Semaphore(self.max_running)
+        self._cleanup_task = asyncio.ensure_future(self._cleanup_loop())
+
+    def _migrate(self):
+        # 旧版本创建的任务表没有 owner / heartbeat_at 列
+        columns = {column["name"] for column in inspect(self.engine).get_columns(Job.__tablename__)}
+        with self.engine.begin() as connection:
+            for name, type_ in (("owner", "VARCHAR"), ("heartbeat_at", "DATETIME")):
+                if name not in columns:
+                    connection.execute(text(f"ALTER TABLE {Job.__tablename__} ADD COLUMN {name} {type_}"))
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        if self._cleanup_task is not None:
+            tasks.append(self._cleanup_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._cleanup_task = None
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def _create(self, job_id: str, operation: str, filename: str, media_type: str, total: Optional[int]):
+        with self.SessionLocal() as db:
+            now = datetime.utcnow()
+            db.add(Job(id=job_id, operation=operation, status="queued", pages_done=0, pages_total=total,
+                       filename=filename, media_type=media_type, created_at=now,
+                       owner=self.owner, heartbeat_at=now))
+            db.commit()
+
+    def update(self, job_id: str, **values):
+        with self.SessionLocal() as db:
+            db.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.SessionLocal() as db:
+            job = db.get(Job, job_id)
+            if job is not None and job.expires_at is not None and job.expires_at < datetime.utcnow():
+                return None
+            return job
+
+    async def submit(self, operation: str, runner: Callable[[JobContext], Awaitable[None]],
+                     filename: str, media_type: str, total: Optional[int] = None) -> JSONResponse:
+        job_id = uuid.uuid4().hex
+        await run_in_threadpool(self._create, job_id, operation, filename, media_type, total)
+        task = asyncio.ensure_future(self._execute(JobContext(self, job_id, self._path(job_id)), runner))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return JSONResponse(status_code=202, content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/jobs/{job_id}",
+            "result_url": f"/api/jobs/{job_id}/result",
+        })
+
+    async def _execute(self, context: JobContext, runner: Callable[[JobContext], Awaitable[None]]):
+        async with self._semaphore:
+            await run_in_threadpool(self.update, context.id, status="running", started_at=datetime.utcnow())
+            try:
+                await runner(context)
+            except Exception as e:
+                logger.exception("Job %s failed", context.id)
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                await run_in_threadpool(self._finish, context.id, "failed", str(detail))
+                if os.path.exists(context.path):
+                    os.remove(context.path)
+            else:
+                await run_in_threadpool(self._finish, context.id, "done", None)
+
+    def _finish(self, job_id: str, status: str, error: Optional[str]):
+        now = datetime.utcnow()
+        values = {"status": status, "error": error, "finished_at": now,
+                  "expires_at": now + timedelta(seconds=self.ttl)}
+        if status == "done":
+            with self.SessionLocal() as db:
+                job = db.get(Job, job_id)
+                if job is not None and job.pages_total is not None:
+                    values["pages_done"] = job.pages_total
+        self.update(job_id, **values)
+
+    def status(self, job_id: str) -> Dict:
+        job = self.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+        # 按已完成页数的平均耗时估算剩余时间
+        eta = None
+        if job.status == "running" and job.started_at and job.pages_total and job.pages_done:
+            elapsed = (datetime.utcnow() - job.started_at).total_seconds()
+            eta = round(elapsed / job.pages_done * (job.pages_total - job.pages_done), 1)
+        elif job.status == "done":
+            eta = 0
+
+        return {
+            "job_id": job.id,
+            "operation": job.operation,
+            "status": job.status,
+            "pages_done": job.pages_done,
+            "pages_total": job.pages_total,
+            "eta_seconds": eta,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "expires_at": job.expires_at.isoformat() if job.expires_at else None,
+            "result_url": f"/api/jobs/{job.id}/result" if job.status == "done" else None,
+        }
+
+    def result(self, job_id: str) -> FileResponse:
+        job = self.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job.status == "failed":
+            raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+        path = self._path(job_id)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Job result not found")
+        return FileResponse(path, media_type=job.media_type, filename=job.filename)
+
+    def heartbeat(self):
+        with self.SessionLocal() as db:
+            db.query(Job).filter(Job.owner == self.owner, Job.status.in_(("queued", "running"))).update(
+                {"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+
+    def _owner_alive(self, owner: Optional[str], last_seen: Optional[datetime], cutoff: datetime) -> bool:
+        # 同一台主机上的进程可以直接检查 pid；其他主机（或容器）只能看心跳是否过期
+        if owner:
+            host, _, rest = owner.partition(":")
+            pid = rest.partition(":")[0]
+            if host == self.hostname and pid.isdigit():
+                if int(pid) == os.getpid():
+                    return owner == self.owner
+                try:
+                    os.kill(int(pid), 0)
+                except ProcessLookupError:
+                    return False
+                except PermissionError:
+                    pass
+        return last_seen is not None and last_seen >= cutoff
+
+    def reap(self):
+        # 多个 worker 共用任务库，只把执行进程已经退出的未完成任务标记为失败，其他进程的任务不受影响。
+        # 旧版本留下的任务没有 owner，按创建时间判断
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT)
+        with self.SessionLocal() as db:
+            candidates = db.query(Job.id, Job.owner, Job.heartbeat_at, Job.created_at).filter(
+                Job.status.in_(("queued", "running")))
+            dead = [job_id for job_id, owner, heartbeat_at, created_at in candidates
+                    if not self._owner_alive(owner, heartbeat_at or created_at, cutoff)]
+            if dead:
+                db.query(Job).filter(Job.id.in_(dead)).update(
+                    {"status": "failed", "error": "Interrupted: the worker process running this job stopped",
+                     "finished_at": now, "expires_at": now + timedelta(seconds=self.ttl)},
+                    synchronize_session=False)
+                db.commit()
+                logger.warning("Marked %d orphaned jobs as failed", len(dead))
+
+    def cleanup(self):
+        # 删除过期任务的记录和结果文件，同时清理没有记录的遗留文件
+        now = datetime.utcnow()
+        with self.SessionLocal() as db:
+            expired = [job_id for (job_id,) in db.query(Job.id).filter(Job.expires_at < now)]
+            if expired:
+                db.query(Job).filter(Job.id.in_(expired)).delete(synchronize_session=False)
+                db.commit()
+            known = {job_id for (job_id,) in db.query(Job.id)}
+        for job_id in expired:
+            if os.path.exists(self._path(job_id)):
+                os.remove(self._path(job_id))
+        for entry in os.scandir(self.directory):
+            if entry.name not in known and time.time() - entry.stat().st_mtime > self.ttl:
+                os.remove(entry.path)
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await run_in_threadpool(self.heartbeat)
+                await run_in_threadpool(self.reap)
+                await run_in_threadpool(self.cleanup)
+            except Exception:
+                logger.exception("Job cleanup failed")
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+
+
+jobs = JobManager(JOB_DATABASE_URL, JOB_DIR, JOB_TTL, JOB_MAX_RUNNING)
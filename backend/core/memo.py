@@ -0,0 +1,135 @@
+import asyncio
+import collections
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class _Flight:
+    # 进行中的一次流式执行，片段按顺序保存，订阅者从头补发后继续等待新的片段
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class AsyncMemo:
+    # 内存中的异步结果缓存：相同键的并发调用共享同一次执行（singleflight），
+    # 成功的结果保留 ttl 秒，超过 max_size 条时淘汰最久未访问的；失败不缓存
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "collections.OrderedDict[str, Tuple[float, Any]]" = collections.OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.counts = {"hit": 0, "shared": 0, "miss": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if time.monotonic() - created > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        # 返回 (结果, 来源)，来源为 hit（缓存）、shared（等待进行中的调用）或 miss（本次执行）。
+        # 执行放在独立的任务中，发起者被取消时其他等待者仍能拿到结果
+        value = self.get(key)
+        if value is not None:
+            self.counts["hit"] += 1
+            return value, "hit"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counts["shared"] += 1
+            return await asyncio.shield(task), "shared"
+
+        async def execute():
+            try:
+                result = await fn()
+                self.put(key, result)
+                return result
+            finally:
+                self._inflight.pop(key, None)
+
+        self.counts["miss"] += 1
+        task = asyncio.ensure_future(execute())
+        self._inflight[key] = task
+        return await asyncio.shield(task), "miss"
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator], combine: Callable[[List], Any]) -> AsyncIterator:
+        # run 的流式版本：缓存命中时产出完整结果；相同键的并发调用订阅同一次执行，已产出的片段先补发。
+        # 执行放在独立的任务中，所有订阅者都离开后才取消；只有完整结束的流用 combine 合并后写入缓存
+        value = self.get(key)
+        if value is not None:
+            self.counts["hit"] += 1
+            yield value
+            return
+
+        flight = self._streams.get(key)
+        if flight is not None:
+            self.counts["shared"] += 1
+        else:
+            self.counts["miss"] += 1
+            flight = self._streams[key] = _Flight()
+
+            async def produce():
+                try:
+                    async for item in fn():
+                        flight.items.append(item)
+                        async with flight.changed:
+                            flight.changed.notify_all()
+                    self.put(key, combine(flight.items))
+                except BaseException as e:
+                    flight.error = e
+                finally:
+                    flight.done = True
+                    if self._streams.get(key) is flight:
+                        del self._streams[key]
+                    async with flight.changed:
+                        flight.changed.notify_all()
+
+            flight.task = asyncio.ensure_future(produce())
+
+        flight.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(flight.items):
+                    index += 1
+                    yield flight.items[index - 1]
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    async with flight.changed:
+                        await flight.changed.wait_for(lambda: index < len(flight.items) or flight.done)
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                # 最后一个订阅者离开（例如客户端断开），之后的调用重新开始一次执行
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                flight.task.cancel()
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "inflight": len(self._inflight) + len(self._streams), **self.counts}
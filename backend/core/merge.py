@@ -0,0 +1,212 @@
+import hashlib
+import io
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pypdf import PageObject, PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+from core.pagetree import release_page
+
+load_dotenv()
+
+# 合并输出累计超过该字节数就交给调用方发送，不等整个文档处理完
+MERGE_FLUSH_BYTES = int(os.getenv('MERGE_FLUSH_BYTES', 1024 * 1024))
+
+CATALOG_ID = 1
+PAGES_ID = 2
+# 按内容去重的对象：所有流（字体文件、图片、内容流）以及这些类型的字典
+DEDUP_TYPES = {"/Font", "/FontDescriptor", "/Encoding", "/ExtGState"}
+# 页面字典中不复制的键：父节点改为新的页面树根，结构树和文章线程不合并
+PAGE_EXCLUDED_KEYS = {"/Parent", "/StructParents", "/B"}
+
+
+class MergeWriter:
+    # 增量写出合并后的 PDF：对象按输入顺序直接序列化到输出缓冲区，只在内存中保留 xref 偏移和去重哈希，
+    # 目录和页面树根预留固定编号，全部页面写完后再写出
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._offset = 0
+        self._xref: Dict[int, int] = {}
+        self._next_id = PAGES_ID + 1
+        self._kids: List[int] = []
+        self._digests: Dict[bytes, int] = {}
+        self.deduplicated = 0
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._kids)
+
+    def _write(self, data: bytes):
+        self._buffer.write(data)
+
+    def _position(self) -> int:
+        return self._offset + self._buffer.tell()
+
+    def _allocate(self) -> int:
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _write_object(self, object_id: int, body: bytes):
+        self._xref[object_id] = self._position()
+        self._write(b"%d 0 obj\n" % object_id)
+        self._write(body)
+        self._write(b"\nendobj\n")
+
+    def pending(self) -> int:
+        return self._buffer.tell()
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._offset += len(data)
+        self._buffer = io.BytesIO()
+        return data
+
+    def add_document(self, reader: PdfReader, pages: Iterable[PageObject]) -> Iterable[int]:
+        # 逐页写入，每页写完后产出已缓冲的字节数，调用方据此决定是否 drain
+        serializer = _DocumentSerializer(self, reader)
+        pages = list(pages)
+        # 先给选中的页面分配编号，页面之间的链接可以指向新编号
+        for page in pages:
+            if page.indirect_reference is not None and page.indirect_reference.idnum not in serializer.page_ids:
+                serializer.page_ids[page.indirect_reference.idnum] = self._allocate()
+        for page in pages:
+            page_id = None
+            if page.indirect_reference is not None:
+                # 同一页被选中多次时，除第一次外都使用新的页面对象，内容和资源仍然共享
+                page_id = serializer.page_ids.pop(page.indirect_reference.idnum, None)
+                if page_id is not None:
+                    serializer.written_pages[page.indirect_reference.idnum] = page_id
+            if page_id is None:
+                page_id = self._allocate()
+            serializer.write_page(page, page_id)
+            release_page(reader, page)
+            self._kids.append(page_id)
+            yield self.pending()
+
+    def finish(self) -> bytes:
+        kids = b" ".join(b"%d 0 R" % kid for kid in self._kids)
+        self._write_object(PAGES_ID, b"<< /Type /Pages /Kids [ " + kids + b" ] /Count %d >>" % len(self._kids))
+        self._write_object(CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R >>" % PAGES_ID)
+
+        xref_position = self._position()
+        size = self._next_id
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for object_id in range(1, size):
+            self._write(b"%010d 00000 n \n" % self._xref[object_id])
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (size, CATALOG_ID, xref_position))
+        return self.drain()
+
+
+class _DocumentSerializer:
+    # 单个输入文档的对象编号映射，文档处理完即丢弃
+    def __init__(self, writer: MergeWriter, reader: PdfReader):
+        self.writer = writer
+        self.reader = reader
+        self.mapping: Dict[Tuple[int, int], int] = {}
+        # 待写出的选中页面（原编号 -> 新编号），以及已经写出的页面
+        self.page_ids: Dict[int, int] = {}
+        self.written_pages: Dict[int, int] = {}
+        # 正在序列化、还没有确定编号的可去重对象，出现循环引用时直接分配编号
+        self._pending: Dict[Tuple[int, int], Optional[int]] = {}
+
+    def write_page(self, page: PageObject, page_id: int):
+        out = io.BytesIO()
+        out.write(b"<<")
+        for key, value in page.items():
+            if key in PAGE_EXCLUDED_KEYS:
+                continue
+            out.write(b" ")
+            NameObject(key).write_to_stream(out)
+            out.write(b" ")
+            self._serialize(value, out)
+        out.write(b" /Parent %d 0 R >>" % PAGES_ID)
+        self.writer._write_object(page_id, out.getvalue())
+
+    def _page_reference(self, reference: IndirectObject, target: DictionaryObject) -> Optional[int]:
+        # 指向页面的引用（例如链接目标）只保留到选中的页面，其余页面和页面树节点替换为 null
+        if target.get("/Type") == "/Pages":
+            return None
+        return self.page_ids.get(reference.idnum) or self.written_pages.get(reference.idnum)
+
+    def _reference(self, reference: IndirectObject) -> Optional[int]:
+        key = (reference.idnum, reference.generation)
+        if key in self.mapping:
+            return self.mapping[key]
+        if key in self._pending:
+            # 循环引用：放弃对该对象去重，立即分配编号
+            if self._pending[key] is None:
+                self._pending[key] = self.writer._allocate()
+            return self._pending[key]
+
+        target = reference.get_object()
+        if target is None:
+            return None
+        if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Page", "/Pages"):
+            return self._page_reference(reference, target)
+
+        dedup = isinstance(target, StreamObject) or \
+            (isinstance(target, DictionaryObject) and target.get("/Type") in DEDUP_TYPES)
+        if not dedup:
+            # 普通对象先分配编号再序列化，循环引用可以直接指向这个编号
+            object_id = self.writer._allocate()
+            self.mapping[key] = object_id
+            self.writer._write_object(object_id, self._body(target))
+            return object_id
+
+        # 可去重对象先序列化（子对象先写出并完成去重），再按内容哈希查找已有对象
+        self._pending[key] = None
+        body = self._body(target)
+        object_id = self._pending.pop(key)
+        if object_id is None:
+            digest = hashlib.sha256(body).digest()
+            object_id = self.writer._digests.get(digest)
+            if object_id is not None:
+                self.writer.deduplicated += 1
+                self.mapping[key] = object_id
+                return object_id
+            object_id = self.writer._allocate()
+            self.writer._digests[digest] = object_id
+        self.mapping[key] = object_id
+        self.writer._write_object(object_id, body)
+        return object_id
+
+    def _body(self, obj) -> bytes:
+        out = io.BytesIO()
+        self._serialize(obj, out)
+        return out.getvalue()
+
+    def _serialize(self, obj, out: io.BytesIO):
+        if isinstance(obj, IndirectObject):
+            object_id = self._reference(obj)
+            out.write(b"null" if object_id is None else b"%d 0 R" % object_id)
+        elif isinstance(obj, DictionaryObject):
+            stream = isinstance(obj, StreamObject)
+            out.write(b"<<")
+            for key, value in obj.items():
+                if stream and key == "/Length":
+                    continue
+                out.write(b" ")
+                NameObject(key).write_to_stream(out)
+                out.write(b" ")
+                self._serialize(value, out)
+            if stream:
+                # 保留原始编码的流数据，不解压也不重新压缩
+                data = obj._data
+                out.write(b" /Length %d >>\nstream\n" % len(data))
+                out.write(data)
+                out.write(b"\nendstream")
+            else:
+                out.write(b" >>")
+        elif isinstance(obj, ArrayObject):
+            out.write(b"[")
+            for item in obj:
+                out.write(b" ")
+                self._serialize(item, out)
+            out.write(b" ]")
+        else:
+            obj.write_to_stream(out)
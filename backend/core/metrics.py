@@ -0,0 +1,253 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2,
+                256 * 1024 ** 2, 1024 ** 3)
+INF_LABEL = 'le="+Inf"'
+
+# 当前请求记录的阶段耗时，用于生成 Server-Timing 响应头
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_stages", default=None)
+# worker 进程里只收集事件，随结果带回主进程后再计入指标
+_worker_events: ContextVar[Optional[List[Tuple[str, str, float]]]] = ContextVar("worker_events", default=None)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    # 在抓取时调用 collect 取值，返回 {标签值元组: 数值}
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class CollectedCounter(Gauge):
+    # 同样在抓取时取值，但值只增不减（例如缓存命中数），按 counter 导出，可以用 rate() 计算
+    type = "counter"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # 标签值 -> [每个桶的计数..., 总数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, INF_LABEL)} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "convertflow_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+REQUEST_SECONDS = registry.register(Histogram(
+    "convertflow_http_request_duration_seconds", "HTTP request duration including the response body",
+    ("method", "route")))
+REQUEST_BYTES = registry.register(Histogram(
+    "convertflow_http_request_size_bytes", "HTTP request body size", ("route",), SIZE_BUCKETS))
+RESPONSE_BYTES = registry.register(Histogram(
+    "convertflow_http_response_size_bytes", "HTTP response body size", ("route",), SIZE_BUCKETS))
+STAGE_SECONDS = registry.register(Histogram(
+    "convertflow_stage_duration_seconds", "Duration of processing stages", ("stage",)))
+PAGES = registry.register(Counter(
+    "convertflow_pages_processed_total", "Pages or images processed by operation", ("operation",)))
+
+
+def record_stage(name: str, duration: float):
+    events = _worker_events.get()
+    if events is not None:
+        events.append(("stage", name, duration))
+        return
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, duration))
+    STAGE_SECONDS.observe(duration, stage=name)
+
+
+def record_pages(operation: str, count: int):
+    events = _worker_events.get()
+    if events is not None:
+        events.append(("pages", operation, count))
+        return
+    PAGES.inc(count, operation=operation)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def replay(events: Iterable[Tuple[str, str, float]]):
+    # 在主进程中重放 worker 带回来的事件
+    for kind, name, value in events:
+        if kind == "stage":
+            record_stage(name, value)
+        else:
+            record_pages(name, int(value))
+
+
+@contextmanager
+def collecting_events():
+    # 在 worker 中使用，期间记录的阶段和页数只收集不计入指标
+    events = []
+    token = _worker_events.set(events)
+    try:
+        yield events
+    finally:
+        _worker_events.reset(token)
+
+
+def call_collecting(fn: Callable, *args, **kwargs):
+    # 在 worker 中执行，返回 (结果, 事件列表)
+    with collecting_events() as events:
+        return fn(*args, **kwargs), events
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    # 同名阶段（例如逐个文件处理）合并为一项
+    merged: Dict[str, float] = {}
+    for name, duration in stages:
+        merged[name] = merged.get(name, 0) + duration
+    items = [f"{name.replace('.', '-')};dur={duration * 1000:.1f}" for name, duration in merged.items()]
+    items.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(items)
+
+
+class MetricsMiddleware:
+    # 纯 ASGI 中间件，不缓冲响应体，流式响应照常逐块发送
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        state = {"status": 500, "request_bytes": 0, "response_bytes": 0, "started": None}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["request_bytes"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["started"] = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stages, state["started"] - start).encode()))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                state["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            _request_stages.reset(token)
+            end = time.perf_counter()
+            if state["started"] is not None:
+                STAGE_SECONDS.observe(end - state["started"], stage="send")
+            # 使用路由模板作为标签，避免路径参数导致标签数量无限增长
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            REQUESTS.inc(method=method, route=route, status=state["status"])
+            REQUEST_SECONDS.observe(end - start, method=method, route=route)
+            REQUEST_BYTES.observe(state["request_bytes"], route=route)
+            RESPONSE_BYTES.observe(state["response_bytes"], route=route)
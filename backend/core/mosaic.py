@@ -0,0 +1,273 @@
+import math
+import os
+import struct
+import tempfile
+import zlib
+from enum import Enum
+from typing import BinaryIO, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 拼接时每次编码的输出行数，峰值内存约为一张源图加一个输出带
+JOIN_BAND_ROWS = int(os.getenv('JOIN_BAND_ROWS', 256))
+# PNG 的 zlib 压缩级别，与 Pillow 默认值一致
+JOIN_COMPRESS_LEVEL = int(os.getenv('JOIN_COMPRESS_LEVEL', 6))
+
+BACKGROUND = (255, 255, 255)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 单个 IDAT 块的大小
+IDAT_SIZE = 256 * 1024
+
+
+class JoinDirection(str, Enum):
+    HORIZONTAL = "horizontal"
+    VERTICAL = "vertical"
+    GRID = "grid"
+
+
+class Placement:
+    def __init__(self, index: int, x: int, y: int, width: int, height: int):
+        self.index = index
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class LayoutRow:
+    # 一行布局单元，行内图片在垂直方向居中
+    def __init__(self, y: int, height: int, placements: List[Placement]):
+        self.y = y
+        self.height = height
+        self.placements = placements
+
+
+def read_sizes(paths: Sequence[str]) -> List[Tuple[int, int]]:
+    # Image.open 只解析文件头，不解码像素
+    sizes = []
+    for path in paths:
+        with Image.open(path) as image:
+            sizes.append(image.size)
+    return sizes
+
+
+def compute_layout(sizes: Sequence[Tuple[int, int]], direction: JoinDirection,
+                   columns: int = 0) -> Tuple[Tuple[int, int], List[LayoutRow]]:
+    # 水平拼接是一行 N 列，垂直拼接是 N 行 1 列；网格布局每列宽度取该列最宽的图片，每行高度取该行最高的图片，
+    # 图片在单元格内居中
+    if direction == JoinDirection.HORIZONTAL:
+        columns = len(sizes)
+    elif direction == JoinDirection.VERTICAL:
+        columns = 1
+    elif columns <= 0:
+        columns = math.ceil(math.sqrt(len(sizes)))
+    columns = max(1, min(columns, len(sizes)))
+
+    grid = [list(range(start, min(start + columns, len(sizes)))) for start in range(0, len(sizes), columns)]
+    column_widths = [max(sizes[row[c]][0] for row in grid if c < len(row)) for c in range(columns)]
+    width = sum(column_widths)
+
+    rows = []
+    y = 0
+    for row in grid:
+        row_height = max(sizes[index][1] for index in row)
+        # 行内的总宽度小于画布宽度时整体居中（例如垂直拼接中较窄的图片、网格最后一行不满）
+        row_width = sum(column_widths[c] for c in range(len(row)))
+        x = (width - row_width) // 2
+        placements = []
+        for c, index in enumerate(row):
+            image_width, image_height = sizes[index]
+            placements.append(Placement(index, x + (column_widths[c] - image_width) // 2,
+                                        (row_height - image_height) // 2, image_width, image_height))
+            x += column_widths[c]
+        rows.append(LayoutRow(y, row_height, placements))
+        y += row_height
+    return (width, y), rows
+
+
+def scale_sizes(sizes: Sequence[Tuple[int, int]], direction: JoinDirection, columns: int,
+                max_dimension: int) -> List[Tuple[int, int]]:
+    # 拼接结果的长边超过 max_dimension 时，所有图片按同一比例缩小后再布局。
+    # 尺寸向下取整，多张图片累加后才不会超出上限；每边至少保留 1 像素，图片很多时仍可能超出，
+    # 这时按实际结果继续缩小，直到不超出或所有图片都已是 1 像素
+    if not max_dimension:
+        return list(sizes)
+    (width, height), _ = compute_layout(sizes, direction, columns)
+    longest = max(width, height)
+    if longest <= max_dimension:
+        return list(sizes)
+    factor = max_dimension / longest
+    while True:
+        scaled = [(max(1, int(w * factor)), max(1, int(h * factor))) for w, h in sizes]
+        (width, height), _ = compute_layout(scaled, direction, columns)
+        longest = max(width, height)
+        if longest <= max_dimension or all(size == (1, 1) for size in scaled):
+            return scaled
+        factor *= max_dimension / longest
+
+
+def load_source(path: str, placement: Placement) -> Image.Image:
+    # 解码一张源图并缩放到布局中的尺寸；JPEG 先按比例降采样解码
+    image = Image.open(path)
+    if image.size != (placement.width, placement.height):
+        if image.format == "JPEG":
+            image.draft(image.mode, (placement.width, placement.height))
+        resized = image.resize((placement.width, placement.height), Image.LANCZOS)
+        image.close()
+        return resized
+    image.load()
+    return image
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    # 透明像素合成到白色背景上，其余模式直接转换为 RGB
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", image.size, BACKGROUND)
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+class PngWriter:
+    # 增量写出 8 位 RGB PNG：调用方按行顺序提交像素，逐行选择滤波方式后送入同一个 zlib 流
+    def __init__(self, file: BinaryIO, width: int, height: int, compress_level: int = JOIN_COMPRESS_LEVEL):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.stride = width * 3
+        self._rows = 0
+        self._previous = np.zeros(self.stride, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = bytearray()
+        file.write(PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def _flush_idat(self, final: bool = False):
+        while len(self._pending) >= IDAT_SIZE or (final and self._pending):
+            self._chunk(b"IDAT", bytes(self._pending[:IDAT_SIZE]))
+            del self._pending[:IDAT_SIZE]
+
+    def write_rows(self, data: bytes):
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.stride)
+        self._pending += self._compressor.compress(self._filter(rows))
+        self._rows += rows.shape[0]
+        self._flush_idat()
+
+    def _filter(self, rows: np.ndarray) -> bytes:
+        # 每行在 None / Sub / Up 三种滤波中选择有符号字节绝对值之和最小的一种（libpng 的启发式），
+        # 候选逐个计算，临时内存只有输出带的几倍
+        sub = rows.copy()
+        sub[:, 3:] -= rows[:, :-3]
+        up = rows.copy()
+        up[0] -= self._previous
+        up[1:] -= rows[:-1]
+
+        scores = np.stack([np.abs(candidate.view(np.int8).astype(np.int16)).sum(axis=1)
+                           for candidate in (rows, sub, up)])
+        choice = np.argmin(scores, axis=0)
+
+        output = np.empty((rows.shape[0], self.stride + 1), dtype=np.uint8)
+        output[:, 0] = choice
+        output[:, 1:] = rows
+        output[choice == 1, 1:] = sub[choice == 1]
+        output[choice == 2, 1:] = up[choice == 2]
+        self._previous = rows[-1].copy()
+        return output.tobytes()
+
+    def close(self):
+        if self._rows != self.height:
+            raise ValueError(f"PNG expects {self.height} rows, got {self._rows}")
+        self._pending += self._compressor.flush()
+        self._flush_idat(final=True)
+        self._chunk(b"IEND", b"")
+
+
+def _background_rows(width: int, rows: int) -> bytes:
+    return bytes(BACKGROUND) * (width * rows)
+
+
+def _write_single_image_row(writer: PngWriter, path: str, placement: Placement, row: LayoutRow, width: int,
+                            band_rows: int):
+    # 一行只有一张图片时直接从源图裁剪出输出带，不需要整行缓冲
+    with load_source(path, placement) as image:
+        for start in range(0, row.height, band_rows):
+            height = min(band_rows, row.height - start)
+            band = Image.new("RGB", (width, height), BACKGROUND)
+            top = max(start, placement.y)
+            bottom = min(start + height, placement.y + placement.height)
+            if top < bottom:
+                band.paste(flatten(image.crop((0, top - placement.y, placement.width, bottom - placement.y))),
+                           (placement.x, top - start))
+            writer.write_rows(band.tobytes())
+
+
+def _write_multi_image_row(writer: PngWriter, paths: Sequence[str], row: LayoutRow, width: int, band_rows: int):
+    # 一行有多张图片时逐张解码，按行写入磁盘上的原始像素缓冲，再按输出带读回编码
+    stride = width * 3
+    with tempfile.TemporaryFile() as spool:
+        for start in range(0, row.height, band_rows):
+            spool.write(_background_rows(width, min(band_rows, row.height - start)))
+
+        for placement in row.placements:
+            with load_source(paths[placement.index], placement) as image:
+                for start in range(0, placement.height, band_rows):
+                    height = min(band_rows, placement.height - start)
+                    data = flatten(image.crop((0, start, placement.width, start + height))).tobytes()
+                    line = placement.width * 3
+                    for i in range(height):
+                        spool.seek((placement.y + start + i) * stride + placement.x * 3)
+                        spool.write(data[i * line:(i + 1) * line])
+
+        spool.seek(0)
+        for start in range(0, row.height, band_rows):
+            writer.write_rows(spool.read(min(band_rows, row.height - start) * stride))
+
+
+def join_to_png(paths: Sequence[str], output: BinaryIO, direction: JoinDirection, columns: int = 0,
+                band_rows: int = JOIN_BAND_ROWS, compress_level: int = JOIN_COMPRESS_LEVEL,
+                max_dimension: int = 0) -> Tuple[int, int]:
+    # 只根据文件头计算布局，源图逐张解码并直接放到目标位置，输出按行带编码
+    sizes = scale_sizes(read_sizes(paths), direction, columns, max_dimension)
+    (width, height), rows = compute_layout(sizes, direction, columns)
+    writer = PngWriter(output, width, height, compress_level)
+    for row in rows:
+        if len(row.placements) == 1:
+            _write_single_image_row(writer, paths[row.placements[0].index], row.placements[0], row, width, band_rows)
+        else:
+            _write_multi_image_row(writer, paths, row, width, band_rows)
+    writer.close()
+    return width, height
+
+
+def join_to_image(paths: Sequence[str], direction: JoinDirection, columns: int = 0,
+                  max_dimension: int = 0) -> Image.Image:
+    # 需要完整画布的输出格式使用：源图仍然逐张解码后直接粘贴，不再额外生成补边副本
+    sizes = scale_sizes(read_sizes(paths), direction, columns, max_dimension)
+    size, rows = compute_layout(sizes, direction, columns)
+    canvas = Image.new("RGB", size, BACKGROUND)
+    for row in rows:
+        for placement in row.placements:
+            with load_source(paths[placement.index], placement) as image:
+                canvas.paste(flatten(image), (placement.x, row.y + placement.y))
+    return canvas
+
+
+def join_loaded(images: Sequence[Image.Image], direction: JoinDirection, columns: int = 0) -> Image.Image:
+    # 已经在内存中的图片（例如流水线的中间结果）按同样的布局拼接
+    size, rows = compute_layout([image.size for image in images], direction, columns)
+    canvas = Image.new("RGB", size, BACKGROUND)
+    for row in rows:
+        for placement in row.placements:
+            canvas.paste(flatten(images[placement.index]), (placement.x, row.y + placement.y))
+    return canvas
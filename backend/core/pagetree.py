@@ -0,0 +1,195 @@
+import bisect
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from pypdf import PageObject, PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject
+
+# 页面可以从父节点继承的属性（PDF 规范 7.7.3.4）
+INHERITABLE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+# 页面树的最大深度，防止损坏文件中的循环引用
+MAX_TREE_DEPTH = 64
+
+
+class PageRangeError(ValueError):
+    pass
+
+
+def page_count(reader: PdfReader) -> int:
+    # 页面树的 /Count 自洽时直接使用，不展开页面树；损坏的文件按实际遍历到的页面计数
+    root = reader.trailer["/Root"]["/Pages"].get_object()
+    count = _tree_count(root, set(), 0)
+    if count is None:
+        return sum(1 for _ in iter_page_tree(reader))
+    return count
+
+
+def _is_page(reference) -> bool:
+    return isinstance(reference, IndirectObject) and \
+        isinstance(reference.get_object(), DictionaryObject) and reference.get_object().get("/Type") == "/Page"
+
+
+def _tree_count(node: DictionaryObject, visited: set, depth: int) -> Optional[int]:
+    # 校验节点的 /Count：读取子节点逐个累加（中间节点递归），任一节点与 /Count 不符时返回 None。
+    # 子节点数等于 /Count 并不说明每个子节点都是一页，其中可能有中间节点
+    if depth > MAX_TREE_DEPTH:
+        raise PageRangeError("Page tree is too deep")
+    kids = node.get("/Kids", [])
+    count = node.get("/Count")
+
+    total = 0
+    for reference in kids:
+        if not isinstance(reference, IndirectObject) or reference.idnum in visited:
+            continue
+        kid = reference.get_object()
+        if not isinstance(kid, DictionaryObject):
+            continue
+        if kid.get("/Type") == "/Pages" or "/Kids" in kid:
+            visited.add(reference.idnum)
+            subtotal = _tree_count(kid, visited, depth + 1)
+            if subtotal is None:
+                return None
+            total += subtotal
+        else:
+            total += 1
+    return total if total == count else None
+
+
+def parse_page_ranges(spec: str, total: int) -> List[int]:
+    # 解析 "1-3,10,50-" 形式的页码范围（从 1 开始），返回从 0 开始的页码，保持书写顺序
+    indices = []
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start = int(start) if start else 1
+                end = int(end) if end else total
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise PageRangeError(f"Invalid page range: {part}")
+        if start < 1 or end < start:
+            raise PageRangeError(f"Invalid page range: {part}")
+        if end > total:
+            raise PageRangeError(f"Page range {part} exceeds page count {total}")
+        indices.extend(range(start - 1, end))
+    if not indices:
+        raise PageRangeError("No pages selected")
+    return indices
+
+
+def _make_page(reader: PdfReader, reference: IndirectObject, node: DictionaryObject,
+               inherited: Dict[str, object]) -> PageObject:
+    page = PageObject(reader, reference)
+    page.update(node)
+    for key, value in inherited.items():
+        if key not in page:
+            page[key] = value
+    return page
+
+
+def _walk(reader: PdfReader, node: DictionaryObject, offset: int, targets: Sequence[int],
+          inherited: Dict[str, object], found: Dict[int, PageObject], visited: set, depth: int) -> int:
+    # 按 /Count 跳过不含目标页的子树，只解析通往目标页路径上的节点，返回遍历后的页码偏移
+    if depth > MAX_TREE_DEPTH:
+        raise PageRangeError("Page tree is too deep")
+    inherited = {**inherited, **{key: node[key] for key in INHERITABLE_KEYS if key in node}}
+    kids = node.get("/Kids", [])
+
+    # 子节点全部是页面时每个子节点正好一页，可以按下标直接定位目标页，不必逐页计算偏移
+    if node.get("/Count") == len(kids) and all(_is_page(reference) for reference in kids):
+        end = offset + len(kids)
+        for target in targets[bisect.bisect_left(targets, offset):bisect.bisect_left(targets, end)]:
+            _visit(reader, kids[target - offset], target, targets, inherited, found, visited, depth)
+        return end
+
+    for reference in kids:
+        # 所有目标页都已经越过，后面的节点不用再读取
+        if offset > targets[-1]:
+            break
+        offset = _visit(reader, reference, offset, targets, inherited, found, visited, depth)
+    return offset
+
+
+def _visit(reader: PdfReader, reference, offset: int, targets: Sequence[int], inherited: Dict[str, object],
+           found: Dict[int, PageObject], visited: set, depth: int) -> int:
+    if not isinstance(reference, IndirectObject) or reference.idnum in visited:
+        return offset
+    kid = reference.get_object()
+    if not isinstance(kid, DictionaryObject):
+        return offset
+
+    if kid.get("/Type") == "/Pages" or "/Kids" in kid:
+        count = kid.get("/Count")
+        first = bisect.bisect_left(targets, offset)
+        if isinstance(count, int) and count >= 0 and \
+                (first == len(targets) or targets[first] >= offset + count):
+            return offset + count
+        visited.add(reference.idnum)
+        return _walk(reader, kid, offset, targets, inherited, found, visited, depth + 1)
+
+    index = bisect.bisect_left(targets, offset)
+    if index < len(targets) and targets[index] == offset:
+        found[offset] = _make_page(reader, reference, kid, inherited)
+    return offset + 1
+
+
+def iter_pages(reader: PdfReader, indices: List[int]) -> Iterator[PageObject]:
+    # 只解析指定页面，避免 reader.pages 展开整个页面树；/Count 不可信时无法跳过子树，改为顺序遍历
+    targets = sorted(set(indices))
+    found: Dict[int, PageObject] = {}
+    root = reader.trailer["/Root"]["/Pages"].get_object()
+    if _tree_count(root, set(), 0) is None:
+        wanted = set(targets)
+        for index, page in zip(range(targets[-1] + 1), iter_page_tree(reader)):
+            if index in wanted:
+                found[index] = page
+    else:
+        _walk(reader, root, 0, targets, {}, found, set(), 0)
+
+    for index in indices:
+        if index not in found:
+            raise PageRangeError(f"Page {index + 1} does not exist")
+        yield found[index]
+
+
+def iter_page_tree(reader: PdfReader) -> Iterator[PageObject]:
+    # 按顺序逐页遍历页面树，不像 reader.pages 那样先展开并保存全部页面
+    root = reader.trailer["/Root"]["/Pages"].get_object()
+    yield from _iter_node(reader, root, {}, set(), 0)
+
+
+def _iter_node(reader: PdfReader, node: DictionaryObject, inherited: Dict[str, object], visited: set,
+               depth: int) -> Iterator[PageObject]:
+    if depth > MAX_TREE_DEPTH:
+        raise PageRangeError("Page tree is too deep")
+    inherited = {**inherited, **{key: node[key] for key in INHERITABLE_KEYS if key in node}}
+
+    for reference in node.get("/Kids", []):
+        if not isinstance(reference, IndirectObject) or reference.idnum in visited:
+            continue
+        kid = reference.get_object()
+        if not isinstance(kid, DictionaryObject):
+            continue
+        if kid.get("/Type") == "/Pages" or "/Kids" in kid:
+            visited.add(reference.idnum)
+            yield from _iter_node(reader, kid, inherited, visited, depth + 1)
+        else:
+            yield _make_page(reader, reference, kid, inherited)
+
+
+def release_page(reader: PdfReader, page: PageObject):
+    # 从 reader 的对象缓存中移除只属于该页的对象（页面字典、内容流、注释），
+    # 字体、图片等共享资源保留在缓存中，后续页面直接复用已解析的对象
+    references = [page.indirect_reference]
+    for key in ("/Contents", "/Annots"):
+        value = page.raw_get(key) if key in page else None
+        if isinstance(value, IndirectObject):
+            references.append(value)
+            value = reader.cache_get_indirect_object(value.generation, value.idnum)
+        if isinstance(value, ArrayObject):
+            references.extend(item for item in value if isinstance(item, IndirectObject))
+    for reference in references:
+        if reference is not None:
+            reader.resolved_objects.pop((reference.generation, reference.idnum), None)
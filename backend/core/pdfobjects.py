@@ -0,0 +1,28 @@
+from typing import Iterator, List, Tuple
+
+from pypdf import PdfWriter
+from pypdf.generic import IndirectObject, PdfObject
+
+# pypdf 没有公开遍历和替换 PdfWriter 全部间接对象的接口，压缩用到的私有属性都集中在这里，
+# 只在 requirements.txt 固定的 pypdf 版本上验证过，升级时由 tests/test_pdfobjects.py 检查
+
+
+def iter_objects(writer: PdfWriter) -> Iterator[Tuple[int, PdfObject]]:
+    # 按编号产出 writer 中的所有间接对象，已删除的编号跳过
+    for index, obj in enumerate(writer._objects):
+        if obj is not None:
+            yield index + 1, obj
+
+
+def replace_object(writer: PdfWriter, reference, obj: PdfObject):
+    # reference 为对象编号或 IndirectObject，保留原编号，其他对象的引用不受影响
+    writer._replace_object(reference, obj)
+
+
+def trailer_references(writer: PdfWriter) -> List[IndirectObject]:
+    # 写出时 trailer 直接引用的对象（Root 和 Info），可达性分析的起点
+    references = [writer.root_object.indirect_reference]
+    info = writer._info_obj
+    if isinstance(info, IndirectObject):
+        references.append(info)
+    return references
@@ -0,0 +1,165 @@
+import contextvars
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from dotenv import load_dotenv
+
+from core.executor import pool
+
+load_dotenv()
+
+# 流水线在一个 worker 进程内执行，互不依赖的分支用线程并行，0 表示 CPU 核数除以 pipeline 的并发上限
+PIPELINE_THREADS = int(os.getenv('PIPELINE_THREADS', 0)) or pool.threads_per_task("pipeline")
+# 单个流水线允许的最大节点数
+PIPELINE_MAX_STEPS = int(os.getenv('PIPELINE_MAX_STEPS', 32))
+
+# 引用上传文件的输入写作 file:<序号>
+FILE_PREFIX = "file:"
+
+
+class PipelineError(ValueError):
+    pass
+
+
+class Step:
+    def __init__(self, id: str, op: str, inputs: List[str], params: Optional[dict] = None):
+        self.id = id
+        self.op = op
+        self.inputs = inputs
+        self.params = params or {}
+
+
+def file_index(ref: str) -> Optional[int]:
+    if not ref.startswith(FILE_PREFIX):
+        return None
+    try:
+        return int(ref[len(FILE_PREFIX):])
+    except ValueError:
+        raise PipelineError(f"Invalid file reference: {ref}")
+
+
+def order_steps(steps: Sequence[Step], file_count: int) -> List[Step]:
+    # 校验节点引用并按拓扑序排列，存在环时报错
+    if not steps:
+        raise PipelineError("Pipeline has no steps")
+    if len(steps) > PIPELINE_MAX_STEPS:
+        raise PipelineError(f"Pipeline has more than {PIPELINE_MAX_STEPS} steps")
+
+    by_id: Dict[str, Step] = {}
+    for step in steps:
+        if not step.id or step.id.startswith(FILE_PREFIX):
+            raise PipelineError(f"Invalid step id: {step.id!r}")
+        if step.id in by_id:
+            raise PipelineError(f"Duplicate step id: {step.id}")
+        by_id[step.id] = step
+
+    waiting: Dict[str, int] = {}
+    consumers: Dict[str, List[str]] = {step.id: [] for step in steps}
+    for step in steps:
+        if not step.inputs:
+            raise PipelineError(f"Step {step.id} has no inputs")
+        for ref in step.inputs:
+            index = file_index(ref)
+            if index is not None:
+                if not 0 <= index < file_count:
+                    raise PipelineError(f"Step {step.id} references missing file {ref}")
+            elif ref not in by_id:
+                raise PipelineError(f"Step {step.id} references unknown step {ref}")
+            else:
+                consumers[ref].append(step.id)
+        waiting[step.id] = len({ref for ref in step.inputs if ref in by_id})
+
+    ordered = []
+    ready = [step.id for step in steps if not waiting[step.id]]
+    while ready:
+        step_id = ready.pop(0)
+        ordered.append(by_id[step_id])
+        for consumer in dict.fromkeys(consumers[step_id]):
+            waiting[consumer] -= 1
+            if not waiting[consumer]:
+                ready.append(consumer)
+    if len(ordered) != len(steps):
+        raise PipelineError("Pipeline contains a cycle")
+    return ordered
+
+
+def default_outputs(steps: Sequence[Step]) -> List[str]:
+    # 没有被其他节点使用的节点就是最终输出
+    used = {ref for step in steps for ref in step.inputs}
+    return [step.id for step in steps if step.id not in used]
+
+
+def run_steps(steps: Sequence[Step], outputs: Sequence[str], load: Callable[[int], list],
+              execute: Callable[[Step, List[list], List[bool]], list],
+              serialize: Optional[Callable[[str, list], object]] = None,
+              threads: int = PIPELINE_THREADS) -> Iterator[Tuple[str, object]]:
+    # 输入全部就绪的节点提交到线程池，互不依赖的分支并行执行，输出节点按完成顺序产出。
+    # 每个节点的结果是一组文档；最后一个使用者提交后即释放引用，中间结果不会堆积在内存中。
+    # execute 额外收到每个输入是否被其他节点共享，会原地修改文档的操作需要先复制共享的输入。
+    # 给出 serialize 时输出节点在自己的线程里紧接着序列化，产出序列化的结果：写出文档会修改它
+    # （例如 PdfWriter.write），必须在使用它的下游节点提交之前完成
+    uses: Dict[str, int] = {}
+    for step in steps:
+        for ref in step.inputs:
+            uses[ref] = uses.get(ref, 0) + 1
+    output_set = set(outputs)
+    shared = {ref for ref, count in uses.items() if count > 1} | output_set
+
+    values: Dict[str, list] = {}
+    remaining = {step.id: set(step.inputs) for step in steps}
+    pending: Dict[Future, str] = {}
+    submitted: Set[str] = set()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, threads))
+
+    def submit(ref: str, fn: Callable, *args):
+        # 复制上下文，线程中记录的阶段耗时同样会带回主进程
+        pending[executor.submit(contextvars.copy_context().run, fn, *args)] = ref
+        submitted.add(ref)
+
+    serialized: Dict[str, object] = {}
+
+    def execute_output(step: Step, inputs: List[list], flags: List[bool]):
+        documents = execute(step, inputs, flags)
+        return documents, serialize(step.id, documents)
+
+    def submit_ready():
+        for step in steps:
+            if step.id in submitted or remaining[step.id]:
+                continue
+            inputs = [values[ref] for ref in step.inputs]
+            flags = [ref in shared for ref in step.inputs]
+            if serialize is not None and step.id in output_set:
+                submit(step.id, execute_output, step, inputs, flags)
+            else:
+                submit(step.id, execute, step, inputs, flags)
+            for ref in step.inputs:
+                uses[ref] -= 1
+                if not uses[ref] and ref not in output_set:
+                    values.pop(ref, None)
+
+    try:
+        for ref in dict.fromkeys(ref for step in steps for ref in step.inputs):
+            index = file_index(ref)
+            if index is not None:
+                submit(ref, load, index)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ref = pending.pop(future)
+                if serialize is not None and ref in output_set:
+                    values[ref], serialized[ref] = future.result()
+                else:
+                    values[ref] = future.result()
+                for step in steps:
+                    remaining[step.id].discard(ref)
+            # 先提交后续节点再产出结果，回传输出时下游分支已经在运行
+            submit_ready()
+            for ref in [ref for ref in outputs if ref in output_set and ref in values]:
+                output_set.discard(ref)
+                document = values[ref] if uses.get(ref) else values.pop(ref)
+                yield ref, serialized.pop(ref) if serialize is not None else document
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
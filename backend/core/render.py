@@ -0,0 +1,98 @@
+import math
+import os
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from dotenv import load_dotenv
+from pypdf import PdfReader
+
+from core.pagetree import iter_page_tree, release_page
+
+load_dotenv()
+
+# 单页渲染的像素上限（宽 × 高），超出时自动降低该页的 DPI；默认约为 A4 在 600 DPI 下的像素数，0 表示不限制
+RENDER_MAX_PIXELS = int(os.getenv('RENDER_MAX_PIXELS', 36_000_000))
+
+POINTS_PER_INCH = 72
+# 黑白模式的二值化阈值，灰度值不低于该值的像素为白色
+MONO_THRESHOLD = 128
+
+
+class ColorMode(str, Enum):
+    COLOR = "color"
+    GRAY = "gray"
+    MONO = "mono"
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    dpi: int = 600
+    # 目标框的宽高（像素），页面等比缩放到框内；0 表示不限制该方向，都为 0 时按 dpi 渲染
+    width: int = 0
+    height: int = 0
+    # 单页像素上限，0 表示不限制
+    max_pixels: int = RENDER_MAX_PIXELS
+    color: ColorMode = ColorMode.COLOR
+
+    @property
+    def grayscale(self) -> bool:
+        return self.color != ColorMode.COLOR
+
+    @property
+    def image_mode(self) -> str:
+        return "L" if self.grayscale else "RGB"
+
+    def cache_params(self) -> dict:
+        return {"dpi": self.dpi, "width": self.width, "height": self.height, "max_pixels": self.max_pixels,
+                "color": self.color.value}
+
+    def page_args(self, size: Tuple[float, float]) -> Tuple[int, Optional[Tuple[Optional[int], Optional[int]]]]:
+        # 返回该页传给 convert_from_path 的 (dpi, size)。指定目标框时由限制更紧的一边决定缩放，
+        # 交给 poppler 的 -scale-to-x / -scale-to-y 直接按目标尺寸渲染，而不是先按高 DPI 渲染再缩小
+        width_in, height_in = size[0] / POINTS_PER_INCH, size[1] / POINTS_PER_INCH
+        dpi, scale_to = self.dpi, None
+        candidates = []
+        if self.width:
+            candidates.append((self.width / width_in, (self.width, None)))
+        if self.height:
+            candidates.append((self.height / height_in, (None, self.height)))
+        if candidates:
+            dpi, scale_to = min(candidates, key=lambda candidate: candidate[0])
+
+        if self.max_pixels:
+            limit = math.sqrt(self.max_pixels / (width_in * height_in))
+            if dpi > limit:
+                return max(1, int(limit)), None
+        # 按目标框渲染时 poppler 忽略 dpi，统一传入原值，相邻页面可以合并为一次调用
+        return self.dpi, scale_to
+
+
+def limit_max_pixels(requested: int) -> int:
+    # 请求只能收紧服务端的像素上限，0 表示使用服务端上限
+    if not RENDER_MAX_PIXELS:
+        return requested
+    return min(requested, RENDER_MAX_PIXELS) if requested else RENDER_MAX_PIXELS
+
+
+def page_sizes(pdf_path: str) -> List[Tuple[float, float]]:
+    # 只沿页面树读取 MediaBox 和 Rotate（poppler 默认按 MediaBox 渲染），不解析内容流；
+    # 旋转 90/270 度的页面交换宽高
+    reader = PdfReader(pdf_path)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    sizes = []
+    for page in iter_page_tree(reader):
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        if page.rotation % 180:
+            width, height = height, width
+        sizes.append((max(width, 1.0), max(height, 1.0)))
+        release_page(reader, page)
+    return sizes
+
+
+def to_mono(image: Image.Image) -> Image.Image:
+    # 先按灰度渲染，再按固定阈值二值化（不做抖动，文字边缘更清晰）
+    gray = image if image.mode == "L" else image.convert("L")
+    return gray.point(lambda value: 255 if value >= MONO_THRESHOLD else 0, mode="1")
@@ -0,0 +1,42 @@
+import mmap
+from multiprocessing.reduction import ForkingPickler
+from tempfile import SpooledTemporaryFile
+from typing import Union
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from core.metrics import stage
+
+# 上传内容：还在内存中的小文件为 bytes，已经落盘的为只读 mmap。两者都支持切片、len 和 hashlib，
+# mmap 持有自己的文件描述符，上传文件在接口返回后被关闭也仍然可读
+UploadData = Union[bytes, mmap.mmap]
+
+
+def _reduce_mmap(mapped: mmap.mmap):
+    # 进程池参数经 pickle 传给 worker，mmap 在这里才复制成 bytes；
+    # 排队等待 worker 的请求只占用映射的页缓存，不额外持有一份完整的副本
+    return bytes, (mapped[:],)
+
+
+ForkingPickler.register(mmap.mmap, _reduce_mmap)
+
+
+def read_upload_bytes(file: UploadFile) -> UploadData:
+    # 直接从上传的 spool 读取：还在内存中时读出内存缓冲，已经落盘时返回其 mmap，不再复制到临时目录。
+    # SpooledTemporaryFile 落盘后 name 才不为 None（fileno() 会强制落盘，不能用来判断）
+    spool = file.file
+    spool.seek(0)
+    if isinstance(spool, SpooledTemporaryFile) and spool.name is not None:
+        spool.flush()
+        try:
+            return mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法 mmap
+            return b""
+    return spool.read()
+
+
+async def read_upload(file: UploadFile) -> UploadData:
+    with stage("upload"):
+        return await run_in_threadpool(read_upload_bytes, file)
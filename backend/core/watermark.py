@@ -0,0 +1,99 @@
+import functools
+import os
+from enum import Enum
+from typing import Iterator, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageFont
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 图片水印字体，找不到时使用 Pillow 自带字体
+WATERMARK_FONT = os.getenv('WATERMARK_FONT', 'arial')
+# 每个 worker 进程缓存的水印图章数量，按 (文字, 字体, 字号, 透明度) 区分
+WATERMARK_STAMP_CACHE_SIZE = int(os.getenv('WATERMARK_STAMP_CACHE_SIZE', 128))
+# 字号按该步长取整，分辨率相近的图片共用同一个图章
+FONT_SIZE_STEP = 8
+MIN_FONT_SIZE = 12
+
+
+class WatermarkPosition(str, Enum):
+    BOTTOM_RIGHT = "bottom-right"
+    BOTTOM_LEFT = "bottom-left"
+    TOP_RIGHT = "top-right"
+    TOP_LEFT = "top-left"
+    CENTER = "center"
+    TILE = "tile"
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(name: str, size: int) -> Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]:
+    try:
+        return ImageFont.truetype(name, size)
+    except IOError:
+        return ImageFont.load_default(size)
+
+
+def font_size_for(image_size: Tuple[int, int], scale: float) -> int:
+    # 字号取图片短边乘以 scale，再按步长取整
+    size = min(image_size) * scale
+    return max(MIN_FONT_SIZE, int(round(size / FONT_SIZE_STEP)) * FONT_SIZE_STEP)
+
+
+@functools.lru_cache(maxsize=WATERMARK_STAMP_CACHE_SIZE)
+def get_stamp(text: str, font_name: str, size: int, opacity: float) -> Image.Image:
+    # 文字只栅格化一次，得到裁剪到文字边界的 RGBA 图章
+    font = load_font(font_name, size)
+    left, top, right, bottom = font.getbbox(text)
+    stamp = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (255, 255, 255, 0))
+    ImageDraw.Draw(stamp).text((-left, -top), text, font=font, fill=(255, 255, 255, round(255 * opacity)))
+    return stamp
+
+
+def stamp_positions(image_size: Tuple[int, int], stamp_size: Tuple[int, int], position: WatermarkPosition,
+                    margin: int) -> Iterator[Tuple[int, int]]:
+    width, height = image_size
+    stamp_width, stamp_height = stamp_size
+    if position == WatermarkPosition.TILE:
+        # 平铺时相邻两行错开半个间距
+        step_x = stamp_width + stamp_width // 2
+        step_y = stamp_height * 3
+        for row, y in enumerate(range(margin, height, step_y)):
+            offset = (step_x // 2) * (row % 2)
+            for x in range(margin - offset, width, step_x):
+                yield x, y
+        return
+
+    right = width - stamp_width - margin
+    bottom = height - stamp_height - margin
+    yield {
+        WatermarkPosition.BOTTOM_RIGHT: (right, bottom),
+        WatermarkPosition.BOTTOM_LEFT: (margin, bottom),
+        WatermarkPosition.TOP_RIGHT: (right, margin),
+        WatermarkPosition.TOP_LEFT: (margin, margin),
+        WatermarkPosition.CENTER: ((width - stamp_width) // 2, (height - stamp_height) // 2),
+    }[position]
+
+
+def apply_watermark(image: Image.Image, text: str, position: WatermarkPosition = WatermarkPosition.BOTTOM_RIGHT,
+                    opacity: float = 0.5, scale: float = 0.1) -> Image.Image:
+    # 按图章的 alpha 合成到图片上；RGB 图片用图章作为蒙版粘贴，RGBA 图片按区域做 alpha 合成
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    size = font_size_for(image.size, scale)
+    stamp = get_stamp(text, WATERMARK_FONT, size, opacity)
+    margin = max(10, size // 4)
+
+    for x, y in stamp_positions(image.size, stamp.size, position, margin):
+        if image.mode == "RGBA":
+            # alpha_composite 不接受超出边界的位置，先裁剪图章
+            left, top = max(0, -x), max(0, -y)
+            right = min(stamp.width, image.width - x)
+            bottom = min(stamp.height, image.height - y)
+            if left < right and top < bottom:
+                image.alpha_composite(stamp, (x + left, y + top), (left, top, right, bottom))
+        else:
+            image.paste(stamp, (x, y), stamp)
+    return image
@@ -0,0 +1,110 @@
+import os
+import zipfile
+from typing import AsyncIterator, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from core.cache import CacheWriter, result_cache
+from core.metrics import stage
+
+# 已经压缩过的格式直接 STORED，避免重复 deflate 浪费 CPU
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".avif", ".gif", ".zip"}
+
+
+class _ChunkBuffer:
+    # 只支持 write 的缓冲区，ZipFile 检测到不可 seek 时会使用 data descriptor 流式写入
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    def __init__(self):
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add(self, name: str, data: bytes) -> bytes:
+        ext = os.path.splitext(name)[1].lower()
+        compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self._zip.writestr(name, data, compress_type=compress_type)
+        return self._buffer.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._buffer.drain()
+
+
+async def stream_zip(entries: AsyncIterator[Tuple[str, bytes]],
+                     cache_writer: Optional[CacheWriter] = None) -> AsyncIterator[bytes]:
+    # 可选地把发送出去的字节同时写入结果缓存，完整发送后才提交
+    archive = ZipStream()
+    try:
+        async for name, data in entries:
+            # deflate 在线程池中执行，不阻塞事件循环
+            with stage("zip"):
+                chunk = await run_in_threadpool(archive.add, name, data)
+            if cache_writer is not None:
+                cache_writer.write(chunk)
+            yield chunk
+        chunk = archive.close()
+        if cache_writer is not None:
+            cache_writer.write(chunk)
+            await run_in_threadpool(cache_writer.commit)
+        yield chunk
+    except BaseException:
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+
+
+async def prefetch(entries: AsyncIterator) -> AsyncIterator:
+    # 在返回响应前先取出第一项，这样输入错误仍然可以返回 4xx/5xx 而不是中断的下载
+    try:
+        first = await entries.__anext__()
+    except StopAsyncIteration:
+        return _empty()
+
+    async def chained():
+        try:
+            yield first
+            async for item in entries:
+                yield item
+        finally:
+            await entries.aclose()
+
+    return chained()
+
+
+async def _empty():
+    return
+    yield
+
+
+def zip_response(entries: AsyncIterator[Tuple[str, bytes]], filename: str,
+                 headers: Optional[dict] = None, cache_key: Optional[str] = None) -> StreamingResponse:
+    headers = headers or {}
+    cache_writer = result_cache.writer(cache_key, "application/zip", filename, headers)
+    return StreamingResponse(
+        stream_zip(entries, cache_writer),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}", **headers}
+    )
+
+
+async def write_zip(entries: AsyncIterator[Tuple[str, bytes]], path: str):
+    # 异步任务使用，把 ZIP 直接写到结果文件
+    with open(path, "wb") as f:
+        async for chunk in stream_zip(entries):
+            await run_in_threadpool(f.write, chunk)
@@ -1,16 +1,164 @@
+import asyncio
+import json
+import logging
 import os
+import threading
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+from core.memo import AsyncMemo
+from core.metrics import stage
+
 load_dotenv()
 
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'), transport='rest')
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+# 官方 demo 默认的 grpc 传输会出现超时问题，默认使用 rest
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT', 'rest')
+# 单次生成的超时（秒）
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', 60))
+# 同时进行的生成请求数，超出的请求排队等待
+GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', 4))
+# 提示词 → 完整回复的内存缓存，条目数或有效期（秒）为 0 时关闭
+GEMINI_CACHE_SIZE = int(os.getenv('GEMINI_CACHE_SIZE', 512))
+GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL', 3600))
+# 指向 {"提示词": ["片段", ...]} 的 JSON 文件时使用本地回放，不调用 Gemini，用于测试和本地开发
+GEMINI_FAKE_RESPONSES = os.getenv('GEMINI_FAKE_RESPONSES', '')
+GEMINI_FAKE_DELAY = float(os.getenv('GEMINI_FAKE_DELAY', 0.05))
+
+
+class GeminiError(Exception):
+    pass
+
+
+class GeminiBackend:
+    # 进程内复用同一个 GenerativeModel 及其连接；SDK 在第一次调用时才导入，回放后端不依赖它
+    def __init__(self, model: str = GEMINI_MODEL, api_key: Optional[str] = GEMINI_API_KEY,
+                 transport: str = GEMINI_TRANSPORT, timeout: float = GEMINI_TIMEOUT):
+        self.model_name = model
+        self.api_key = api_key
+        self.transport = transport
+        self.timeout = timeout
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key, transport=self.transport)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        response = self.model.generate_content(prompt, stream=True, request_options={"timeout": self.timeout})
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # 被安全策略拦截的片段没有文本
+                raise GeminiError(f"Gemini response blocked: {chunk.prompt_feedback or chunk.candidates}")
+            if text:
+                yield text
+
+
+class FakeBackend:
+    # 回放预先录制的片段，未录制的提示词原样分词返回
+    def __init__(self, responses: Dict[str, List[str]], delay: float = GEMINI_FAKE_DELAY):
+        self.model_name = "fake"
+        self.responses = responses
+        self.delay = delay
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path: str, delay: float = GEMINI_FAKE_DELAY) -> "FakeBackend":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), delay)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.calls += 1
+        chunks = self.responses.get(prompt)
+        if chunks is None:
+            chunks = [word + " " for word in prompt.split()]
+        for chunk in chunks:
+            if self.delay:
+                threading.Event().wait(self.delay)
+            yield chunk
+
+
+class ChatService:
+    # 后端的同步流在线程中迭代，片段经队列转成异步生成器；并发受信号量限制，完整的回复按提示词缓存，
+    # 同一提示词的并发请求共享一次生成
+    def __init__(self, backend, concurrency: int = GEMINI_CONCURRENCY,
+                 cache_size: int = GEMINI_CACHE_SIZE, cache_ttl: int = GEMINI_CACHE_TTL):
+        self.backend = backend
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.cache = AsyncMemo(cache_size, cache_ttl)
+
+    def cache_key(self, prompt: str) -> str:
+        return f"{self.backend.model_name}\0{prompt}"
+
+    def cached(self, prompt: str) -> Optional[str]:
+        return self.cache.get(self.cache_key(prompt))
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        async for chunk in self.cache.stream(self.cache_key(prompt), lambda: self._generate(prompt), "".join):
+            yield chunk
+
+    async def _generate(self, prompt: str) -> AsyncIterator[str]:
+        async with self.semaphore:
+            with stage("gemini"):
+                async for chunk in self._iterate(prompt):
+                    yield chunk
+
+    async def complete(self, prompt: str) -> str:
+        return "".join([chunk async for chunk in self.stream(prompt)])
+
+    async def _iterate(self, prompt: str) -> AsyncIterator[str]:
+        # 消费方提前停止（例如客户端断开）时通知线程不再读取后续片段；不等待线程退出，
+        # SDK 可能要等到下一个片段才返回，信号量名额立即归还
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in self.backend.stream(prompt):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            if not producer.done():
+                producer.add_done_callback(lambda future: future.exception())
+
+
+def create_backend():
+    if GEMINI_FAKE_RESPONSES:
+        return FakeBackend.from_file(GEMINI_FAKE_RESPONSES)
+    return GeminiBackend()
+
+
+chat_service = ChatService(create_backend())
 
 
-def chat(text):
-    # 注意这行代码，官方提供的demo没有transport='rest' 会出现超时问题，因此一定要加上
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content(text, stream=True)
-    for chunk in response:
-        print(chunk.text, end='', flush=True)
+async def chat(text: str) -> str:
+    return await chat_service.complete(text)
@@ -0,0 +1,288 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from core.executor import parse_op_limits
+from core.metrics import stage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REPLICATE_API_TOKEN = os.getenv('REPLICATE_API_TOKEN', '')
+# API 地址，测试时可以指向本地的模拟服务
+REPLICATE_API_BASE = os.getenv('REPLICATE_API_BASE', 'https://api.replicate.com').rstrip('/')
+# 单个 HTTP 请求的超时，以及一次预测从创建到完成的总超时（秒）
+REPLICATE_HTTP_TIMEOUT = float(os.getenv('REPLICATE_HTTP_TIMEOUT', 30))
+REPLICATE_PREDICTION_TIMEOUT = float(os.getenv('REPLICATE_PREDICTION_TIMEOUT', 300))
+# 连接池大小
+REPLICATE_MAX_CONNECTIONS = int(os.getenv('REPLICATE_MAX_CONNECTIONS', 20))
+# 每个模型同时进行的预测数，REPLICATE_MODEL_LIMITS 按模型覆盖，格式 "nightmareai/real-esrgan=2"
+REPLICATE_MODEL_CONCURRENCY = int(os.getenv('REPLICATE_MODEL_CONCURRENCY', 4))
+REPLICATE_MODEL_LIMITS = os.getenv('REPLICATE_MODEL_LIMITS', '')
+# 失败请求的重试次数（POST 只在连接失败和 429 时重试），退避时间从 REPLICATE_RETRY_BACKOFF 秒开始翻倍
+REPLICATE_MAX_RETRIES = int(os.getenv('REPLICATE_MAX_RETRIES', 3))
+REPLICATE_RETRY_BACKOFF = float(os.getenv('REPLICATE_RETRY_BACKOFF', 0.5))
+# 轮询间隔从 0.2 秒逐步增加到该值
+REPLICATE_POLL_INTERVAL = float(os.getenv('REPLICATE_POLL_INTERVAL', 2))
+# 配置后由 Replicate 回调通知完成（指向 /api/image/replicate/webhook 的公网地址），轮询降为兜底；
+# 启用回调时必须配置签名密钥，否则启动失败
+REPLICATE_WEBHOOK_URL = os.getenv('REPLICATE_WEBHOOK_URL', '')
+REPLICATE_WEBHOOK_SECRET = os.getenv('REPLICATE_WEBHOOK_SECRET', '')
+REPLICATE_WEBHOOK_POLL_INTERVAL = float(os.getenv('REPLICATE_WEBHOOK_POLL_INTERVAL', 15))
+# 不超过该大小的文件以 data URI 内联，更大的文件先上传到 Replicate 文件接口
+REPLICATE_DATA_URI_MAX_BYTES = int(os.getenv('REPLICATE_DATA_URI_MAX_BYTES', 256 * 1024))
+
+FIRST_POLL_INTERVAL = 0.2
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+# 回调早于登记等待者到达时暂存的预测数
+EARLY_WEBHOOK_CACHE_SIZE = 256
+# 回调签名允许的时间偏差（秒）
+WEBHOOK_TOLERANCE = 300
+# 请求还没有发到服务端的错误，非幂等的 POST 也可以安全重试
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class ReplicateError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ReplicateTimeout(ReplicateError):
+    pass
+
+
+class FileInput:
+    # 作为模型输入的文件内容
+    def __init__(self, data: bytes, content_type: str = "application/octet-stream", filename: str = "file"):
+        self.data = data
+        self.content_type = content_type
+        self.filename = filename
+
+
+def model_name(model: str) -> str:
+    return model.split(":", 1)[0]
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    # 指数退避加随机抖动，避免大量请求同时重试
+    return REPLICATE_RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+class ReplicateClient:
+    # 共享连接池的异步客户端：按模型限制并发，请求失败时退避重试，通过回调或轮询等待预测完成
+    def __init__(self, base_url: str = REPLICATE_API_BASE, token: str = REPLICATE_API_TOKEN,
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 webhook_url: str = REPLICATE_WEBHOOK_URL, webhook_secret: str = REPLICATE_WEBHOOK_SECRET):
+        # 没有签名密钥时任何人都能伪造回调、篡改预测结果，因此启用回调必须同时配置密钥
+        if webhook_url and not webhook_secret:
+            raise RuntimeError("REPLICATE_WEBHOOK_SECRET is required when REPLICATE_WEBHOOK_URL is set")
+        self.base_url = base_url
+        self.token = token
+        self.transport = transport
+        self.webhook_url = webhook_url
+        self.model_limits = parse_op_limits(REPLICATE_MODEL_LIMITS)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._early: "collections.OrderedDict[str, dict]" = collections.OrderedDict()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.token}"},
+                timeout=httpx.Timeout(REPLICATE_HTTP_TIMEOUT),
+                limits=httpx.Limits(max_connections=REPLICATE_MAX_CONNECTIONS,
+                                    max_keepalive_connections=REPLICATE_MAX_CONNECTIONS),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        name = model_name(model)
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.model_limits.get(name, REPLICATE_MODEL_CONCURRENCY))
+        return self._semaphores[name]
+
+    async def _request(self, method: str, path: str, idempotent: Optional[bool] = None, **kwargs) -> httpx.Response:
+        # 幂等请求（默认只有 GET）在连接错误、超时、429 和 5xx 时重试；创建预测、上传文件等 POST
+        # 可能已经被服务端执行，只在请求确定没有发出或被 429 拒绝时重试，避免重复创建和计费。
+        # 非 GET 请求带 Idempotency-Key，重试时沿用同一个，服务端可以据此识别重复请求
+        if idempotent is None:
+            idempotent = method == "GET"
+        if method != "GET":
+            kwargs["headers"] = {"Idempotency-Key": uuid.uuid4().hex, **kwargs.get("headers", {})}
+        for attempt in range(REPLICATE_MAX_RETRIES + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == REPLICATE_MAX_RETRIES or not (idempotent or isinstance(e, UNSENT_ERRORS)):
+                    raise ReplicateError(f"Replicate request failed: {e!r}")
+                delay = backoff(attempt)
+            else:
+                if response.status_code == 429 or (idempotent and response.status_code >= 500):
+                    if attempt == REPLICATE_MAX_RETRIES:
+                        raise ReplicateError(f"Replicate API error {response.status_code}: {response.text}",
+                                             response.status_code)
+                    delay = retry_after(response)
+                    if delay is None:
+                        delay = backoff(attempt)
+                elif response.status_code >= 400:
+                    raise ReplicateError(f"Replicate API error {response.status_code}: {response.text}",
+                                         response.status_code)
+                else:
+                    return response
+            logger.warning("Retrying Replicate %s %s in %.2fs", method, path, delay)
+            await asyncio.sleep(delay)
+
+    async def upload_file(self, file: FileInput) -> str:
+        response = await self._request("POST", "/v1/files",
+                                       files={"content": (file.filename, file.data, file.content_type)})
+        return response.json()["urls"]["get"]
+
+    async def _encode_input(self, input: Mapping[str, Any]) -> Dict[str, Any]:
+        encoded = {}
+        for key, value in input.items():
+            if isinstance(value, FileInput):
+                if len(value.data) <= REPLICATE_DATA_URI_MAX_BYTES:
+                    value = f"data:{value.content_type};base64,{base64.b64encode(value.data).decode()}"
+                else:
+                    value = await self.upload_file(value)
+            encoded[key] = value
+        return encoded
+
+    async def create_prediction(self, model: str, input: Mapping[str, Any]) -> dict:
+        # owner/name:version 按版本创建，owner/name 使用模型的最新版本
+        body: Dict[str, Any] = {"input": await self._encode_input(input)}
+        if self.webhook_url:
+            body["webhook"] = self.webhook_url
+            body["webhook_events_filter"] = ["completed"]
+        if ":" in model:
+            body["version"] = model.split(":", 1)[1]
+            path = "/v1/predictions"
+        else:
+            path = f"/v1/models/{model}/predictions"
+        return (await self._request("POST", path, json=body)).json()
+
+    async def get_prediction(self, prediction_id: str) -> dict:
+        return (await self._request("GET", f"/v1/predictions/{prediction_id}")).json()
+
+    async def cancel_prediction(self, prediction_id: str):
+        try:
+            await self._request("POST", f"/v1/predictions/{prediction_id}/cancel", idempotent=True)
+        except ReplicateError:
+            logger.warning("Failed to cancel Replicate prediction %s", prediction_id)
+
+    async def download(self, url: str) -> Tuple[bytes, str]:
+        # 下载预测输出，输出地址不在 API 域名下，不携带 API token
+        request = self.client.build_request("GET", url)
+        request.headers.pop("Authorization", None)
+        try:
+            response = await self.client.send(request)
+        except httpx.TransportError as e:
+            raise ReplicateError(f"Failed to download {url}: {e!r}")
+        if response.status_code >= 400:
+            raise ReplicateError(f"Failed to download {url}: HTTP {response.status_code}", response.status_code)
+        return response.content, response.headers.get("Content-Type", "application/octet-stream")
+
+    async def wait(self, prediction: dict) -> dict:
+        # 配置了回调时等待回调，每隔 REPLICATE_WEBHOOK_POLL_INTERVAL 秒查询一次兜底；否则按递增间隔轮询
+        prediction_id = prediction["id"]
+        waiter = None
+        if self.webhook_url:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[prediction_id] = waiter
+        try:
+            interval = FIRST_POLL_INTERVAL
+            while prediction.get("status") not in TERMINAL_STATUSES:
+                if waiter is not None:
+                    if prediction_id in self._early:
+                        return self._early.pop(prediction_id)
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(waiter), REPLICATE_WEBHOOK_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 1.5, REPLICATE_POLL_INTERVAL)
+                prediction = await self.get_prediction(prediction_id)
+            return prediction
+        finally:
+            self._waiters.pop(prediction_id, None)
+
+    def handle_webhook(self, prediction: dict):
+        # 只轮询时不接受回调
+        prediction_id = prediction.get("id")
+        if not self.webhook_url or not prediction_id or prediction.get("status") not in TERMINAL_STATUSES:
+            return
+        waiter = self._waiters.get(prediction_id)
+        if waiter is not None:
+            if not waiter.done():
+                waiter.set_result(prediction)
+            return
+        self._early[prediction_id] = prediction
+        while len(self._early) > EARLY_WEBHOOK_CACHE_SIZE:
+            self._early.popitem(last=False)
+
+    async def run(self, model: str, input: Mapping[str, Any], timeout: float = REPLICATE_PREDICTION_TIMEOUT) -> Any:
+        # 等待名额的时间不计入预测超时
+        async with self._semaphore(model):
+            with stage("replicate"):
+                prediction = await self.create_prediction(model, input)
+                try:
+                    prediction = await asyncio.wait_for(self.wait(prediction), timeout)
+                except asyncio.TimeoutError:
+                    await self.cancel_prediction(prediction["id"])
+                    raise ReplicateTimeout(f"Replicate prediction {prediction['id']} timed out after {timeout}s")
+
+        if prediction.get("status") != "succeeded":
+            raise ReplicateError(f"Replicate prediction {prediction['status']}: {prediction.get('error')}")
+        return prediction.get("output")
+
+
+def verify_webhook(headers: Mapping[str, str], body: bytes, secret: str = REPLICATE_WEBHOOK_SECRET) -> bool:
+    # Replicate 回调签名：HMAC-SHA256("{webhook-id}.{webhook-timestamp}.{body}")，密钥为 whsec_ 之后的 base64；
+    # 没有配置密钥时拒绝所有回调
+    if not secret:
+        return False
+    try:
+        webhook_id = headers["webhook-id"]
+        timestamp = headers["webhook-timestamp"]
+        signatures = headers["webhook-signature"]
+        if abs(time.time() - int(timestamp)) > WEBHOOK_TOLERANCE:
+            return False
+        key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    except (KeyError, ValueError):
+        return False
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    return any(hmac.compare_digest(expected, signature.split(",", 1)[-1]) for signature in signatures.split())
+
+
+replicate_client = ReplicateClient()
@@ -1,21 +1,49 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from starlette.middleware.sessions import SessionMiddleware
 
+from api.chat import chat_route
 from api.file import file_route
 from api.image import image_route
+from api.jobs import job_route
+from api.metrics import metrics_route
 from api.pdf import pdf_route
+from api.pipeline import pipeline_route
 from api.user import user_route
+from core.executor import pool
+from core.jobs import jobs
+from core.metrics import MetricsMiddleware
+from llm.replicate_client import replicate_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时创建进程池，退出时先取消未完成的异步任务再回收 worker
+    pool.start()
+    jobs.start()
+    yield
+    await jobs.shutdown()
+    await replicate_client.aclose()
+    pool.shutdown()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(file_route)
 app.include_router(pdf_route)
 app.include_router(image_route)
+app.include_router(pipeline_route)
+app.include_router(chat_route)
+app.include_router(job_route)
 app.include_router(user_route)
+app.include_router(metrics_route)
 
 # 添加 SessionMiddleware,
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key")
+# 最外层记录请求耗时和 Server-Timing
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == '__main__':
     load_dotenv()
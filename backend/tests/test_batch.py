@@ -0,0 +1,53 @@
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+import core.batch
+from core.batch import BatchItem
+
+
+def make_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def test_read_within_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core.batch, "BATCH_MAX_FILE_BYTES", 100)
+    path = tmp_path / "batch.zip"
+    make_zip(path, {"a.txt": b"a" * 100})
+    assert BatchItem(0, "a.txt", str(path), "a.txt").read() == b"a" * 100
+
+
+def test_zip_member_over_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core.batch, "BATCH_MAX_FILE_BYTES", 100)
+    path = tmp_path / "bomb.zip"
+    make_zip(path, {"big.txt": b"\0" * 10_000})
+    with pytest.raises(HTTPException) as error:
+        BatchItem(0, "big.txt", str(path), "big.txt").read()
+    assert error.value.status_code == 413
+
+
+def test_zip_member_with_understated_size(tmp_path, monkeypatch):
+    # 伪造 ZIP 里声明的解压大小：读取不会超出上限，在声明的大小处截断后 CRC 校验失败
+    monkeypatch.setattr(core.batch, "BATCH_MAX_FILE_BYTES", 100)
+    buffer = io.BytesIO()
+    make_zip(buffer, {"big.txt": b"\0" * 10_000})
+    data = buffer.getvalue()
+    real = (10_000).to_bytes(4, "little")
+    forged = (50).to_bytes(4, "little")
+    assert data.count(real) == 2
+    path = tmp_path / "forged.zip"
+    path.write_bytes(data.replace(real, forged))
+    with pytest.raises(zipfile.BadZipFile):
+        BatchItem(0, "big.txt", str(path), "big.txt").read()
+
+
+def test_plain_file_over_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core.batch, "BATCH_MAX_FILE_BYTES", 100)
+    path = tmp_path / "big.pdf"
+    path.write_bytes(b"x" * 101)
+    with pytest.raises(HTTPException):
+        BatchItem(0, "big.pdf", str(path)).read()
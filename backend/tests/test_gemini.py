@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import time
+
+from llm.gemini import ChatService, FakeBackend
+
+
+class SlowBackend(FakeBackend):
+    # slow 在第一个片段之后阻塞，模拟 SDK 迟迟不返回下一个片段
+    def __init__(self):
+        super().__init__({}, 0)
+        self.release = threading.Event()
+
+    def stream(self, prompt):
+        if prompt != "slow":
+            yield from super().stream(prompt)
+            return
+        self.calls += 1
+        yield "first "
+        self.release.wait(5)
+        yield "second"
+
+
+def test_concurrent_prompts_share_one_generation():
+    async def scenario():
+        backend = FakeBackend({"hi": ["a", "b", "c"]}, delay=0.02)
+        service = ChatService(backend, concurrency=4)
+        results = await asyncio.gather(*[service.complete("hi") for _ in range(3)])
+        assert results == ["abc"] * 3
+        assert await service.complete("hi") == "abc"
+        assert backend.calls == 1
+        assert service.cache.stats()["miss"] == 1
+        assert service.cache.stats()["shared"] == 2
+        assert service.cache.stats()["hit"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_releases_slot_without_waiting_for_backend():
+    async def scenario():
+        backend = SlowBackend()
+        service = ChatService(backend, concurrency=1)
+        # 客户端断开时请求任务在等待下一个片段的地方被取消
+        request = asyncio.ensure_future(service.complete("slow"))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        request.cancel()
+        # 信号量名额立即归还，其他提示词不用等 SDK 返回下一个片段
+        assert await asyncio.wait_for(service.complete("other words"), 2) == "other words "
+        assert time.monotonic() - started < 2
+        assert service.cached("slow") is None
+        backend.release.set()
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from core.jobs import Job, JobManager
+
+
+def make_manager(tmp_path) -> JobManager:
+    manager = JobManager(f"sqlite:///{tmp_path / 'jobs.db'}", str(tmp_path / "jobs"), 60, 1)
+    os.makedirs(manager.directory, exist_ok=True)
+    Job.metadata.create_all(bind=manager.engine)
+    manager._migrate()
+    return manager
+
+
+def statuses(manager: JobManager):
+    with manager.SessionLocal() as db:
+        return {job.id: job.status for job in db.query(Job)}
+
+
+def test_reap_only_dead_owners(tmp_path):
+    manager = make_manager(tmp_path)
+    now = datetime.utcnow()
+    with manager.SessionLocal() as db:
+        db.add_all([
+            Job(id="mine", status="running", owner=manager.owner, heartbeat_at=now, created_at=now),
+            # 同一进程重启前的任务：pid 相同但启动标识不同
+            Job(id="restarted", status="running", owner=f"{manager.hostname}:{os.getpid()}:old",
+                heartbeat_at=now, created_at=now),
+            Job(id="parent", status="running", owner=f"{manager.hostname}:{os.getppid()}:x",
+                heartbeat_at=now, created_at=now),
+            Job(id="remote", status="queued", owner="elsewhere:1:x", heartbeat_at=now, created_at=now),
+            Job(id="stale", status="queued", owner="elsewhere:1:y",
+                heartbeat_at=now - timedelta(days=1), created_at=now - timedelta(days=1)),
+        ])
+        db.commit()
+    manager.reap()
+    assert statuses(manager) == {"mine": "running", "restarted": "failed", "parent": "running",
+                                 "remote": "queued", "stale": "failed"}
+
+
+def test_migrate_adds_owner_columns(tmp_path):
+    path = tmp_path / "jobs.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE jobs (id VARCHAR PRIMARY KEY, operation VARCHAR, status VARCHAR, "
+                           "pages_done INTEGER, pages_total INTEGER, filename VARCHAR, media_type VARCHAR, "
+                           "error TEXT, created_at DATETIME, started_at DATETIME, finished_at DATETIME, "
+                           "expires_at DATETIME)")
+    manager = JobManager(f"sqlite:///{path}", str(tmp_path / "jobs"), 60, 1)
+    manager._migrate()
+    manager.heartbeat()
+    manager.reap()
@@ -0,0 +1,60 @@
+import gc
+import io
+import weakref
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+import api.pdf
+from api.pdf import iter_merge_pdfs, merge_pdfs
+from core.pagetree import PageRangeError
+
+
+def make_pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for index in range(pages):
+        writer.add_blank_page(width=100 + index, height=100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def page_widths(data: bytes):
+    return [int(page.mediabox.width) for page in PdfReader(io.BytesIO(data)).pages]
+
+
+@pytest.mark.parametrize("ranges, expected", [("1,1", [100, 100]), ("1-3,2", [100, 101, 102, 101])])
+def test_merge_duplicate_pages(ranges, expected):
+    output = b"".join(iter_merge_pdfs([make_pdf(3)], [(0, ranges)]))
+    assert page_widths(output) == expected
+
+
+def test_merge_same_file_twice():
+    source = make_pdf(2)
+    assert page_widths(merge_pdfs([source, source])) == [100, 101, 100, 101]
+
+
+def test_merge_validates_ranges_before_output():
+    chunks = iter_merge_pdfs([make_pdf(1), make_pdf(2)], [(0, None), (1, "5")])
+    with pytest.raises(PageRangeError):
+        next(chunks)
+
+
+def test_merge_keeps_one_reader_open(monkeypatch):
+    live = weakref.WeakSet()
+    peak = []
+    open_pdf = api.pdf.open_pdf
+
+    def tracking_open_pdf(source):
+        # 回收已经丢弃的 reader 后再统计，pypdf 的对象和 reader 之间有循环引用
+        gc.collect()
+        reader = open_pdf(source)
+        live.add(reader)
+        peak.append(len(live))
+        return reader
+
+    monkeypatch.setattr(api.pdf, "open_pdf", tracking_open_pdf)
+    sources = [make_pdf(2) for _ in range(4)]
+    output = b"".join(iter_merge_pdfs(sources, [(0, None), (1, "2"), (2, None), (3, "1"), (0, "1")]))
+    assert page_widths(output) == [100, 101, 101, 100, 101, 100, 100]
+    assert max(peak) == 1
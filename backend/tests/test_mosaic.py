@@ -0,0 +1,24 @@
+import pytest
+
+from core.mosaic import JoinDirection, compute_layout, scale_sizes
+
+
+@pytest.mark.parametrize("direction, columns", [
+    (JoinDirection.HORIZONTAL, 0), (JoinDirection.VERTICAL, 0), (JoinDirection.GRID, 0), (JoinDirection.GRID, 2),
+])
+@pytest.mark.parametrize("sizes", [
+    [(101, 33)] * 3,
+    [(333, 50), (167, 301), (95, 95)],
+    [(1000, 3)] * 120,
+])
+def test_scale_sizes_within_max_dimension(sizes, direction, columns):
+    scaled = scale_sizes(sizes, direction, columns, 250)
+    (width, height), _ = compute_layout(scaled, direction, columns)
+    assert max(width, height) <= 250
+    assert all(w >= 1 and h >= 1 for w, h in scaled)
+
+
+def test_scale_sizes_keeps_small_layouts():
+    sizes = [(100, 50), (60, 40)]
+    assert scale_sizes(sizes, JoinDirection.HORIZONTAL, 0, 250) == sizes
+    assert scale_sizes(sizes, JoinDirection.HORIZONTAL, 0, 0) == sizes
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+from api.pdf import iter_split_pdf
+from core.pagetree import iter_pages, page_count
+
+
+def make_pdf(pages: int, count=None, nested: bool = False, mixed: bool = False) -> bytes:
+    writer = PdfWriter()
+    for index in range(pages):
+        writer.add_blank_page(width=100 + index, height=100)
+    root = writer.root_object["/Pages"]
+    if nested:
+        # 根节点下分成两个中间节点，第一个节点的 /Count 写错
+        kids = list(root["/Kids"])
+        middle = []
+        for part in (kids[:2], kids[2:]):
+            node = DictionaryObject({NameObject("/Type"): NameObject("/Pages"),
+                                     NameObject("/Kids"): ArrayObject(part),
+                                     NameObject("/Count"): NumberObject(len(part))})
+            reference = writer._add_object(node)
+            for kid in part:
+                kid.get_object()[NameObject("/Parent")] = reference
+            node[NameObject("/Parent")] = root.indirect_reference
+            middle.append(reference)
+        middle[0].get_object()[NameObject("/Count")] = NumberObject(1)
+        root[NameObject("/Kids")] = ArrayObject(middle)
+    if mixed:
+        # 根节点 /Count=2、Kids=[中间节点(Count=2), 页面]，子节点数与 /Count 相等，实际有 3 页
+        kids = list(root["/Kids"])
+        node = DictionaryObject({NameObject("/Type"): NameObject("/Pages"),
+                                 NameObject("/Kids"): ArrayObject(kids[:2]),
+                                 NameObject("/Count"): NumberObject(2),
+                                 NameObject("/Parent"): root.indirect_reference})
+        reference = writer._add_object(node)
+        for kid in kids[:2]:
+            kid.get_object()[NameObject("/Parent")] = reference
+        root[NameObject("/Kids")] = ArrayObject([reference, kids[2]])
+        root[NameObject("/Count")] = NumberObject(2)
+    if count is not None:
+        root[NameObject("/Count")] = NumberObject(count)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def reader(data: bytes) -> PdfReader:
+    return PdfReader(io.BytesIO(data))
+
+
+def test_page_count_trusts_consistent_count():
+    assert page_count(reader(make_pdf(5))) == 5
+
+
+@pytest.mark.parametrize("data", [make_pdf(5, count=3), make_pdf(5, nested=True)])
+def test_page_count_walks_inconsistent_tree(data):
+    assert page_count(reader(data)) == 5
+    assert [int(page.mediabox.width) for page in iter_pages(reader(data), [4, 1])] == [104, 101]
+
+
+def test_split_keeps_pages_beyond_count():
+    names = [name for name, _ in iter_split_pdf(make_pdf(5, count=3), 2)]
+    assert names == ["split_1-2.pdf", "split_3-4.pdf", "split_5-5.pdf"]
+
+
+def test_count_equal_to_kids_with_intermediate_node():
+    data = make_pdf(3, mixed=True)
+    assert page_count(reader(data)) == 3
+    assert [int(page.mediabox.width) for page in iter_pages(reader(data), [2, 1])] == [102, 101]
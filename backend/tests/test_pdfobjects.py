@@ -0,0 +1,54 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject, NullObject
+
+from core.compress import remove_duplicate_streams, remove_orphans
+from core.pdfobjects import iter_objects, replace_object, trailer_references
+
+
+def make_writer() -> PdfWriter:
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    return writer
+
+
+def add_stream(writer: PdfWriter, data: bytes):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return writer._add_object(stream)
+
+
+def test_iter_objects_and_replace_object():
+    writer = make_writer()
+    reference = add_stream(writer, b"unused")
+    objects = dict(iter_objects(writer))
+    assert reference.idnum in objects
+
+    replace_object(writer, reference.idnum, NullObject())
+    assert isinstance(dict(iter_objects(writer))[reference.idnum], NullObject)
+
+
+def test_trailer_references():
+    writer = make_writer()
+    references = trailer_references(writer)
+    assert references[0].get_object() is writer.root_object
+    assert all(reference.idnum in dict(iter_objects(writer)) for reference in references)
+
+
+def test_remove_orphans_and_duplicates_roundtrip():
+    writer = make_writer()
+    orphan = add_stream(writer, b"orphan")
+    first, second = add_stream(writer, b"same"), add_stream(writer, b"same")
+    page = writer.pages[0]
+    page[NameObject("/Contents")] = first
+    page[NameObject("/Extra")] = second
+
+    assert remove_duplicate_streams(writer) > 0
+    assert page.raw_get("/Extra").idnum == first.idnum
+    assert remove_orphans(writer) > 0
+    assert isinstance(dict(iter_objects(writer))[orphan.idnum], NullObject)
+
+    output = io.BytesIO()
+    writer.write(output)
+    assert len(PdfReader(output).pages) == 1
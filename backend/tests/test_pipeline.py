@@ -0,0 +1,44 @@
+import threading
+
+from core.pipeline import Step, run_steps
+
+
+def test_outputs_serialized_before_consumers_run():
+    steps = [Step("a", "op", ["file:0"]), Step("b", "op", ["a"]), Step("c", "op", ["a"])]
+    serialized = set()
+    lock = threading.Lock()
+
+    def execute(step, inputs, shared):
+        # 下游节点开始执行时，它用到的输出节点必须已经序列化完毕
+        with lock:
+            assert all(ref in serialized for ref in step.inputs if ref == "a")
+        return [step.id]
+
+    def serialize(step_id, documents):
+        with lock:
+            serialized.add(step_id)
+        return f"{step_id}:{','.join(documents)}"
+
+    results = dict(run_steps(steps, ["a", "b", "c"], lambda index: ["source"], execute, serialize, threads=4))
+    assert results == {"a": "a:a", "b": "b:b", "c": "c:c"}
+
+
+def test_outputs_without_serialize():
+    steps = [Step("a", "op", ["file:0"]), Step("b", "op", ["a"])]
+    results = dict(run_steps(steps, ["a", "b"], lambda index: ["source"],
+                             lambda step, inputs, shared: [step.id] + inputs[0]))
+    assert results == {"a": ["a", "source"], "b": ["b", "a", "source"]}
+
+
+def test_independent_branches_overlap():
+    # 两个分支都在屏障处等待对方，只有同时运行才能通过
+    steps = [Step("a", "op", ["file:0"]), Step("b", "op", ["file:0"])]
+    barrier = threading.Barrier(2, timeout=5)
+
+    def execute(step, inputs, shared):
+        barrier.wait()
+        return [step.id]
+
+    results = dict(run_steps(steps, ["a", "b"], lambda index: ["source"], execute, threads=2))
+    assert results == {"a": ["a"], "b": ["b"]}
+
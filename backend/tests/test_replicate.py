@@ -0,0 +1,101 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import httpx
+import pytest
+
+import llm.replicate_client
+from llm.replicate_client import ReplicateClient, ReplicateTimeout, verify_webhook
+
+SECRET = "whsec_" + base64.b64encode(b"test-secret").decode()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm.replicate_client, "REPLICATE_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(llm.replicate_client, "FIRST_POLL_INTERVAL", 0.01)
+
+
+def make_client(handler) -> ReplicateClient:
+    return ReplicateClient(base_url="http://replicate.test", token="token", transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retry_reuses_idempotency_key(status):
+    # 429 对所有请求重试；5xx 只对幂等请求重试，取消预测是幂等的
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        assert request.url.host == "replicate.test"
+        if len(requests) < 3:
+            return httpx.Response(status, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={})
+
+    async def scenario():
+        client = make_client(handler)
+        if status == 429:
+            await client.create_prediction("owner/model", {"prompt": "hi"})
+        else:
+            await client._request("POST", "/v1/predictions/p1/cancel", idempotent=True)
+        await client.aclose()
+
+    asyncio.run(scenario())
+    keys = {request.headers["Idempotency-Key"] for request in requests}
+    assert len(requests) == 3 and len(keys) == 1
+
+
+def test_create_prediction_not_retried_on_server_error():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(503)
+
+    async def scenario():
+        client = make_client(handler)
+        with pytest.raises(llm.replicate_client.ReplicateError):
+            await client.create_prediction("owner/model", {"prompt": "hi"})
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert len(requests) == 1
+
+
+def test_timeout_cancels_prediction():
+    paths = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        paths.append((request.method, request.url.path))
+        return httpx.Response(200, json={"id": "p1", "status": "processing"})
+
+    async def scenario():
+        client = make_client(handler)
+        with pytest.raises(ReplicateTimeout):
+            await client.run("owner/model", {"prompt": "hi"}, timeout=0.1)
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert paths[0] == ("POST", "/v1/models/owner/model/predictions")
+    assert paths[-1] == ("POST", "/v1/predictions/p1/cancel")
+
+
+def sign(body: bytes, timestamp: int, webhook_id: str = "msg_1") -> dict:
+    key = base64.b64decode(SECRET.split("_", 1)[1])
+    digest = hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return {"webhook-id": webhook_id, "webhook-timestamp": str(timestamp),
+            "webhook-signature": "v1," + base64.b64encode(digest).decode()}
+
+
+def test_webhook_signature():
+    body = json.dumps({"id": "p1", "status": "succeeded"}).encode()
+    now = int(time.time())
+    assert verify_webhook(sign(body, now), body, SECRET)
+    assert not verify_webhook(sign(body, now), body + b" ", SECRET)
+    assert not verify_webhook({**sign(body, now), "webhook-signature": "v1,AAAA"}, body, SECRET)
+    assert not verify_webhook(sign(body, now - 3600), body, SECRET)
+    assert not verify_webhook(sign(body, now), body, "")
@@ -0,0 +1,35 @@
+import mmap
+import pickle
+from multiprocessing.reduction import ForkingPickler
+from tempfile import SpooledTemporaryFile
+
+from starlette.datastructures import UploadFile
+
+from core.uploads import read_upload_bytes
+
+
+def make_upload(data: bytes, max_size: int) -> UploadFile:
+    spool = SpooledTemporaryFile(max_size=max_size)
+    spool.write(data)
+    return UploadFile(spool, filename="upload.bin")
+
+
+def test_in_memory_upload_is_bytes():
+    assert read_upload_bytes(make_upload(b"small", 1024)) == b"small"
+
+
+def test_rolled_upload_is_mapped():
+    data = b"x" * 4096
+    upload = make_upload(data, 16)
+    mapped = read_upload_bytes(upload)
+    assert isinstance(mapped, mmap.mmap)
+    # 上传文件关闭后映射仍然可读，传给 worker 时转成 bytes
+    upload.file.close()
+    assert mapped[:] == data
+    assert pickle.loads(ForkingPickler.dumps(mapped)) == data
+
+
+def test_empty_rolled_upload():
+    upload = make_upload(b"", 16)
+    upload.file.rollover()
+    assert read_upload_bytes(upload) == b""